@@ -0,0 +1,225 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENSE BLOCK #####
+# Copyright © 2023, OpheliaComplex.
+
+# Headless batch export. Spreads .blend files over a pool of background blender processes, every worker
+# opens its files one after another and exports the active scene of each, so blender only starts once per worker:
+#   python -m SMPRigidBodies.SMPBatch "outfits/*.blend" -o xmls --workers 4 --report report.json
+# Both Rigid Body Bones and SMPRigidBodies have to be installed in that blender.
+
+import argparse
+import glob
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+
+# Workers print one line starting with this per exported file
+RESULT_MARKER = "SMP_BATCH_RESULT "
+
+# Run by every blender worker, the package is put on sys.path in case it is not installed as an add-on
+WORKER_EXPR = "import sys; sys.path.insert(0, {package_parent!r}); " \
+              "from SMPRigidBodies.SMPBatch import worker_main; worker_main()"
+
+def _ensure_registered():
+    # The add-on registers the SMP properties on objects and bones, without them nothing can be read
+    import bpy
+    if not hasattr(bpy.types.Object, "smp_tag"):
+        import SMPRigidBodies
+        SMPRigidBodies.register()
+
+def worker_main():
+    # Inside blender: read jobs as json lines from stdin, answer every job with a RESULT_MARKER line
+    import bpy
+    from SMPRigidBodies.SMP_Core_Classes import SMPError
+    from SMPRigidBodies.SMPUtils import parse_scene, write_xml
+
+    for line in sys.stdin:
+        job = json.loads(line)
+        result = {"blend": job["blend"], "xml": job["xml"], "ok": False, "error": None}
+        start = time.perf_counter()
+        try:
+            _ensure_registered()
+            bpy.ops.wm.open_mainfile(filepath=job["blend"])
+            loaded = time.perf_counter()
+            write_xml(job["xml"], parse_scene(bpy.context.scene))
+            result["ok"] = True
+            result["export_seconds"] = time.perf_counter() - loaded
+        except SMPError as e:
+            result["error"] = e.message
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+        result["seconds"] = time.perf_counter() - start
+        print(RESULT_MARKER + json.dumps(result), flush=True)
+
+
+class BlenderWorker():
+    """One background blender process, fed one job at a time"""
+
+    def __init__(self, blender, verbose=False):
+        self.blender = blender
+        self.verbose = verbose
+        self.process = None
+
+    def start(self):
+        package_parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.process = subprocess.Popen(
+            [self.blender, "-b", "--python-expr", WORKER_EXPR.format(package_parent=package_parent)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=None if self.verbose else subprocess.DEVNULL,
+            text=True,
+            bufsize=1,
+        )
+
+    def run(self, blend, xml):
+        try:
+            if self.process is None or self.process.poll() is not None:
+                self.start()
+            self.process.stdin.write(json.dumps({"blend": blend, "xml": xml}) + "\n")
+            self.process.stdin.flush()
+        except OSError as e:
+            return {"blend": blend, "xml": xml, "ok": False, "seconds": None,
+                    "error": f"could not run {self.blender}: {e}"}
+        # Blender prints plenty of its own, skip to our answer
+        for line in self.process.stdout:
+            if line.startswith(RESULT_MARKER):
+                return json.loads(line[len(RESULT_MARKER):])
+            if self.verbose:
+                print(line, end="")
+        # Blender died on this file, the next job gets a new process
+        self.process.wait()
+        return {"blend": blend, "xml": xml, "ok": False, "seconds": None,
+                "error": f"blender exited with code {self.process.returncode}"}
+
+    def close(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.stdin.close()
+            self.process.wait()
+
+
+def batch_export(jobs, blender="blender", workers=1, verbose=False):
+    # jobs is a list of (blend path, xml path), returns one result dict per job in the same order
+    pending = queue.Queue()
+    for i, job in enumerate(jobs):
+        pending.put((i, job))
+    results = [None] * len(jobs)
+
+    def work():
+        worker = BlenderWorker(blender, verbose)
+        try:
+            while True:
+                try:
+                    i, (blend, xml) = pending.get_nowait()
+                except queue.Empty:
+                    return
+                wall_start = time.perf_counter()
+                result = worker.run(blend, xml)
+                result["wall_seconds"] = time.perf_counter() - wall_start
+                results[i] = result
+                print(f"{'OK   ' if result['ok'] else 'ERROR'} {blend}" +
+                      ("" if result["ok"] else f": {result['error']}"), flush=True)
+        finally:
+            worker.close()
+
+    threads = [threading.Thread(target=work) for _ in range(max(1, min(workers, len(jobs))))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def collect_jobs(inputs, output_dir=None, list_file=None):
+    # .blend paths or globs, exported next to the .blend or into output_dir.
+    # list_file has one "<blend path><TAB><xml path>" per line.
+    # Raises ValueError if different .blends would be exported to the same .xml
+    jobs = []
+    for pattern in inputs:
+        blends = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for blend in blends:
+            xml = os.path.splitext(blend)[0] + ".xml"
+            if output_dir is not None:
+                xml = os.path.join(output_dir, os.path.basename(xml))
+            jobs.append((os.path.abspath(blend), os.path.abspath(xml)))
+    if list_file is not None:
+        with open(list_file) as f:
+            for line in f:
+                line = line.rstrip("\n")
+                if not line.strip() or line.startswith("#"):
+                    continue
+                blend, xml = line.split("\t")
+                jobs.append((os.path.abspath(blend), os.path.abspath(xml)))
+
+    # A .blend matched twice is exported once
+    jobs = list(dict.fromkeys(jobs))
+    blends = {}
+    for blend, xml in jobs:
+        blends.setdefault(os.path.normcase(xml), []).append(blend)
+    clashes = [f"{xml}: {', '.join(same_xml)}" for xml, same_xml in blends.items() if len(same_xml) > 1]
+    if clashes:
+        raise ValueError("these .blend files would be exported to the same .xml, use --list to name them:\n" +
+                         "\n".join(clashes))
+    return jobs
+
+def summarize(results, wall_seconds):
+    failed = [r for r in results if not r["ok"]]
+    timed = [r for r in results if r["ok"]]
+    lines = [f"{len(results) - len(failed)}/{len(results)} exported in {wall_seconds:.1f}s"]
+    if timed:
+        slowest = max(timed, key=lambda r: r["seconds"])
+        lines.append(f"slowest: {slowest['blend']} ({slowest['seconds']:.2f}s)")
+    for r in failed:
+        lines.append(f"failed: {r['blend']}: {r['error']}")
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export SMP .xmls from many .blend files with background blenders")
+    parser.add_argument("inputs", nargs="*", help=".blend files or glob patterns")
+    parser.add_argument("-o", "--output-dir", help="directory for the .xmls, default is next to each .blend")
+    parser.add_argument("--list", dest="list_file", help="file with one '<blend><TAB><xml>' pair per line")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="number of blender processes, default: number of cpus")
+    parser.add_argument("--blender", default=os.environ.get("BLENDER", "blender"),
+                        help="blender executable, default: $BLENDER or 'blender'")
+    parser.add_argument("--report", help="write per-file timing and errors as json")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show blender's output")
+    args = parser.parse_args(argv)
+
+    try:
+        jobs = collect_jobs(args.inputs, args.output_dir, args.list_file)
+    except ValueError as e:
+        parser.error(str(e))
+    if not jobs:
+        parser.error("no .blend files given")
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    results = batch_export(jobs, args.blender, args.workers, args.verbose)
+    wall_seconds = time.perf_counter() - start
+
+    print(summarize(results, wall_seconds))
+    if args.report is not None:
+        with open(args.report, "w") as f:
+            json.dump({"wall_seconds": wall_seconds, "workers": args.workers, "files": results}, f, indent=2)
+    return 0 if all(r["ok"] for r in results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENSE BLOCK #####
+# Copyright © 2023, OpheliaComplex.
+
+# Incremental export. Between exports the depsgraph handlers below collect which objects changed, the next
+# export only captures those again (records) and only regenerates the xml of records whose properties
+# changed (fragments). Everything else is reused from the previous export.
+
+import bpy
+from bpy.app.handlers import persistent
+from SMPRigidBodies.SMP_Core_Classes import strip_rbb_suffix, record_key
+
+
+class SMPFragmentCache():
+    """Records by object and xml fragments by record properties, kept from one export to the next"""
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # as_pointer() of the object -> captured record
+        self.records = {}
+        # record_key -> xml fragment
+        self.fragments = {}
+        # Filled during an export, replaces the above when it finishes so entries of deleted objects go away
+        self.next_records = {}
+        self.next_fragments = {}
+        # Changed since the last export, see on_depsgraph_update
+        self.dirty_objects = set()
+        self.dirty_armatures = set()
+        # The tag presets of the last export, and of the one running
+        self.presets = None
+        self.next_presets = None
+        self.hits = 0
+        self.misses = 0
+
+    def mark_dirty(self, obj):
+        self.dirty_objects.add(obj.as_pointer())
+
+    def mark_armature_dirty(self, armature_name):
+        # Kinematic bones also read the extra props of their armature bone
+        self.dirty_armatures.add(armature_name)
+
+    def begin_capture(self):
+        self.next_records = {}
+
+    def cached_record(self, obj, armature_name=None):
+        # The record captured for obj by the last export, None if it has to be captured again
+        pointer = obj.as_pointer()
+        if pointer in self.dirty_objects or armature_name in self.dirty_armatures:
+            return None
+        record = self.records.get(pointer)
+        if record is not None:
+            self.next_records[pointer] = record
+        return record
+
+    def cached_constraint(self, obj):
+        # Renaming a body doesn't update the joint object, check the body names as well
+        record = self.cached_record(obj)
+        if record is None:
+            return None
+        constraint = obj.rigid_body_constraint
+        if record.bodyA != strip_rbb_suffix(constraint.object1.name) or \
+                record.bodyB != strip_rbb_suffix(constraint.object2.name):
+            return None
+        return record
+
+    def presets_changed(self, presets):
+        # True if presets differ from the tag presets of the last export
+        self.next_presets = presets
+        return presets != self.presets
+
+    def store_record(self, obj, record):
+        self.next_records[obj.as_pointer()] = record
+        return record
+
+    def end_capture(self):
+        self.records = self.next_records
+        self.next_records = {}
+        self.presets = self.next_presets
+        self.dirty_objects.clear()
+        self.dirty_armatures.clear()
+
+    def begin_fragments(self):
+        self.next_fragments = {}
+        self.hits = 0
+        self.misses = 0
+
+    def iter_fragments(self, records, generate, keys=None):
+        # Yields one fragment per record. generate(records) must yield one fragment per record as well,
+        # it is only given the records that have no cached fragment.
+        # keys replace record_key for fragments that also depend on something besides their record
+        if keys is None:
+            keys = [record_key(record) for record in records]
+        fragments = [self.fragments.get(key) for key in keys]
+        generated = generate([record for record, fragment in zip(records, fragments) if fragment is None])
+        for key, fragment in zip(keys, fragments):
+            if fragment is None:
+                fragment = next(generated)
+                self.misses += 1
+            else:
+                self.hits += 1
+            self.next_fragments[key] = fragment
+            yield fragment
+
+    def end_fragments(self):
+        self.fragments = self.next_fragments
+        self.next_fragments = {}
+
+
+# The cache used by the export operator
+fragment_cache = SMPFragmentCache()
+
+@persistent
+def on_depsgraph_update(scene, depsgraph):
+    for update in depsgraph.updates:
+        id_data = update.id.original
+        if isinstance(id_data, bpy.types.Object):
+            fragment_cache.mark_dirty(id_data)
+        elif isinstance(id_data, bpy.types.Armature):
+            fragment_cache.mark_armature_dirty(id_data.name)
+
+@persistent
+def on_reset(*args):
+    # Loading a file or undoing can reallocate every object, nothing cached is safe to reuse
+    fragment_cache.clear()
+
+# Handler lists and the functions registered into them
+handlers = (
+    (bpy.app.handlers.depsgraph_update_post, on_depsgraph_update),
+    (bpy.app.handlers.load_post, on_reset),
+    (bpy.app.handlers.undo_post, on_reset),
+    (bpy.app.handlers.redo_post, on_reset),
+)
+
+def register_handlers():
+    for handler_list, handler in handlers:
+        if handler not in handler_list:
+            handler_list.append(handler)
+
+def unregister_handlers():
+    for handler_list, handler in handlers:
+        if handler in handler_list:
+            handler_list.remove(handler)
+    fragment_cache.clear()
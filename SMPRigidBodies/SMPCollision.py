@@ -0,0 +1,364 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENSE BLOCK #####
+# Copyright © 2023, OpheliaComplex.
+
+# Estimates how much collision work the exported shapes cause in game. SMP tests every element (vertex
+# sphere or triangle) of a shape against every element of each shape it may collide with, so the cost of a
+# pair is the product of their element counts and the total is the sum over all pairs that can collide.
+# This is the worst case before SMP's broadphase, good for comparing setups, not an absolute frame time.
+#
+# Within one .xml a pair of shapes can collide unless:
+#   - either shape has the other's tag in its no-collide-with-tag list
+#   - either shape has a can-collide-with-tag list without the other's tag
+#   - both are per-triangle shapes, SMP doesn't collide triangles with triangles
+#   - either is 'external', those only collide with shapes of other systems
+#
+# SMPTagMatrix evaluates these rules for all shapes at once with tags and shapes as bits of python ints,
+# which also tells which tag rules change nothing and can be left out of the .xml.
+
+import numpy as np
+from SMPRigidBodies.SMP_Core_Classes import SMPCollisionShape
+
+def shapes_compatible(a, b):
+    # The parts of can_collide that don't depend on tags
+    if a.collision_mesh_type == "triangle" and b.collision_mesh_type == "triangle":
+        return False
+    if a.collision_mesh_privacy == "external" or b.collision_mesh_privacy == "external":
+        return False
+    return True
+
+def can_collide(a, b):
+    if not shapes_compatible(a, b):
+        return False
+    if b.tag in a.no_collide_with_tags or a.tag in b.no_collide_with_tags:
+        return False
+    if a.collide_with_tags and b.tag not in a.collide_with_tags:
+        return False
+    if b.collide_with_tags and a.tag not in b.collide_with_tags:
+        return False
+    return True
+
+def mesh_counts(mesh):
+    # (vertices, triangles) of a mesh, read in bulk with foreach_get
+    loop_totals = np.empty(len(mesh.polygons), dtype=np.int32)
+    mesh.polygons.foreach_get("loop_total", loop_totals)
+    # An n-gon is n - 2 triangles
+    return len(mesh.vertices), int((loop_totals - 2).sum())
+
+def mesh_element_counts(obj, depsgraph):
+    # (vertices, triangles) of the evaluated mesh of obj
+    obj_eval = obj.evaluated_get(depsgraph)
+    mesh = obj_eval.to_mesh()
+    try:
+        return mesh_counts(mesh)
+    finally:
+        obj_eval.to_mesh_clear()
+
+def vertex_weights(obj, depsgraph):
+    # (vertex count, vertex indices, vertex group indices, weights) of the evaluated mesh of obj, one entry
+    # per weight of a vertex in a group. Blender has no flat accessor for vertex group weights, every
+    # vertex's group list is read with foreach_get into one flat array
+    obj_eval = obj.evaluated_get(depsgraph)
+    mesh = obj_eval.to_mesh()
+    try:
+        vertex_count = len(mesh.vertices)
+        vertex_groups = [vertex.groups for vertex in mesh.vertices]
+        counts = np.fromiter(map(len, vertex_groups), dtype=np.int64, count=vertex_count)
+        ends = np.cumsum(counts)
+        groups = np.empty(int(ends[-1]) if vertex_count else 0, dtype=np.int32)
+        weights = np.empty(len(groups), dtype=np.float32)
+        for elements, end, count in zip(vertex_groups, ends.tolist(), counts.tolist()):
+            if count:
+                elements.foreach_get("group", groups[end - count:end])
+                elements.foreach_get("weight", weights[end - count:end])
+    finally:
+        obj_eval.to_mesh_clear()
+    vertices = np.repeat(np.arange(vertex_count, dtype=np.int64), counts)
+    return vertex_count, vertices, groups.astype(np.int64), weights.astype(np.float64)
+
+class SMPWeightThresholdPreview():
+    """Vertices of a per-vertex shape SMP keeps with the shape's weight thresholds: those with a weight above
+       the threshold of its bone, every bone without a threshold keeps any weight above 0"""
+    __slots__ = ("name", "vertex_count", "kept", "emptied_bones", "bone_vertices")
+
+    def __init__(self, name, vertex_count, vertices, groups, weights, group_names, weight_thresholds):
+        self.name = name
+        self.vertex_count = vertex_count
+        index = {group_name: i for i, group_name in enumerate(group_names)}
+        thresholds = np.zeros(len(group_names))
+        for bone, weight in weight_thresholds:
+            if bone in index:
+                thresholds[index[bone]] = weight
+        weighted = weights > 0.0
+        above = weights > thresholds[groups]
+        keep = np.zeros(vertex_count, dtype=bool)
+        keep[vertices[above]] = True
+        self.kept = int(keep.sum())
+        before = np.bincount(groups[weighted], minlength=len(group_names))
+        after = np.bincount(groups[above], minlength=len(group_names))
+        # Bones that lose every vertex they had
+        self.emptied_bones = [group_names[i] for i in np.nonzero((before > 0) & (after == 0))[0]]
+        # bone -> (vertices before, after), of the bones weighting any vertex
+        self.bone_vertices = {group_names[i]: (int(before[i]), int(after[i])) for i in np.nonzero(before)[0]}
+
+    def summary(self):
+        line = f"{self.name}: {self.kept} of {self.vertex_count} collision vertices kept"
+        if self.emptied_bones:
+            line += f", {len(self.emptied_bones)} bones left without vertices: " + ", ".join(self.emptied_bones[:5])
+        return line
+
+
+def preview_weight_thresholds(shape, obj, depsgraph):
+    # SMPWeightThresholdPreview of a shape and the blender object it was captured from
+    vertex_count, vertices, groups, weights = vertex_weights(obj, depsgraph)
+    return SMPWeightThresholdPreview(shape.name, vertex_count, vertices, groups, weights,
+                                     [group.name for group in obj.vertex_groups], shape.weight_thresholds)
+
+
+def shape_element_count(shape, counts):
+    # counts: (vertices, triangles) of the shape's mesh. What SMP collides with depends on the shape type
+    vertex_count, triangle_count = counts
+    return triangle_count if shape.collision_mesh_type == "triangle" else vertex_count
+
+
+def _bits(mask):
+    # Indices of the set bits of an int
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+def _dedupe(tags):
+    return list(dict.fromkeys(tags))
+
+
+class SMPTagMatrix():
+    """Collision rules of a set of shapes as integer bitsets.
+
+       Every tag gets a bit, shapes' tags first, then tags that only appear in rules. allowed[i] is the tag
+       mask shape i accepts, rows[i] the mask of shapes (bit j = shapes[j]) shape i can collide with and
+       tag_rows[t] the mask of tags that tag t collides with through at least one pair of shapes"""
+
+    # Shapes with this privacy only ever meet shapes of the same .xml
+    CLOSED_PRIVACY = frozenset(("private",))
+
+    def __init__(self, shapes):
+        self.shapes = shapes
+        self.tags = []
+        self.tag_bits = {}
+        for shape in shapes:
+            self._tag_bit(shape.tag)
+        # Tags some exported shape actually has
+        self.used_tags = (1 << len(self.tags)) - 1
+        for shape in shapes:
+            for tag in shape.no_collide_with_tags + shape.collide_with_tags:
+                self._tag_bit(tag)
+        self.all_tags = (1 << len(self.tags)) - 1
+
+        n = len(shapes)
+        self.shape_tags = [self.tag_bits[shape.tag] for shape in shapes]
+        self.allowed = [self.allowed_mask(shape.collide_with_tags, shape.no_collide_with_tags) for shape in shapes]
+        # tag -> shapes with that tag
+        self.shapes_with_tag = [0] * len(self.tags)
+        for i, tag in enumerate(self.shape_tags):
+            self.shapes_with_tag[tag] |= 1 << i
+        # tag -> shapes that accept that tag
+        self.accepting = [0] * len(self.tags)
+        for i, allowed in enumerate(self.allowed):
+            for tag in _bits(allowed):
+                self.accepting[tag] |= 1 << i
+        # Shapes that could collide going by type and privacy alone, grouped since there are only a few kinds
+        kinds = {}
+        for i, shape in enumerate(shapes):
+            kinds.setdefault((shape.collision_mesh_type, shape.collision_mesh_privacy), [shape, 0])[1] |= 1 << i
+        self.compatible = [0] * n
+        for shape_a, mask_a in kinds.values():
+            for shape_b, mask_b in kinds.values():
+                if shapes_compatible(shape_a, shape_b):
+                    for i in _bits(mask_a):
+                        self.compatible[i] |= mask_b
+        for i in range(n):
+            self.compatible[i] &= ~(1 << i)
+
+        self.rows = [self.row(i, self.allowed[i]) for i in range(n)]
+        self.tag_rows = [0] * len(self.tags)
+        for i, row in enumerate(self.rows):
+            for j in _bits(row):
+                self.tag_rows[self.shape_tags[i]] |= 1 << self.shape_tags[j]
+
+    def _tag_bit(self, tag):
+        if tag not in self.tag_bits:
+            self.tag_bits[tag] = len(self.tags)
+            self.tags.append(tag)
+        return self.tag_bits[tag]
+
+    def allowed_mask(self, collide_with_tags, no_collide_with_tags):
+        mask = self.all_tags
+        if collide_with_tags:
+            mask = 0
+            for tag in collide_with_tags:
+                mask |= 1 << self.tag_bits[tag]
+        for tag in no_collide_with_tags:
+            mask &= ~(1 << self.tag_bits[tag])
+        return mask
+
+    def row(self, i, allowed):
+        # Shapes that shape i collides with if it accepted the tags in allowed
+        shapes = 0
+        for tag in _bits(allowed & self.used_tags):
+            shapes |= self.shapes_with_tag[tag]
+        return self.compatible[i] & shapes & self.accepting[self.shape_tags[i]]
+
+    def pair_count(self):
+        return sum(bin(row).count("1") for row in self.rows) // 2
+
+    def prune_rules(self, closed_world=False):
+        # Drops duplicate tags and tag rules that don't change which pairs collide.
+        # Rules can also matter against shapes of other .xmls (the body, other outfits), so besides duplicates
+        # only rules of shapes that can't meet those are dropped, unless closed_world says this .xml is all
+        # there is. Returns new shape records (the originals may be cached) and (shape, element, tag) of
+        # everything dropped
+        shapes = []
+        dropped = []
+        for i, shape in enumerate(self.shapes):
+            no_collide = _dedupe(shape.no_collide_with_tags)
+            collide = _dedupe(shape.collide_with_tags)
+            for tag in self._removed(shape.no_collide_with_tags):
+                dropped.append((shape.name, "no-collide-with-tag", tag))
+            for tag in self._removed(shape.collide_with_tags):
+                dropped.append((shape.name, "can-collide-with-tag", tag))
+
+            if closed_world or shape.collision_mesh_privacy in self.CLOSED_PRIVACY:
+                for tag in list(no_collide):
+                    remaining = [t for t in no_collide if t != tag]
+                    if self._try_rules(i, collide, remaining):
+                        no_collide = remaining
+                        dropped.append((shape.name, "no-collide-with-tag", tag))
+                for tag in list(collide):
+                    # An empty list means colliding with everything, the last one always stays
+                    remaining = [t for t in collide if t != tag]
+                    if remaining and self._try_rules(i, remaining, no_collide):
+                        collide = remaining
+                        dropped.append((shape.name, "can-collide-with-tag", tag))
+
+            shapes.append(SMPCollisionShape(
+                name=shape.name, tag=shape.tag, collision_mesh_type=shape.collision_mesh_type,
+                collision_mesh_privacy=shape.collision_mesh_privacy, margin=shape.margin,
+                penetration=shape.penetration, no_collide_with_tags=no_collide, collide_with_tags=collide,
+                weight_thresholds=shape.weight_thresholds))
+        return shapes, dropped
+
+    @staticmethod
+    def _removed(tags):
+        # The duplicate occurrences _dedupe dropped
+        seen = set()
+        removed = []
+        for tag in tags:
+            if tag in seen:
+                removed.append(tag)
+            seen.add(tag)
+        return removed
+
+    def _try_rules(self, i, collide, no_collide):
+        # Switch shape i to these rules if that keeps its collisions the same
+        allowed = self.allowed_mask(collide, no_collide)
+        if self.row(i, allowed) != self.rows[i]:
+            return False
+        for tag in _bits(allowed ^ self.allowed[i]):
+            self.accepting[tag] ^= 1 << i
+        self.allowed[i] = allowed
+        return True
+
+    def format(self, dropped=()):
+        used = list(_bits(self.used_tags))
+        width = max([len(self.tags[t]) for t in used] + [3])
+        lines = [f"Tag collision matrix, {len(self.shapes)} shapes, {self.pair_count()} colliding pairs:"]
+        lines.append(" " * (width + 1) + " ".join(self.tags[t][:3].ljust(3) for t in used))
+        for t in used:
+            cells = " ".join((" x " if self.tag_rows[t] >> u & 1 else " . ") for u in used)
+            lines.append(f"{self.tags[t]:<{width}} {cells}")
+        unused = [self.tags[t] for t in _bits(self.all_tags & ~self.used_tags)]
+        if unused:
+            lines.append("Tags in rules that no exported shape has: " + ", ".join(unused))
+        if dropped:
+            lines.append(f"Dropped {len(dropped)} rules without effect:")
+            for name, element, tag in dropped:
+                lines.append(f"    {name}: <{element}>{tag}</{element}>")
+        return "\n".join(lines)
+
+
+class SMPCollisionReport():
+    """Estimated collision work of a set of shapes"""
+    __slots__ = ("shapes", "element_counts", "pairs", "shape_costs", "total")
+
+    def __init__(self, shapes, element_counts, matrix=None):
+        # shapes: SMPCollisionShape records, element_counts: name -> element count,
+        # matrix: the SMPTagMatrix of shapes if there already is one
+        self.shapes = shapes
+        self.element_counts = element_counts
+        if matrix is None:
+            matrix = SMPTagMatrix(shapes)
+        n = len(shapes)
+        elements = np.array([element_counts.get(shape.name, 0) for shape in shapes], dtype=np.float64)
+        collides = np.zeros((n, n), dtype=bool)
+        for i, row in enumerate(matrix.rows):
+            for j in _bits(row >> (i + 1)):
+                collides[i, i + 1 + j] = True
+        # Element pairs tested per frame for every shape pair that can collide
+        pair_costs = np.outer(elements, elements) * collides
+        rows, cols = np.nonzero(pair_costs)
+        self.pairs = sorted(((shapes[i].name, shapes[j].name, float(pair_costs[i, j])) for i, j in zip(rows, cols)),
+                            key=lambda pair: pair[2], reverse=True)
+        # Each pair's cost counts towards both of its shapes
+        per_shape = pair_costs.sum(axis=0) + pair_costs.sum(axis=1)
+        self.shape_costs = sorted(((shape.name, float(cost)) for shape, cost in zip(shapes, per_shape)),
+                                  key=lambda item: item[1], reverse=True)
+        self.total = float(pair_costs.sum())
+
+    def top_offenders(self, top=5):
+        return [(name, cost) for name, cost in self.shape_costs[:top] if cost > 0]
+
+    def summary(self, top=3):
+        # One line for the operator report
+        offenders = ", ".join(f"{name} {cost / self.total:.0%}" for name, cost in self.top_offenders(top)) \
+            if self.total else "none"
+        return (f"Collision cost: ~{self.total:,.0f} element tests per frame over {len(self.pairs)} shape pairs, "
+                f"shapes involved in most of it: {offenders}")
+
+    def format(self, top=10):
+        lines = [self.summary(top)]
+        lines.append("Shapes:")
+        for name, cost in self.top_offenders(top):
+            lines.append(f"    {name:<40} {self.element_counts.get(name, 0):>8} elements {cost:>16,.0f}")
+        lines.append("Pairs:")
+        for name_a, name_b, cost in self.pairs[:top]:
+            lines.append(f"    {name_a} <-> {name_b}: {cost:,.0f}")
+        return "\n".join(lines)
+
+
+def analyze_collision_cost(shapes, objects, depsgraph, matrix=None):
+    # shapes: SMPCollisionShape records, objects: name -> blender object of each shape
+    element_counts = {}
+    for shape in shapes:
+        obj = objects.get(shape.name)
+        if obj is not None and obj.type == "MESH":
+            if shape.vertex_weight_thresholds():
+                # Only the vertices left after the weight thresholds collide
+                element_counts[shape.name] = preview_weight_thresholds(shape, obj, depsgraph).kept
+            else:
+                element_counts[shape.name] = shape_element_count(shape, mesh_element_counts(obj, depsgraph))
+    return SMPCollisionReport(shapes, element_counts, matrix)
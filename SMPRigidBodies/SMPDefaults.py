@@ -0,0 +1,87 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENSE BLOCK #####
+# Copyright © 2023, OpheliaComplex.
+
+# Finds the settings many elements share, so they can be written once as a bone-default /
+# generic-constraint-default and every element only lists what differs from it.
+#
+# SMP keeps templates by name. Every template is named and referenced with a template attribute: an unnamed
+# *-default would replace the default of every element SMP creates after it, in this file or a later one,
+# including the bones it adds implicitly, which have to stay static.
+# Every template is written in full, what came before them doesn't matter.
+
+# More named templates than this rarely pay for themselves
+MAX_TEMPLATES = 8
+
+def _difference(fields, template):
+    # Number of elements that differ, fields and template are tuples of (element, value)
+    return sum(1 for field, default in zip(fields, template) if field != default)
+
+def _mode(field_sets):
+    # The most common value of every element
+    mode = []
+    for column in zip(*field_sets):
+        counts = {}
+        for field in column:
+            counts[field] = counts.get(field, 0) + 1
+        mode.append(max(counts, key=counts.get))
+    return tuple(mode)
+
+def _assign(field_sets, templates):
+    # Index of the template every field set differs least from, the earlier (more common) on ties
+    return [min(range(len(templates)), key=lambda t: _difference(fields, templates[t])) for fields in field_sets]
+
+def factor_defaults(field_sets, max_templates=MAX_TEMPLATES):
+    """Picks templates for field_sets, one tuple of (element, value) per element to write.
+       Returns (templates, assignment): the templates, most used first, and the index of the template of
+       every field set. No templates if sharing doesn't make the output smaller"""
+    if not field_sets:
+        return [], []
+
+    counts = {}
+    for fields in field_sets:
+        counts[fields] = counts.get(fields, 0) + 1
+    # Settings at least two elements share exactly, or failing that the most common value of every element
+    templates = sorted((fields for fields, n in counts.items() if n > 1), key=counts.get, reverse=True)
+    templates = templates[:max_templates] or [_mode(field_sets)]
+
+    while templates:
+        assignment = _assign(field_sets, templates)
+        # Elements a template saves over its elements' next best choice, a template costs about as much as
+        # writing all its elements once
+        saved = [-len(template) for template in templates]
+        for fields, t in zip(field_sets, assignment):
+            others = [_difference(fields, template) for other, template in enumerate(templates) if other != t]
+            saved[t] += min(others, default=len(fields)) - _difference(fields, templates[t])
+        # Drop the least useful template until all of them pay off
+        worst = min(range(len(templates)), key=saved.__getitem__)
+        if saved[worst] > 0:
+            break
+        del templates[worst]
+    else:
+        return [], []
+
+    # Most used first
+    used = [0] * len(templates)
+    for t in assignment:
+        used[t] += 1
+    order = sorted(range(len(templates)), key=lambda t: used[t], reverse=True)
+    rank = {t: i for i, t in enumerate(order)}
+    return [templates[t] for t in order], [rank[t] for t in assignment]
+
+def template_name(prefix, index):
+    return f"{prefix}-{index + 1}"
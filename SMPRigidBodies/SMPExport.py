@@ -16,10 +16,21 @@
 # ##### END GPL LICENSE BLOCK #####
 # Copyright © 2023, OpheliaComplex.
 
+import os
 import bpy
 from bpy_extras.io_utils import ExportHelper
-from bpy.props import StringProperty
-from SMPRigidBodies.SMPUtils import generate_xml
+from bpy.props import StringProperty, BoolProperty, IntProperty, FloatProperty
+from SMPRigidBodies.SMPUtils import write_xml, write_split_xml, parse_scene, SMPWriteJob
+from SMPRigidBodies.SMP_Core_Classes import SMPError
+from SMPRigidBodies.SMPSnapshot import save_snapshot, SNAPSHOT_EXT
+from SMPRigidBodies.SMPCache import fragment_cache
+from SMPRigidBodies.SMPStats import SMPExportStats, SMPMemoryStats
+from SMPRigidBodies.SMPCollision import analyze_collision_cost, SMPTagMatrix
+from SMPRigidBodies.SMPFormat import SMPCompactFormat
+from SMPRigidBodies.SMPGraph import SMPConstraintGraph, solver_order
+
+# The background export currently writing, only one at a time since they share the fragment cache
+running_job = None
 
 class SMPExport(bpy.types.Operator, ExportHelper):
     """Exporting rigid body bones setups to bullet SMP .xmls"""
@@ -35,6 +46,123 @@ class SMPExport(bpy.types.Operator, ExportHelper):
         maxlen=255,  # Max internal buffer length, longer would be clamped.
     )
 
+    write_snapshot: BoolProperty(
+        name="Write scene snapshot",
+        description="Also save the captured scene next to the .xml, so the .xml can be regenerated "
+                    "without blender (python -m SMPRigidBodies.SMPSnapshot)",
+        default=False,
+    )
+
+    incremental: BoolProperty(
+        name="Incremental export",
+        description="Only re-read and regenerate the objects that changed since the last export",
+        default=True,
+    )
+
+    share_defaults: BoolProperty(
+        name="Share common settings",
+        description="Write settings many bones or constraints share once as a bone-default / "
+                    "generic-constraint-default, every element then only lists what differs",
+        default=False,
+    )
+
+    compact: BoolProperty(
+        name="Compact output",
+        description="Write one element per line without indentation and round numbers to the significant "
+                    "digits below, smaller files that only change when the values do",
+        default=False,
+    )
+
+    significant_digits: IntProperty(
+        name="Significant digits",
+        description="Digits kept of every number in compact output, anything below 1e-6 is written as 0",
+        default=6,
+        min=1,
+        max=17,
+    )
+
+    split_armatures: BoolProperty(
+        name="One .xml per armature",
+        description="Write every armature into its own <file>_<armature>.xml, written in parallel",
+        default=False,
+    )
+
+    shared_shapes: BoolProperty(
+        name="Shared collision mesh file",
+        description="With one .xml per armature, write the collision meshes once into "
+                    "<file>_collision_meshes.xml instead of into every armature's .xml",
+        default=True,
+    )
+
+    check_constraint_graph: BoolProperty(
+        name="Check constraint graph",
+        description="Report constraints of missing bones, bones without constraints or static bone to hang from, "
+                    "loops and large mass ratios across joints (full report in the system console)",
+        default=False,
+    )
+
+    order_root_to_leaf: BoolProperty(
+        name="Order root to leaf",
+        description="Write bones and constraints from the roots of the chains outwards, which SMP's solver "
+                    "converges faster on",
+        default=False,
+    )
+
+    write_stats: BoolProperty(
+        name="Write export stats",
+        description="Save the time spent in every export phase and the exported counts as a .stats.json "
+                    "next to the .xml",
+        default=False,
+    )
+
+    analyze_collisions: BoolProperty(
+        name="Report collision cost",
+        description="Estimate the in-game collision work of the exported shapes and report the most expensive "
+                    "ones (full report in the system console)",
+        default=False,
+    )
+
+    prune_collision_rules: BoolProperty(
+        name="Prune collision rules",
+        description="Leave out duplicate collision tags and tag rules of private shapes that don't change "
+                    "which shapes collide",
+        default=False,
+    )
+
+    closed_world: BoolProperty(
+        name="Prune against this .xml only",
+        description="Also prune the rules of shapes that can meet other .xmls, as if nothing else was "
+                    "loaded in game. Only for setups that don't collide with anything else",
+        default=False,
+    )
+
+    write_collision_report: BoolProperty(
+        name="Write collision report",
+        description="Save the tag collision matrix and the pruned rules as a .collisions.txt next to the .xml",
+        default=False,
+    )
+
+    profile_memory: BoolProperty(
+        name="Profile memory",
+        description="Trace the memory every export phase and the captured records take (slows the export "
+                    "down), saved with the export stats",
+        default=False,
+    )
+
+    memory_budget: FloatProperty(
+        name="Memory budget (MiB)",
+        description="Warn when profiling shows the export needed more than this, 0 for no budget",
+        default=512.0,
+        min=0.0,
+    )
+
+    background: BoolProperty(
+        name="Export in background",
+        description="Keep blender responsive while the .xml is written, progress is shown in the status bar "
+                    "and Esc cancels",
+        default=False,
+    )
+
     def execute(self, context):
 
         scene = context.scene
@@ -44,14 +172,141 @@ class SMPExport(bpy.types.Operator, ExportHelper):
             self.report({"ERROR"},reportStr)
             return {"CANCELLED"}
 
-        # Collect the xml
-        xml = generate_xml(scene)
-        # Write the xml to file
-        with open(self.filepath, "w") as f:
-            f.write(xml)
+        if running_job is not None and running_job.is_alive():
+            self.report({"ERROR"}, "An SMP export is still running in the background")
+            return {"CANCELLED"}
+
+        # Capture the scene once, then stream the xml to file
+        stats = None
+        background = False
+        try:
+            cache = fragment_cache if self.incremental else None
+            if self.profile_memory:
+                stats = SMPMemoryStats(int(self.memory_budget * 1024 * 1024) if self.memory_budget else None)
+            else:
+                stats = SMPExportStats()
+            scene_data = parse_scene(scene, cache, stats)
+            if self.profile_memory:
+                stats.measure_records(scene_data)
+            tag_matrix = None
+            if self.prune_collision_rules or self.write_collision_report:
+                with stats.phase("collision rules"):
+                    tag_matrix = SMPTagMatrix(scene_data.collision_meshes)
+                    dropped = []
+                    if self.prune_collision_rules:
+                        # New records, the cached ones stay as they are in blender
+                        scene_data.collision_meshes, dropped = tag_matrix.prune_rules(self.closed_world)
+                        stats.count("pruned rules", len(dropped))
+                    if self.write_collision_report:
+                        report_path = os.path.splitext(self.filepath)[0] + ".collisions.txt"
+                        with open(report_path, "w", encoding="utf-8") as f:
+                            f.write(tag_matrix.format(dropped) + "\n")
+            if self.analyze_collisions:
+                with stats.phase("collision analysis"):
+                    collision_report = analyze_collision_cost(scene_data.collision_meshes, bpy.data.objects,
+                                                              context.evaluated_depsgraph_get(), tag_matrix)
+                print(collision_report.format())
+                self.report({"INFO"}, collision_report.summary())
+            if self.check_constraint_graph or self.order_root_to_leaf:
+                with stats.phase("constraint graph"):
+                    graph = SMPConstraintGraph(scene_data)
+                    if self.order_root_to_leaf:
+                        scene_data = solver_order(scene_data, graph)
+                if self.check_constraint_graph:
+                    print(graph.format())
+                    self.report({"INFO"}, graph.summary())
+                    for problem in graph.problems():
+                        self.report({"WARNING"}, problem)
+            xml_format = SMPCompactFormat(self.significant_digits) if self.compact else None
+            if self.background:
+                # Everything that reads blender data is done, the rest only needs the records
+                background = True
+                return self.start_job(context, SMPWriteJob(self.filepath, scene_data, cache, stats,
+                                                           self.share_defaults, xml_format, self.split_armatures,
+                                                           self.shared_shapes))
+            if self.split_armatures:
+                # The fragment cache holds the fragments of one file, split files are always generated
+                with stats.phase("write split"):
+                    written = write_split_xml(self.filepath, scene_data, self.share_defaults, xml_format,
+                                              self.shared_shapes)
+                stats.count("files", len(written))
+            else:
+                write_xml(self.filepath, scene_data, cache, stats, self.share_defaults, xml_format)
+            return self.finish(scene_data, stats)
+        except SMPError as e:
+            self.report({"ERROR"}, e.message)
+            return {"CANCELLED"}
+        except OSError as e:
+            self.report({"ERROR"}, f"Could not write {e.filename or self.filepath}: {e.strerror or e}")
+            return {"CANCELLED"}
+        finally:
+            # Always stops memory tracing, the stats of a background job are finished when it ends
+            if stats is not None and not background:
+                stats.finish()
+
+    def finish(self, scene_data, stats):
+        # Everything after the xml is written
+        if self.write_snapshot:
+            with stats.phase("snapshot"):
+                save_snapshot(os.path.splitext(self.filepath)[0] + SNAPSHOT_EXT, scene_data)
+
+        stats.finish()
+        self.report({"INFO"}, stats.summary())
+        if self.profile_memory:
+            warning = stats.budget_warning()
+            if warning is not None:
+                self.report({"WARNING"}, warning)
+        if self.write_stats:
+            stats.write_json(os.path.splitext(self.filepath)[0] + ".stats.json")
 
         return {'FINISHED'}            # Lets Blender know the operator finished successfully.
 
+    def start_job(self, context, job):
+        global running_job
+        running_job = self._job = job
+        job.start()
+        wm = context.window_manager
+        self._timer = wm.event_timer_add(0.1, window=context.window)
+        wm.progress_begin(0, 100)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        job = self._job
+        if event.type == 'ESC':
+            job.cancel()
+            return {'RUNNING_MODAL'}
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        if job.is_alive():
+            percent = int(job.progress() * 100)
+            context.window_manager.progress_update(percent)
+            status = "Cancelling SMP export.." if job.cancelled else \
+                f"Exporting {os.path.basename(self.filepath)}: {percent}%, Esc to cancel"
+            context.workspace.status_text_set(status)
+            return {'PASS_THROUGH'}
+
+        context.window_manager.event_timer_remove(self._timer)
+        context.window_manager.progress_end()
+        context.workspace.status_text_set(None)
+        if job.written is None:
+            job.stats.finish()
+            if job.error is not None:
+                self.report({"ERROR"}, job.error)
+            else:
+                # Esc after the write finished doesn't undo it, only a write that stopped is cancelled
+                self.report({"WARNING"}, "SMP export cancelled")
+            return {'CANCELLED'}
+        if job.split:
+            job.stats.count("files", len(job.written))
+        try:
+            return self.finish(job.scene_data, job.stats)
+        except OSError as e:
+            job.stats.finish()
+            self.report({"ERROR"}, f"Could not write {e.filename or self.filepath}: {e.strerror or e}")
+            return {"CANCELLED"}
+
     def invoke(self, context, event):
         wm = context.window_manager.fileselect_add(self)
         return {'RUNNING_MODAL'}
\ No newline at end of file
@@ -0,0 +1,165 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENSE BLOCK #####
+# Copyright © 2023, OpheliaComplex.
+
+# How the xml elements are written. SMPFormat is the indented layout the exporter always wrote, with every
+# number as str() gives it. SMPCompactFormat writes one element per line without indentation and numbers
+# with a fixed number of significant digits, so files are smaller and don't change between exports when
+# the values only differ in float noise.
+
+import numpy as np
+from SMPRigidBodies.SMP_Core_Classes import SMPKinematicBone, SMPGenericConstraint, SMPError
+
+class SMPFormat():
+    """The records' own indented layout"""
+    # Part of the fragment cache keys, fragments of another format can't be reused
+    key = ("pretty",)
+
+    def bone_fields(self, bone):
+        return bone.fields()
+
+    def constraint_fields(self, constraint, converted):
+        return constraint.fields(converted)
+
+    def statics(self, statics):
+        return statics.iter_strings()
+
+    def bone_default(self, fields, name=""):
+        return SMPKinematicBone.default_string(fields, name)
+
+    def bone(self, bone, template=None, template_name=""):
+        return bone.generate_string(template, template_name)
+
+    def shape(self, shape):
+        return shape.generate_string()
+
+    def constraint_default(self, fields, name=""):
+        return SMPGenericConstraint.default_string(fields, name)
+
+    def constraint(self, constraint, converted, template=None, template_name=""):
+        return constraint.generate_string(converted, template, template_name)
+
+
+class SMPCompactFormat(SMPFormat):
+    """One element per line, numbers rounded to digits significant digits and anything closer to 0 than
+       zero written as 0. Whole numbers are written without a fraction"""
+
+    def __init__(self, digits=6, zero=1e-6):
+        self.digits = digits
+        self.zero = zero
+        self.key = ("compact", digits, zero)
+        # float -> text, the same few values come up over and over
+        self._numbers = {}
+
+    def number(self, value):
+        text = self._numbers.get(value)
+        if text is None:
+            if abs(value) < self.zero:
+                text = "0"
+            else:
+                text = f"{value:.{self.digits}g}"
+                if "e" in text:
+                    text = np.format_float_positional(value, precision=self.digits, unique=False,
+                                                      fractional=False, trim="-")
+            self._numbers[value] = text
+        return text
+
+    def value(self, value):
+        if isinstance(value, tuple):
+            return tuple(self.number(v) for v in value)
+        if isinstance(value, str):
+            return value
+        return self.number(value)
+
+    def quantize(self, fields):
+        return tuple((element, self.value(value)) for element, value in fields)
+
+    @staticmethod
+    def field(element, value):
+        if isinstance(value, tuple):
+            return f'<{element} x="{value[0]}" y="{value[1]}" z="{value[2]}"/>'
+        return f"<{element}>{value}</{element}>"
+
+    def element(self, tag, attributes, fields):
+        # attributes are written as given, fields must be quantized
+        attrs = "".join(f' {name}="{value}"' for name, value in attributes if value)
+        children = "".join(self.field(element, value) for element, value in fields)
+        if not children:
+            return f"<{tag}{attrs}/>\n"
+        return f"<{tag}{attrs}>{children}</{tag}>\n"
+
+    def bone_fields(self, bone):
+        return self.quantize(bone.fields())
+
+    def constraint_fields(self, constraint, converted):
+        return self.quantize(constraint.fields(converted))
+
+    center_of_mass = ('<centerOfMassTransform><basis x="0" y="0" z="0" w="1"/><origin x="0" y="0" z="0"/>'
+                      '</centerOfMassTransform>')
+
+    def statics(self, statics):
+        if not statics.bone_list:
+            raise SMPError("No static bones")
+        # The same settings as SMPStaticBones.header
+        yield ('<bone-default><mass>0</mass><inertia x="0" y="0" z="0"/>' + self.center_of_mass +
+               "<linearDamping>0</linearDamping><angularDamping>0</angularDamping><friction>0</friction>"
+               "<rollingFriction>0</rollingFriction><restitution>0</restitution>"
+               "<gravity-factor>0</gravity-factor></bone-default>\n")
+        for bone in statics.bone_list:
+            yield f'<bone name="{bone}"/>\n'
+
+    def full_bone(self, tag, attrs, fields):
+        children = [self.field(element, value) for element, value in fields]
+        # The center of mass goes after the inertia, like in the indented layout
+        children.insert(2, self.center_of_mass)
+        return f"<{tag}{attrs}>{''.join(children)}</{tag}>\n"
+
+    def bone_default(self, fields, name=""):
+        return self.full_bone("bone-default", f' name="{name}"' if name else "", fields)
+
+    @staticmethod
+    def _differing(fields, template):
+        if template is None:
+            return fields
+        return tuple(field for field, default in zip(fields, template) if field != default)
+
+    def bone(self, bone, template=None, template_name=""):
+        fields = self.bone_fields(bone)
+        if template is None:
+            return self.full_bone("bone", f' name="{bone.bone_name}"', fields)
+        return self.element("bone", (("name", bone.bone_name), ("template", template_name)),
+                            self._differing(fields, template))
+
+    def shape(self, shape):
+        tag = f"per-{shape.collision_mesh_type}-shape"
+        fields = [("margin", self.number(shape.margin)), ("shared", shape.collision_mesh_privacy),
+                  ("penetration", self.number(shape.penetration)), ("tag", shape.tag)]
+        children = [self.field(element, value) for element, value in fields]
+        # Weight thresholds name their bone in an attribute, the other fields have none
+        children.extend(f'<weight-threshold bone="{bone}">{self.number(weight)}</weight-threshold>'
+                        for bone, weight in shape.vertex_weight_thresholds())
+        children.extend(self.field("no-collide-with-tag", tag_name) for tag_name in shape.no_collide_with_tags)
+        children.extend(self.field("can-collide-with-tag", tag_name) for tag_name in shape.collide_with_tags)
+        return f'<{tag} name="{shape.name}">{"".join(children)}</{tag}>\n'
+
+    def constraint_default(self, fields, name=""):
+        return self.element("generic-constraint-default", (("name", name),), fields)
+
+    def constraint(self, constraint, converted, template=None, template_name=""):
+        return self.element("generic-constraint", (("bodyA", constraint.bodyA), ("bodyB", constraint.bodyB),
+                                                   ("template", template_name)),
+                            self._differing(self.constraint_fields(constraint, converted), template))
@@ -0,0 +1,220 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENSE BLOCK #####
+# Copyright © 2023, OpheliaComplex.
+
+# The graph the generic-constraints make between bodies (bodyA - bodyB), checked for setups SMP can't solve
+# well and used to write bones and constraints from the roots of the chains outwards. Bullet solves the
+# constraints one after the other in the order of the .xml, so an order where every joint comes after the
+# joints between it and the root moves corrections along a chain in one iteration instead of one joint per
+# iteration. Large mass ratios across a joint slow that down just the same.
+
+from collections import deque
+import numpy as np
+from SMPRigidBodies.SMP_Core_Classes import SMPSceneData
+
+# Mass ratio across a joint above which bullet needs noticeably more iterations
+MASS_RATIO_WARNING = 10.0
+
+def _link(n, a, b):
+    # Union-find over the constraints (a[i], b[i]). Returns the component label of every body and the
+    # constraints closing a loop, the ones whose bodies the constraints before them already connected
+    parent = list(range(n))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    loops = []
+    for c, (i, j) in enumerate(zip(a.tolist(), b.tolist())):
+        root_i, root_j = find(i), find(j)
+        if root_i == root_j:
+            loops.append(c)
+        else:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+    return np.array([find(i) for i in range(n)], dtype=np.int64), loops
+
+def components(n, a, b):
+    # Connected component label of every body, bodies are connected by the constraints (a[i], b[i])
+    return _link(n, a, b)[0]
+
+def body_depths(n, a, b, roots):
+    # Constraints between every body and the nearest of roots (body indices), -1 for bodies not connected
+    # to any of them
+    neighbours = [[] for _ in range(n)]
+    for i, j in zip(a.tolist(), b.tolist()):
+        neighbours[i].append(j)
+        neighbours[j].append(i)
+    depth = np.full(n, -1, dtype=np.int64)
+    queue = deque()
+    for root in np.asarray(roots, dtype=np.int64).tolist():
+        if depth[root] < 0:
+            depth[root] = 0
+            queue.append(root)
+    while queue:
+        i = queue.popleft()
+        for j in neighbours[i]:
+            if depth[j] < 0:
+                depth[j] = depth[i] + 1
+                queue.append(j)
+    return depth
+
+
+class SMPConstraintGraph():
+    """Bodies and joints of a scene's constraints. Bodies are the kinematic bones, the static bones and
+       any other body a constraint names"""
+    __slots__ = ("scene_data", "names", "index", "bone_count", "static", "a", "b", "depths", "orphans", "unconstrained",
+                 "loops", "floating", "mass_ratios")
+
+    def __init__(self, scene_data):
+        self.scene_data = scene_data
+        bones = {}
+        for bone in scene_data.kinematics:
+            bones.setdefault(bone.bone_name, bone)
+        names = list(bones)
+        index = {name: i for i, name in enumerate(names)}
+        self.bone_count = len(names)
+        for name in scene_data.statics.bone_list:
+            if name not in index:
+                index[name] = len(names)
+                names.append(name)
+        known = len(names)
+        for constraint in scene_data.constraints:
+            for name in (constraint.bodyA, constraint.bodyB):
+                if name not in index:
+                    index[name] = len(names)
+                    names.append(name)
+        self.names = names
+        self.index = index
+        n = len(names)
+        self.a = np.array([index[constraint.bodyA] for constraint in scene_data.constraints], dtype=np.int64)
+        self.b = np.array([index[constraint.bodyB] for constraint in scene_data.constraints], dtype=np.int64)
+        # Static bones and massless kinematic bones don't move, the chains hang from them
+        self.static = np.zeros(n, dtype=bool)
+        self.static[self.bone_count:known] = True
+        masses = np.array([bone.mass for bone in bones.values()], dtype=np.float64)
+        self.static[:self.bone_count] = masses <= 0.0
+
+        # Constraints naming a body that is neither a kinematic nor a static bone, SMP skips them
+        self.orphans = [i for i, constraint in enumerate(scene_data.constraints)
+                        if self.a[i] >= known or self.b[i] >= known]
+        constrained = np.zeros(n, dtype=bool)
+        constrained[self.a] = True
+        constrained[self.b] = True
+        self.unconstrained = [names[i] for i in range(self.bone_count) if not constrained[i] and not self.static[i]]
+
+        self.loops = _link(n, self.a, self.b)[1]
+
+        self.depths = body_depths(n, self.a, self.b, np.nonzero(self.static)[0])
+        # Bones hanging from no static bone, free falling as a whole
+        self.floating = [names[i] for i in range(self.bone_count)
+                         if self.depths[i] < 0 and not self.static[i] and constrained[i]]
+
+        # (constraint index, heavier / lighter mass) of the joints between two moving bones, largest first
+        mass = np.zeros(n)
+        mass[:self.bone_count] = masses
+        moving = ~self.static[self.a] & ~self.static[self.b] & (self.a < self.bone_count) & \
+            (self.b < self.bone_count)
+        ratios = np.ones(len(self.a))
+        if moving.any():
+            mass_a = mass[self.a[moving]]
+            mass_b = mass[self.b[moving]]
+            ratios[moving] = np.maximum(mass_a, mass_b) / np.minimum(mass_a, mass_b)
+        order = np.argsort(-ratios, kind="stable")
+        self.mass_ratios = [(int(c), float(ratios[c])) for c in order if ratios[c] > 1.0]
+
+    def max_depth(self):
+        return int(self.depths.max()) if len(self.depths) else 0
+
+    def heavy_joints(self, threshold=MASS_RATIO_WARNING):
+        return [(c, ratio) for c, ratio in self.mass_ratios if ratio > threshold]
+
+    def _joint(self, c):
+        constraint = self.scene_data.constraints[c]
+        return f"{constraint.bodyA} - {constraint.bodyB}"
+
+    def problems(self):
+        # One line per kind of problem the export should warn about
+        lines = []
+        if self.orphans:
+            lines.append(f"{len(self.orphans)} constraints name bodies that aren't bones: "
+                         + ", ".join(self._joint(c) for c in self.orphans[:5]))
+        if self.unconstrained:
+            lines.append(f"{len(self.unconstrained)} bones have no constraints: " + ", ".join(self.unconstrained[:5]))
+        if self.floating:
+            lines.append(f"{len(self.floating)} bones hang from no static bone: " + ", ".join(self.floating[:5]))
+        if self.loops:
+            lines.append(f"{len(self.loops)} constraints close a loop: "
+                         + ", ".join(self._joint(c) for c in self.loops[:5]))
+        heavy = self.heavy_joints()
+        if heavy:
+            lines.append(f"{len(heavy)} joints have a mass ratio above {MASS_RATIO_WARNING:g}: "
+                         + ", ".join(f"{self._joint(c)} {ratio:.1f}" for c, ratio in heavy[:5]))
+        return lines
+
+    def summary(self):
+        heavy = self.heavy_joints()
+        worst = f", worst mass ratio {self.mass_ratios[0][1]:.1f}" if self.mass_ratios else ""
+        return (f"Constraint graph: {self.bone_count} bones, {len(self.a)} constraints, depth {self.max_depth()}, "
+                f"{len(self.loops)} loops, {len(self.orphans)} orphan constraints, "
+                f"{len(self.unconstrained)} unconstrained bones, {len(self.floating)} floating bones, "
+                f"{len(heavy)} heavy joints{worst}")
+
+    def format(self, top=10):
+        lines = [self.summary()]
+        lines.append("Loops (closed by):")
+        lines.extend(f"    {self._joint(c)}" for c in self.loops[:top])
+        lines.append("Orphan constraints:")
+        lines.extend(f"    {self._joint(c)}" for c in self.orphans[:top])
+        lines.append("Unconstrained bones:")
+        lines.extend(f"    {name}" for name in self.unconstrained[:top])
+        lines.append("Floating bones:")
+        lines.extend(f"    {name}" for name in self.floating[:top])
+        lines.append("Mass ratios:")
+        lines.extend(f"    {self._joint(c):<60} {ratio:>8.2f}" for c, ratio in self.mass_ratios[:top])
+        return "\n".join(lines)
+
+    def order(self):
+        # (kinematic bone order, constraint order) as indices into the scene data lists: root to leaf by depth,
+        # the captured order within a depth. Floating bones and orphan constraints go last
+        last = self.max_depth() + 1
+        depths = np.where(self.depths < 0, last, self.depths)
+        bone_depths = depths[np.array([self.index[bone.bone_name] for bone in self.scene_data.kinematics],
+                                      dtype=np.int64)]
+        constraint_depths = np.maximum(depths[self.a], depths[self.b])
+        if self.orphans:
+            constraint_depths[self.orphans] = last + 1
+        return (np.argsort(bone_depths, kind="stable").tolist(),
+                np.argsort(constraint_depths, kind="stable").tolist())
+
+
+def solver_order(scene_data, graph=None):
+    # A copy of scene_data with its kinematic bones and constraints in SMPConstraintGraph.order
+    if graph is None:
+        graph = SMPConstraintGraph(scene_data)
+    bone_order, constraint_order = graph.order()
+    armatures = scene_data.armatures
+    if armatures:
+        armatures = dict(armatures,
+                         kinematics=[armatures["kinematics"][i] for i in bone_order],
+                         constraints=[armatures["constraints"][i] for i in constraint_order])
+    return SMPSceneData(scene_data.statics,
+                        [scene_data.kinematics[i] for i in bone_order],
+                        [scene_data.constraints[i] for i in constraint_order],
+                        scene_data.collision_meshes,
+                        armatures)
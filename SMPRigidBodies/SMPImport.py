@@ -0,0 +1,158 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENSE BLOCK #####
+# Copyright © 2023, OpheliaComplex.
+
+import bpy
+from bpy_extras.io_utils import ImportHelper
+from bpy.props import StringProperty, BoolProperty
+from SMPRigidBodies.SMPReader import read_xml
+from SMPRigidBodies.SMPUtils import index_scene, index_armature_bones
+from SMPRigidBodies.SMP_Core_Classes import SMPError, strip_rbb_suffix
+from SMPRigidBodies.SMP_UI import set_tags
+
+def _apply_constraint(rbc, constraint):
+    # Exported disabled limits are 0/0, which locks the axis in SMP, so every limit is enabled here.
+    # Springs without stiffness and damping are left disabled
+    for i, axis in enumerate("xyz"):
+        setattr(rbc, f"use_limit_lin_{axis}", True)
+        setattr(rbc, f"limit_lin_{axis}_lower", constraint.lin_lower[i])
+        setattr(rbc, f"limit_lin_{axis}_upper", constraint.lin_upper[i])
+        setattr(rbc, f"use_limit_ang_{axis}", True)
+        setattr(rbc, f"limit_ang_{axis}_lower", constraint.ang_lower[i])
+        setattr(rbc, f"limit_ang_{axis}_upper", constraint.ang_upper[i])
+        setattr(rbc, f"use_spring_{axis}", bool(constraint.lin_stiffness[i] or constraint.lin_damping[i]))
+        setattr(rbc, f"spring_stiffness_{axis}", constraint.lin_stiffness[i])
+        setattr(rbc, f"spring_damping_{axis}", constraint.lin_damping[i])
+        setattr(rbc, f"use_spring_ang_{axis}", bool(constraint.ang_stiffness[i] or constraint.ang_damping[i]))
+        setattr(rbc, f"spring_stiffness_ang_{axis}", constraint.ang_stiffness[i])
+        setattr(rbc, f"spring_damping_ang_{axis}", constraint.ang_damping[i])
+
+def _apply_weight_thresholds(obj, weight_thresholds):
+    # The same threshold for every vertex group is the shape's weight threshold, anything else is set per bone
+    obj.smp_bone_weight_thresholds.clear()
+    weights = {weight for bone, weight in weight_thresholds}
+    bones = {bone for bone, weight in weight_thresholds}
+    if len(weights) == 1 and bones >= {group.name for group in obj.vertex_groups}:
+        obj.smp_weight_threshold = weights.pop()
+        return
+    obj.smp_weight_threshold = 0.0
+    for bone, weight in weight_thresholds:
+        item = obj.smp_bone_weight_thresholds.add()
+        item.name = bone
+        item.threshold = weight
+
+def apply_scene_data(scene, scene_data):
+    # Write the records onto the matching rigid body bones objects, bone extra props and collision meshes
+    # of scene. Returns the number of applied records and the names of the ones that have no match
+    index = index_scene(scene)
+    actives = {strip_rbb_suffix(obj.name): (obj, arma_name) for obj, arma_name in index.kinematics}
+    joints = {(strip_rbb_suffix(obj.rigid_body_constraint.object1.name),
+               strip_rbb_suffix(obj.rigid_body_constraint.object2.name)): obj for obj, arma_name in index.joints
+              if obj.rigid_body_constraint.object1 is not None and obj.rigid_body_constraint.object2 is not None}
+    shapes = {obj.name: obj for obj in index.collision_meshes}
+    extra_props_indices = {}
+    applied = 0
+    missing = []
+
+    for bone in scene_data.kinematics:
+        obj, arma_name = actives.get(bone.bone_name, (None, None))
+        if arma_name not in extra_props_indices:
+            armature = bpy.data.armatures.get(arma_name) if arma_name is not None else None
+            extra_props_indices[arma_name] = index_armature_bones(armature)[1] if armature is not None else {}
+        bone_data = extra_props_indices[arma_name].get(bone.bone_name)
+        if obj is None or bone_data is None:
+            missing.append(bone.bone_name)
+            continue
+        rb_obj = obj.rigid_body
+        rb_obj.mass = bone.mass
+        rb_obj.linear_damping = bone.linearDamping
+        rb_obj.angular_damping = bone.angularDamping
+        rb_obj.friction = bone.friction
+        rb_obj.restitution = bone.restitution
+        bone_data.inertia = bone.inertia_x
+        bone_data.gravity_factor = bone.gravityFactor
+        bone_data.rolling_friction = bone.rollingFriction
+        bone_data.margin_multiplier = bone.margin_multiplier
+        applied += 1
+
+    for constraint in scene_data.constraints:
+        obj = joints.get((constraint.bodyA, constraint.bodyB))
+        if obj is None:
+            missing.append(f"{constraint.bodyA} -> {constraint.bodyB}")
+            continue
+        _apply_constraint(obj.rigid_body_constraint, constraint)
+        applied += 1
+
+    for shape in scene_data.collision_meshes:
+        obj = shapes.get(shape.name)
+        if obj is None:
+            missing.append(shape.name)
+            continue
+        obj.rigid_body.collision_margin = shape.margin
+        obj.smp_col_type = shape.collision_mesh_type
+        obj.smp_col_privacy = shape.collision_mesh_privacy
+        obj.smp_tag = shape.tag
+        set_tags(obj.no_collide_with_tags, shape.no_collide_with_tags)
+        set_tags(obj.collide_with_tags, shape.collide_with_tags)
+        _apply_weight_thresholds(obj, shape.weight_thresholds)
+        applied += 1
+
+    return applied, missing
+
+
+class SMPImport(bpy.types.Operator, ImportHelper):
+    """Read an SMP .xml and apply it to the matching Rigid Body Bones setup and collision meshes"""
+    bl_idname = "object.smp_xml_import"
+    bl_label = "Import SMP .xml"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    filename_ext = ".xml"
+
+    filter_glob: StringProperty(
+        default="*.xml",
+        options={'HIDDEN'},
+        maxlen=255,
+    )
+
+    apply_to_scene: BoolProperty(
+        name="Apply to scene",
+        description="Set the values on the matching rigid body bones objects, bones and collision meshes. "
+                    "Otherwise the file is only read and checked",
+        default=True,
+    )
+
+    def execute(self, context):
+        try:
+            scene_data = read_xml(self.filepath)
+        except (SMPError, OSError) as e:
+            self.report({"ERROR"}, getattr(e, "message", None) or str(e))
+            return {"CANCELLED"}
+
+        counts = (f"{len(scene_data.statics.bone_list)} static bones, {len(scene_data.kinematics)} bones, "
+                  f"{len(scene_data.constraints)} constraints, {len(scene_data.collision_meshes)} shapes")
+        if not self.apply_to_scene:
+            self.report({"INFO"}, f"Read {counts}")
+            return {'FINISHED'}
+
+        applied, missing = apply_scene_data(context.scene, scene_data)
+        if missing:
+            shown = ", ".join(missing[:10]) + (", ..." if len(missing) > 10 else "")
+            self.report({"WARNING"}, f"Read {counts}, applied {applied}. "
+                                     f"{len(missing)} not found in the scene: {shown}")
+        else:
+            self.report({"INFO"}, f"Read {counts}, applied all of them")
+        return {'FINISHED'}
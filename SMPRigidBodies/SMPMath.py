@@ -16,8 +16,35 @@
 # ##### END GPL LICENSE BLOCK #####
 # Copyright © 2023, OpheliaComplex.
 
-import bpy_extras
+import numpy as np
+
+# Blender is Z-up with Y forward, SMP wants Z forward with -X up. This is the matrix
+# bpy_extras.io_utils.axis_conversion(from_forward='Y', from_up='Z', to_forward='Z', to_up='-X') returns,
+# written out so the conversion does not need Blender: (x, y, z) -> (-z, -x, y)
+BLENDER_TO_OPENGL = ((0.0, 0.0, -1.0),
+                     (-1.0, 0.0, 0.0),
+                     (0.0, 1.0, 0.0))
 
 def rotate_vector_blender_to_opengl(vec):
-    m = bpy_extras.io_utils.axis_conversion(from_forward='Y', from_up='Z', to_forward='Z', to_up='-X')
-    return m @ vec
\ No newline at end of file
+    m = BLENDER_TO_OPENGL
+    return tuple(row[0] * vec[0] + row[1] * vec[1] + row[2] * vec[2] for row in m)
+
+# The inverse, a rotation so just the transpose: (x, y, z) -> (-y, z, -x)
+OPENGL_TO_BLENDER = tuple(zip(*BLENDER_TO_OPENGL))
+
+def rotate_vector_opengl_to_blender(vec):
+    m = OPENGL_TO_BLENDER
+    return tuple(row[0] * vec[0] + row[1] * vec[1] + row[2] * vec[2] for row in m)
+
+BLENDER_TO_OPENGL_NP = np.array(BLENDER_TO_OPENGL)
+
+def constraints_to_opengl(constraints):
+    # Batch version of SMPGenericConstraint.to_opengl, converts every constraint with one matrix multiply.
+    # Returns a (n, 8, 3) array in the order of SMPGenericConstraint.vectors(), the last four rows
+    # (stiffness and damping) are made positive
+    if not constraints:
+        return np.empty((0, 8, 3))
+    values = np.array([constraint.vectors() for constraint in constraints], dtype=np.float64)
+    converted = values @ BLENDER_TO_OPENGL_NP.T
+    np.abs(converted[:, 4:], out=converted[:, 4:])
+    return converted
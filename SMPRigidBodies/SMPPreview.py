@@ -0,0 +1,354 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENSE BLOCK #####
+# Copyright © 2023, OpheliaComplex.
+
+# Headless preview of how the exported constraint chains move, so setups that never settle or blow up can be
+# rejected without baking the rigid body world or starting the game:
+#   python -m SMPRigidBodies.SMPPreview outfit.smpsnap --json preview.json
+#
+# This is a reduced model, not SMP. Bones have no length or position here, every body is a point with three
+# linear and three angular coordinates (small angles), in SMP coordinates. Each generic-constraint is a
+# spring and damper per axis between its two bodies and clamps their relative coordinates to its limits the
+# way the .xml states them (linear lower limits are written from the upper ones, see
+# SMPGenericConstraint.fields). Per axis a lower limit below the upper one limits it, an equal one locks it
+# and a greater one leaves it free, like bullet. Bodies without a kinematic bone (static bones and the
+# roots of the chains) follow a swaying root motion for drive_time seconds and then stop.
+#
+# All chains of the scene are stepped together as arrays. A chain is a set of bodies connected by
+# constraints, reported under the name of its first driven body.
+
+import argparse
+import json
+import math
+import numpy as np
+from SMPRigidBodies.SMP_Core_Classes import SMPError
+from SMPRigidBodies.SMPMath import constraints_to_opengl, rotate_vector_blender_to_opengl
+from SMPRigidBodies.SMPGraph import components, body_depths
+
+# Blender's default gravity, in scene units per second squared
+GRAVITY = 9.81
+# Root motion directions in blender coordinates: sway diagonally in the horizontal plane while tilting
+# sideways and twisting
+DRIVE_LINEAR = (0.7071, 0.7071, 0.0)
+DRIVE_ANGULAR = (0.7071, 0.0, 0.7071)
+
+
+class SMPChainPreview():
+    """How one chain moved during the preview"""
+    __slots__ = ("name", "bodies", "settling_time", "limit_hits", "jitter", "peak_speed", "unstable")
+
+    def __init__(self, name, bodies, settling_time, limit_hits, jitter, peak_speed, unstable):
+        self.name = name
+        self.bodies = bodies
+        # Seconds after the root motion stopped until the chain stayed below the settle speed,
+        # None if it never did
+        self.settling_time = settling_time
+        # Times a constraint ran into one of its limits (locked axes don't count)
+        self.limit_hits = limit_hits
+        # RMS of the chain's speed over the last second, 0 for a chain at rest
+        self.jitter = jitter
+        self.peak_speed = peak_speed
+        # Blew up, kept gaining speed after the root motion stopped or has springs too stiff for the timestep
+        self.unstable = unstable
+
+    @property
+    def status(self):
+        if self.unstable:
+            return "unstable"
+        return "settled" if self.settling_time is not None else "not settled"
+
+    def to_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+
+class SMPPreviewReport():
+    """Result of preview_chains"""
+    __slots__ = ("chains", "duration", "drive_time")
+
+    def __init__(self, chains, duration, drive_time):
+        self.chains = chains
+        self.duration = duration
+        self.drive_time = drive_time
+
+    def unstable_chains(self):
+        return [chain for chain in self.chains if chain.unstable]
+
+    def unsettled_chains(self):
+        return [chain for chain in self.chains if not chain.unstable and chain.settling_time is None]
+
+    def summary(self):
+        unstable = self.unstable_chains()
+        unsettled = self.unsettled_chains()
+        settled = [chain for chain in self.chains if chain.settling_time is not None and not chain.unstable]
+        line = (f"Preview of {len(self.chains)} chains over {self.duration:g} s: {len(unstable)} unstable, "
+                f"{len(unsettled)} not settled after {self.duration - self.drive_time:g} s, "
+                f"{sum(chain.limit_hits for chain in self.chains)} limit hits")
+        if unstable:
+            line += ", unstable: " + ", ".join(chain.name for chain in unstable[:3])
+        elif settled:
+            slowest = max(settled, key=lambda chain: chain.settling_time)
+            line += f", slowest to settle: {slowest.name} {slowest.settling_time:.2f} s"
+        return line
+
+    def format(self):
+        lines = [self.summary()]
+        for chain in sorted(self.chains, key=lambda chain: (not chain.unstable, chain.settling_time is not None,
+                                                             -(chain.settling_time or 0.0))):
+            settle = f"{chain.settling_time:.2f} s" if chain.settling_time is not None else "-"
+            lines.append(f"    {chain.name:<40} {len(chain.bodies):>4} bodies  settle {settle:>8}  "
+                         f"hits {chain.limit_hits:>5}  jitter {chain.jitter:>10.4g}  peak {chain.peak_speed:>10.4g}"
+                         f"  {chain.status}")
+        return "\n".join(lines)
+
+    def to_dict(self):
+        return {"duration": self.duration,
+                "drive_time": self.drive_time,
+                "unstable": len(self.unstable_chains()),
+                "unsettled": len(self.unsettled_chains()),
+                "chains": [chain.to_dict() for chain in self.chains]}
+
+
+def preview_chains(scene_data, duration=4.0, drive_time=1.0, timestep=1.0 / 240.0, frequency=2.0,
+                   linear_amplitude=0.1, angular_amplitude=0.5, gravity=GRAVITY, settle_speed=0.01,
+                   blowup_speed=1000.0, iterations=4):
+    # scene_data: SMPSceneData, captured, read from an .xml or loaded from a snapshot. Returns an
+    # SMPPreviewReport. Speeds are the largest linear (units/s) or angular (rad/s) speed of any body of a chain
+    if drive_time >= duration:
+        raise SMPError(f"The root motion ({drive_time:g} s) has to stop before the end of the preview "
+                       f"({duration:g} s)")
+
+    bones = {bone.bone_name: bone for bone in scene_data.kinematics if bone.mass > 0}
+    names = list(bones)
+    index = {name: i for i, name in enumerate(names)}
+    for constraint in scene_data.constraints:
+        for name in (constraint.bodyA, constraint.bodyB):
+            if name not in index:
+                index[name] = len(names)
+                names.append(name)
+    n = len(names)
+    n_bones = len(bones)
+    dynamic = np.zeros(n, dtype=bool)
+    dynamic[:n_bones] = True
+
+    # Per body and coordinate: inverse mass (0 for driven bodies), velocity kept per second and gravity
+    inv_mass = np.zeros((n, 6))
+    kept = np.ones((n, 6))
+    weight = np.zeros((n, 3))
+    if n_bones:
+        values = np.array([(bone.mass, bone.inertia_x, bone.inertia_y, bone.inertia_z, bone.linearDamping,
+                            bone.angularDamping, bone.gravityFactor) for bone in bones.values()], dtype=np.float64)
+        mass = values[:, 0:1]
+        inv_mass[:n_bones, :3] = 1.0 / mass
+        inv_mass[:n_bones, 3:] = 1.0 / (mass * np.maximum(values[:, 1:4], 1e-6))
+        # Bullet damps velocities by (1 - damping) per second
+        kept[:n_bones, :3] = (1.0 - np.clip(values[:, 4:5], 0.0, 1.0)) ** timestep
+        kept[:n_bones, 3:] = (1.0 - np.clip(values[:, 5:6], 0.0, 1.0)) ** timestep
+        weight[:n_bones] = np.outer(values[:, 6], rotate_vector_blender_to_opengl((0.0, 0.0, -gravity)))
+
+    a = np.array([index[constraint.bodyA] for constraint in scene_data.constraints], dtype=np.int64)
+    b = np.array([index[constraint.bodyB] for constraint in scene_data.constraints], dtype=np.int64)
+    converted = constraints_to_opengl(scene_data.constraints)
+    lower = np.concatenate((converted[:, 1], converted[:, 2]), axis=1)
+    upper = np.concatenate((converted[:, 1], converted[:, 3]), axis=1)
+    stiffness = np.concatenate((converted[:, 4], converted[:, 6]), axis=1)
+    damping = np.concatenate((converted[:, 5], converted[:, 7]), axis=1)
+    limited = lower < upper
+    clamped = lower <= upper
+    lower = np.where(clamped, lower, -np.inf)
+    upper = np.where(clamped, upper, np.inf)
+
+    # Chains with at least one bone, numbered 0..n_chains-1 in the order of their first body
+    labels = components(n, a, b)
+    roots, chain_of = np.unique(labels, return_inverse=True)
+    has_bones = np.zeros(len(roots), dtype=bool)
+    has_bones[chain_of[:n_bones]] = True
+    n_chains = len(roots)
+
+    x = np.zeros((n, 6))
+    v = np.zeros((n, 6))
+    drive = np.concatenate((np.array(rotate_vector_blender_to_opengl(DRIVE_LINEAR)) * linear_amplitude,
+                            np.array(rotate_vector_blender_to_opengl(DRIVE_ANGULAR)) * angular_amplitude))
+    omega = 2.0 * math.pi * frequency
+    driven = ~dynamic
+
+    # Limits only move one body of a constraint, bodyB unless that is driven, the other one feels the
+    # limit through the springs alone. Going outwards from the driven bodies one depth at a time, a single
+    # sweep then puts every tree back within its limits
+    moves_b = dynamic[b]
+    moved = np.where(moves_b, b, a)
+    direction = np.where(moves_b, -1.0, 1.0)[:, None]
+    depth = body_depths(n, a, b, np.nonzero(driven)[0])
+    # Chains without a driven body count from their first body
+    unreached = depth < 0
+    if unreached.any():
+        firsts = np.nonzero(unreached)[0][np.unique(labels[unreached], return_index=True)[1]]
+        depth = body_depths(n, a, b, np.concatenate((np.nonzero(driven)[0], firsts)))
+    movable = np.nonzero(dynamic[moved])[0]
+    levels = []
+    for level in np.unique(depth[moved[movable]]):
+        i = movable[depth[moved[movable]] == level]
+        levels.append((a[i], b[i], lower[i], upper[i], moved[i], direction[i], i))
+    # Trees are done after one sweep, constraint loops get a few
+    sweeps = iterations if len(a) > n - n_chains else 1
+
+    def project():
+        # Move bodies back within the limits of their constraints, returns the constraint axes found outside
+        outside_any = np.zeros(lower.shape, dtype=bool)
+        for _ in range(sweeps):
+            corrected = False
+            for level_a, level_b, level_lower, level_upper, level_moved, level_direction, i in levels:
+                q = x[level_b] - x[level_a]
+                error = q - np.minimum(np.maximum(q, level_lower), level_upper)
+                outside = error != 0.0
+                if outside.any():
+                    corrected = True
+                    outside_any[i] |= outside
+                    np.add.at(x, level_moved, level_direction * error)
+            if not corrected:
+                break
+        return outside_any
+
+    # Start from a pose within the limits
+    project()
+
+    steps = max(int(round(duration / timestep)), 1)
+    drive_steps = int(round(drive_time / timestep))
+    speeds = np.zeros((steps, n_chains))
+    hits = np.zeros(len(a), dtype=np.int64)
+    at_limit = np.zeros(lower.shape, dtype=bool)
+    unstable = np.zeros(n_chains, dtype=bool)
+    acceleration = np.empty((n, 6))
+    for step in range(steps):
+        if step < drive_steps:
+            t = (step + 1) * timestep
+            x[driven] = drive * math.sin(omega * t)
+            v[driven] = drive * (omega * math.cos(omega * t))
+        else:
+            v[driven] = 0.0
+
+        force = -stiffness * (x[b] - x[a]) - damping * (v[b] - v[a])
+        acceleration.fill(0.0)
+        np.add.at(acceleration, b, force)
+        np.subtract.at(acceleration, a, force)
+        acceleration *= inv_mass
+        acceleration[:, :3] += weight
+        v += acceleration * timestep
+        v *= kept
+        # Position based limits: step, project, then take the velocity the bodies really moved with
+        previous = x[dynamic]
+        x[dynamic] += v[dynamic] * timestep
+        outside = project()
+        v[dynamic] = (x[dynamic] - previous) / timestep
+        hits += (outside & ~at_limit & limited).sum(axis=1)
+        at_limit = outside
+
+        speed = np.abs(v).max(axis=1)
+        blown = dynamic & ~(speed <= blowup_speed)
+        if blown.any():
+            # Take the chain out of the simulation so it doesn't drag the arrays into nan
+            unstable[np.unique(chain_of[blown])] = True
+            frozen = dynamic & unstable[chain_of]
+            x[frozen] = 0.0
+            v[frozen] = 0.0
+            inv_mass[frozen] = 0.0
+            weight[frozen] = 0.0
+            dynamic &= ~frozen
+            speed[frozen] = 0.0
+        np.maximum.at(speeds[step], chain_of[dynamic], speed[dynamic])
+
+    after = speeds[drive_steps:]
+    moving = after > settle_speed
+    last_moving = len(after) - 1 - np.argmax(moving[::-1], axis=0)
+    window = speeds[-max(int(round(1.0 / timestep)), 1):]
+    jitter = np.sqrt((window ** 2).mean(axis=0))
+    # Still gaining speed long after the root stopped
+    if drive_steps:
+        unstable |= window.max(axis=0) > speeds[:drive_steps].max(axis=0) * 1.5 + settle_speed
+    # Springs too stiff or too damped for the timestep overshoot a little more every step, whether or not
+    # the limits keep that from blowing up
+    response = inv_mass[a] + inv_mass[b]
+    overshooting = ((stiffness * response * timestep ** 2 > 4.0) | (damping * response * timestep > 2.0)).any(axis=1)
+    unstable[chain_of[b[overshooting]]] = True
+    chain_hits = np.zeros(n_chains, dtype=np.int64)
+    np.add.at(chain_hits, chain_of[b], hits)
+    peak = speeds.max(axis=0)
+
+    chains = []
+    for c in np.nonzero(has_bones)[0]:
+        members = np.nonzero(chain_of == c)[0]
+        roots_of_chain = [names[i] for i in members if i >= n_bones]
+        if not moving[:, c].any():
+            settling_time = 0.0
+        elif last_moving[c] == len(after) - 1:
+            settling_time = None
+        else:
+            settling_time = float((last_moving[c] + 1) * timestep)
+        chains.append(SMPChainPreview(name=roots_of_chain[0] if roots_of_chain else names[members[0]],
+                                      bodies=[names[i] for i in members if i < n_bones],
+                                      settling_time=None if unstable[c] else settling_time,
+                                      limit_hits=int(chain_hits[c]),
+                                      jitter=float(jitter[c]),
+                                      peak_speed=float(peak[c]),
+                                      unstable=bool(unstable[c])))
+    return SMPPreviewReport(chains, duration, drive_time)
+
+
+def main(argv=None):
+    from SMPRigidBodies.SMPReader import read_xml
+    from SMPRigidBodies.SMPSnapshot import load_snapshot, SNAPSHOT_EXT
+
+    parser = argparse.ArgumentParser(description="Preview how the constraint chains of an SMP .xml or scene "
+                                                 "snapshot settle, without blender")
+    parser.add_argument("input", help="SMP .xml or snapshot written by the exporter")
+    parser.add_argument("--duration", type=float, default=4.0, help="seconds simulated (default 4)")
+    parser.add_argument("--drive-time", type=float, default=1.0,
+                        help="seconds the roots of the chains sway before they stop (default 1)")
+    parser.add_argument("--frequency", type=float, default=2.0, help="sway frequency in Hz (default 2)")
+    parser.add_argument("--linear-amplitude", type=float, default=0.1,
+                        help="sway distance in scene units (default 0.1)")
+    parser.add_argument("--angular-amplitude", type=float, default=0.5,
+                        help="sway angle in radians (default 0.5)")
+    parser.add_argument("--gravity", type=float, default=GRAVITY, help=f"gravity (default {GRAVITY})")
+    parser.add_argument("--timestep", type=float, default=1.0 / 240.0, help="seconds per step (default 1/240)")
+    parser.add_argument("--settle-speed", type=float, default=0.01,
+                        help="speed below which a chain counts as settled (default 0.01)")
+    parser.add_argument("--json", help="also write the report as json")
+    parser.add_argument("--strict", action="store_true", help="also fail if a chain doesn't settle")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.input.endswith(SNAPSHOT_EXT):
+            scene_data = load_snapshot(args.input)
+        else:
+            scene_data = read_xml(args.input)
+        report = preview_chains(scene_data, duration=args.duration, drive_time=args.drive_time,
+                                timestep=args.timestep, frequency=args.frequency,
+                                linear_amplitude=args.linear_amplitude, angular_amplitude=args.angular_amplitude,
+                                gravity=args.gravity, settle_speed=args.settle_speed)
+    except SMPError as e:
+        parser.exit(1, f"ERROR: {e.message}\n")
+
+    print(report.format())
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report.to_dict(), f, indent=2)
+    # Non-zero exit status so pipelines can reject the setup
+    if report.unstable_chains() or (args.strict and report.unsettled_chains()):
+        parser.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENSE BLOCK #####
+# Copyright © 2023, OpheliaComplex.
+
+# Low poly stand-ins for collision meshes. A proxy is a decimated copy of a collision mesh with the same SMP
+# settings and vertex groups, the original points to it (smp_collision_proxy) and is exported through it:
+# index_scene skips collision meshes whose proxy is in the scene. The proxy has to be in the .nif as well,
+# SMP finds the shapes of an .xml by name.
+
+import bpy
+from SMPRigidBodies.SMPCollision import mesh_counts
+
+PROXY_SUFFIX = "_proxy"
+# Decimation doesn't hit a count exactly, the ratio is narrowed down at most this many times
+MAX_DECIMATE_PASSES = 4
+
+def budget_count(counts, budget_kind, collision_mesh_type):
+    # The count of counts (vertices, triangles) a budget of budget_kind limits. 'SHAPE' is what the
+    # shape's type collides with
+    vertex_count, triangle_count = counts
+    if budget_kind == 'SHAPE':
+        budget_kind = 'TRIANGLES' if collision_mesh_type == "triangle" else 'VERTICES'
+    return triangle_count if budget_kind == 'TRIANGLES' else vertex_count
+
+def decimated_mesh(depsgraph, obj, budget, budget_kind):
+    # (new mesh, count) of obj's undeformed mesh collapsed to at most budget elements where decimation gets
+    # there, vertex groups and weights interpolated along. Evaluated in depsgraph, a view layer's of the scene
+    # obj is exported from
+    count = budget_count(mesh_counts(obj.data), budget_kind, obj.smp_col_type)
+    if count <= budget:
+        return obj.data.copy(), count
+
+    # Decimate a copy without the original's modifiers, it has to be in the scene to be evaluated
+    temp = obj.copy()
+    temp.modifiers.clear()
+    depsgraph.scene.collection.objects.link(temp)
+    try:
+        modifier = temp.modifiers.new("SMP proxy", 'DECIMATE')
+        modifier.decimate_type = 'COLLAPSE'
+        modifier.use_collapse_triangulate = True
+        ratio = budget / count
+        for attempt in range(MAX_DECIMATE_PASSES):
+            modifier.ratio = ratio
+            depsgraph.update()
+            mesh = bpy.data.meshes.new_from_object(temp.evaluated_get(depsgraph), preserve_all_data_layers=True,
+                                                   depsgraph=depsgraph)
+            count = budget_count(mesh_counts(mesh), budget_kind, obj.smp_col_type)
+            if count <= budget or attempt == MAX_DECIMATE_PASSES - 1:
+                return mesh, count
+            bpy.data.meshes.remove(mesh)
+            # A bit below what should be enough, collapsing overshoots as often as not
+            ratio *= 0.98 * budget / count
+    finally:
+        bpy.data.objects.remove(temp)
+
+def make_collision_proxy(depsgraph, obj, budget, budget_kind='SHAPE'):
+    # (proxy, element count) of a new proxy of obj, replacing the one it had
+    old = obj.smp_collision_proxy
+    if old is not None:
+        old_mesh = old.data
+        bpy.data.objects.remove(old)
+        if old_mesh.users == 0:
+            bpy.data.meshes.remove(old_mesh)
+
+    mesh, count = decimated_mesh(depsgraph, obj, budget, budget_kind)
+    mesh.name = obj.data.name + PROXY_SUFFIX
+    # The copy keeps the rigid body, modifiers, vertex groups and every SMP property
+    proxy = obj.copy()
+    proxy.data = mesh
+    proxy.name = obj.name + PROXY_SUFFIX
+    proxy.smp_collision_proxy = None
+    proxy.display_type = 'WIRE'
+    # Includes the rigid body world's collection
+    for collection in obj.users_collection:
+        collection.objects.link(proxy)
+    obj.smp_collision_proxy = proxy
+    return proxy, count
@@ -0,0 +1,223 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENSE BLOCK #####
+# Copyright © 2023, OpheliaComplex.
+
+# Reads SMP .xmls back into the SMP records, streaming with iterparse so merged multi-megabyte files are never
+# held as a whole tree. Values are transformed back into blender coordinates, so the records are the same as
+# the ones parse_scene captures. Applying them to a scene is done by SMPImport.py.
+#   python -m SMPRigidBodies.SMPReader outfit.xml outfit.smpsnap
+#
+# Supports bone-default / generic-constraint-default, including named templates (name, extends and template
+# attributes). Bones with a mass of 0 are static bones.
+
+import argparse
+import xml.etree.ElementTree as ET
+from SMPRigidBodies.SMP_Core_Classes import SMPCollisionShape, SMPKinematicBone, SMPStaticBones, \
+    SMPGenericConstraint, SMPSceneData, SMPError
+from SMPRigidBodies.SMPMath import rotate_vector_opengl_to_blender
+
+# SMP element -> SMPKinematicBone slot
+BONE_FIELDS = {
+    "mass": "mass",
+    "linearDamping": "linearDamping",
+    "angularDamping": "angularDamping",
+    "friction": "friction",
+    "rollingFriction": "rollingFriction",
+    "restitution": "restitution",
+    "margin-multiplier": "margin_multiplier",
+    "gravity-factor": "gravityFactor",
+}
+
+# SMP element -> SMPGenericConstraint slot
+CONSTRAINT_VECTORS = {
+    "linearLowerLimit": "lin_lower",
+    "linearUpperLimit": "lin_upper",
+    "angularLowerLimit": "ang_lower",
+    "angularUpperLimit": "ang_upper",
+    "linearStiffness": "lin_stiffness",
+    "linearDamping": "lin_damping",
+    "angularStiffness": "ang_stiffness",
+    "angularDamping": "ang_damping",
+}
+# Stored as absolute values by the exporter
+POSITIVE_VECTORS = frozenset(("lin_stiffness", "lin_damping", "ang_stiffness", "ang_damping"))
+
+SHAPE_ELEMENTS = ("per-vertex-shape", "per-triangle-shape")
+
+def _describe(element):
+    # "bone Hair1", "generic-constraint Hair1 - Hair2", for error messages
+    name = element.get("name") or " - ".join(filter(None, (element.get("bodyA"), element.get("bodyB"))))
+    return f"{element.tag} {name}" if name else element.tag
+
+def _float(text, child, parent):
+    # Empty and non numeric values name the element and its bone, constraint or shape.
+    # A ValueError, read_xml turns it into an SMPError with the file name
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        raise ValueError(f"<{child.tag}> of {_describe(parent)} is not a number: {text!r}") from None
+
+def _vector(element, parent):
+    return tuple(_float(element.get(axis, 0.0), element, parent) for axis in "xyz")
+
+def _bool(text):
+    return (text or "").strip().lower() in ("true", "1")
+
+def _default_bone():
+    # What SMP uses without any bone-default, massless bones are static
+    bone = SMPKinematicBone(bone_name=None)
+    bone.mass = 0.0
+    return bone
+
+def _copy(record):
+    copy = type(record)()
+    for slot in record.__slots__:
+        setattr(copy, slot, getattr(record, slot))
+    return copy
+
+def _read_bone(element, bone):
+    # Fill bone (a copy of its template) from a bone or bone-default element
+    for child in element:
+        if child.tag in BONE_FIELDS:
+            setattr(bone, BONE_FIELDS[child.tag], _float(child.text, child, element))
+        elif child.tag == "inertia":
+            bone.inertia_x, bone.inertia_y, bone.inertia_z = _vector(child, element)
+    return bone
+
+def _read_constraint(element, constraint):
+    for child in element:
+        slot = CONSTRAINT_VECTORS.get(child.tag)
+        if slot is not None:
+            vec = rotate_vector_opengl_to_blender(_vector(child, element))
+            if slot in POSITIVE_VECTORS:
+                vec = tuple(abs(v) for v in vec)
+            setattr(constraint, slot, vec)
+        elif child.tag == "useLinearReferenceFrameA":
+            constraint.useLinearReferenceFrameA = _bool(child.text)
+    return constraint
+
+def _read_shape(element):
+    shape = SMPCollisionShape(name=element.get("name"), collision_mesh_type=element.tag[4:-6])
+    no_collide = []
+    collide = []
+    weight_thresholds = []
+    for child in element:
+        text = (child.text or "").strip()
+        if child.tag == "margin":
+            shape.margin = _float(text, child, element)
+        # Some hand written xmls use SMP's misspelling
+        elif child.tag in ("penetration", "prenetration"):
+            shape.penetration = _float(text, child, element)
+        elif child.tag == "shared":
+            shape.collision_mesh_privacy = text
+        elif child.tag == "tag":
+            shape.tag = text
+        elif child.tag == "no-collide-with-tag":
+            no_collide.append(text)
+        elif child.tag == "can-collide-with-tag":
+            collide.append(text)
+        elif child.tag == "weight-threshold":
+            weight_thresholds.append((child.get("bone", ""), _float(text, child, element)))
+    shape.no_collide_with_tags = no_collide
+    shape.collide_with_tags = collide
+    shape.weight_thresholds = weight_thresholds
+    return shape
+
+def read_xml(filepath):
+    # Returns the SMPSceneData described by an SMP .xml
+    scene_data = SMPSceneData()
+    bone_templates = {"": _default_bone()}
+    constraint_templates = {"": SMPGenericConstraint()}
+
+    def template(templates, name):
+        if name not in templates:
+            raise SMPError(f"{filepath}: unknown template '{name}'")
+        return templates[name]
+
+    depth = 0
+    system_closed = False
+    try:
+        for event, element in ET.iterparse(filepath, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                if depth == 1:
+                    system = element
+                continue
+            depth -= 1
+            if depth == 0:
+                system_closed = True
+                continue
+            if depth != 1:
+                # Children are read with their element
+                continue
+
+            tag = element.tag
+            if tag == "bone-default":
+                bone = _read_bone(element, _copy(template(bone_templates, element.get("extends", ""))))
+                bone_templates[element.get("name", "")] = bone
+            elif tag == "bone":
+                bone = _read_bone(element, _copy(template(bone_templates, element.get("template", ""))))
+                bone.bone_name = element.get("name")
+                if bone.mass == 0.0:
+                    scene_data.statics.push(bone.bone_name)
+                else:
+                    scene_data.kinematics.append(bone)
+            elif tag == "generic-constraint-default":
+                constraint = _read_constraint(
+                    element, _copy(template(constraint_templates, element.get("extends", ""))))
+                constraint_templates[element.get("name", "")] = constraint
+            elif tag == "generic-constraint":
+                constraint = _read_constraint(
+                    element, _copy(template(constraint_templates, element.get("template", ""))))
+                constraint.bodyA = element.get("bodyA")
+                constraint.bodyB = element.get("bodyB")
+                scene_data.constraints.append(constraint)
+            elif tag in SHAPE_ELEMENTS:
+                scene_data.collision_meshes.append(_read_shape(element))
+
+            # Done with this element, drop it from the tree so memory stays flat
+            element.clear()
+            system.clear()
+    except ET.ParseError as e:
+        # The exporter used to end its files with a stray </xml> after </system>, anything after the
+        # document is ignored
+        if not system_closed:
+            raise SMPError(f"Could not parse {filepath}: {e}")
+    except ValueError as e:
+        raise SMPError(f"Could not parse {filepath}: {e}")
+    return scene_data
+
+def main(argv=None):
+    from SMPRigidBodies.SMPSnapshot import save_snapshot, SNAPSHOT_EXT
+
+    parser = argparse.ArgumentParser(description="Convert an SMP .xml into a scene snapshot")
+    parser.add_argument("xml", help="SMP .xml")
+    parser.add_argument("output", nargs="?", help="output snapshot, defaults to the .xml path with "
+                                                  + SNAPSHOT_EXT)
+    args = parser.parse_args(argv)
+
+    output = args.output
+    if output is None:
+        output = (args.xml[:-4] if args.xml.endswith(".xml") else args.xml) + SNAPSHOT_EXT
+    try:
+        scene_data = read_xml(args.xml)
+    except SMPError as e:
+        parser.exit(1, f"ERROR: {e.message}\n")
+    save_snapshot(output, scene_data)
+
+if __name__ == "__main__":
+    main()
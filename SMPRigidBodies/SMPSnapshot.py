@@ -0,0 +1,117 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENSE BLOCK #####
+# Copyright © 2023, OpheliaComplex.
+
+# Snapshots are the captured SMPSceneData written to disk, so xmls can be regenerated without starting blender:
+#   python -m SMPRigidBodies.SMPSnapshot outfit.smpsnap outfit.xml
+# The file is gzipped json. Records are stored as rows of values, with the slot names of each record
+# class written once in the header
+
+import argparse
+import gzip
+import json
+from SMPRigidBodies.SMP_Core_Classes import SMPCollisionShape, SMPKinematicBone, SMPGenericConstraint, \
+    SMPStaticBones, SMPSceneData, SMPError
+
+SNAPSHOT_FORMAT = "smp-snapshot"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_EXT = ".smpsnap"
+
+def _pack(records, cls):
+    return [[getattr(record, slot) for slot in cls.__slots__] for record in records]
+
+def _unpack(rows, cls, slots):
+    return [cls(**dict(zip(slots, row))) for row in rows]
+
+def save_snapshot(filepath, scene_data):
+    snapshot = {
+        "format": SNAPSHOT_FORMAT,
+        "version": SNAPSHOT_VERSION,
+        "slots": {
+            "kinematics": SMPKinematicBone.__slots__,
+            "constraints": SMPGenericConstraint.__slots__,
+            "collision_meshes": SMPCollisionShape.__slots__,
+        },
+        "statics": scene_data.statics.bone_list,
+        "kinematics": _pack(scene_data.kinematics, SMPKinematicBone),
+        "constraints": _pack(scene_data.constraints, SMPGenericConstraint),
+        "collision_meshes": _pack(scene_data.collision_meshes, SMPCollisionShape),
+        "armatures": scene_data.armatures,
+    }
+    with gzip.open(filepath, "wt", encoding="utf-8") as f:
+        json.dump(snapshot, f, separators=(",", ":"))
+
+def load_snapshot(filepath):
+    try:
+        with gzip.open(filepath, "rt", encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError) as e:
+        raise SMPError(f"Could not read snapshot {filepath}: {e}")
+
+    if snapshot.get("format") != SNAPSHOT_FORMAT or snapshot.get("version") != SNAPSHOT_VERSION:
+        raise SMPError(f"{filepath} is not a version {SNAPSHOT_VERSION} SMP snapshot")
+
+    slots = snapshot["slots"]
+    try:
+        return SMPSceneData(SMPStaticBones(snapshot["statics"]),
+                            _unpack(snapshot["kinematics"], SMPKinematicBone, slots["kinematics"]),
+                            _unpack(snapshot["constraints"], SMPGenericConstraint, slots["constraints"]),
+                            _unpack(snapshot["collision_meshes"], SMPCollisionShape, slots["collision_meshes"]),
+                            # Not in snapshots of older versions of the add-on
+                            snapshot.get("armatures"))
+    except TypeError as e:
+        # A slot this version of the records doesn't know about
+        raise SMPError(f"Snapshot {filepath} does not match the SMP records: {e}")
+
+def main(argv=None):
+    from SMPRigidBodies.SMPUtils import write_xml, write_split_xml
+    from SMPRigidBodies.SMPGraph import solver_order
+
+    parser = argparse.ArgumentParser(description="Generate an SMP .xml from a scene snapshot, without blender")
+    parser.add_argument("snapshot", help="snapshot file written by the exporter")
+    parser.add_argument("output", nargs="?", help="output .xml, defaults to the snapshot path with .xml")
+    parser.add_argument("--split", action="store_true",
+                        help="write one .xml per armature (output_<armature>.xml) and the collision meshes "
+                             "into output_collision_meshes.xml")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="processes writing the split .xmls, defaults to the number of cpus")
+    parser.add_argument("--root-to-leaf", action="store_true",
+                        help="write bones and constraints from the roots of the chains outwards")
+    parser.add_argument("--share-defaults", action="store_true",
+                        help="write settings many bones or constraints share once as a named template")
+    args = parser.parse_args(argv)
+
+    output = args.output
+    if output is None:
+        output = args.snapshot[:-len(SNAPSHOT_EXT)] if args.snapshot.endswith(SNAPSHOT_EXT) else args.snapshot
+        output += ".xml"
+
+    try:
+        scene_data = load_snapshot(args.snapshot)
+        if args.root_to_leaf:
+            scene_data = solver_order(scene_data)
+        if args.split:
+            for path, written in write_split_xml(output, scene_data, share_defaults=args.share_defaults,
+                                                  workers=args.jobs, processes=True):
+                print(path)
+        else:
+            write_xml(output, scene_data, share_defaults=args.share_defaults)
+    except SMPError as e:
+        parser.exit(1, f"ERROR: {e.message}\n")
+
+if __name__ == "__main__":
+    main()
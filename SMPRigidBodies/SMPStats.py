@@ -0,0 +1,211 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENSE BLOCK #####
+# Copyright © 2023, OpheliaComplex.
+
+# Export instrumentation: wall time per phase and a few counters, reported by the export operator and
+# optionally written next to the .xml as json. SMPMemoryStats adds the memory every phase needed, traced
+# with tracemalloc, which makes the export itself a few times slower.
+
+import gc
+import json
+import sys
+import time
+import tracemalloc
+
+class SMPExportStats():
+    """Phases can nest, every phase only counts its own time (without the phases inside it), so the phase
+       times add up to the time spent in all of them"""
+
+    def __init__(self):
+        # phase name -> seconds, in the order the phases first ran
+        self.phases = {}
+        # counter name -> int
+        self.counts = {}
+        self.wall_seconds = None
+        self._started = time.perf_counter()
+        # [name, start, seconds spent in nested phases]
+        self._stack = []
+
+    def enter(self, name):
+        self._stack.append([name, time.perf_counter(), 0.0])
+
+    def exit(self):
+        name, start, nested = self._stack.pop()
+        elapsed = time.perf_counter() - start
+        self.phases[name] = self.phases.get(name, 0.0) + elapsed - nested
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def timed_iter(self, name, iterable):
+        # Counts the time spent producing the items of iterable (not consuming them) towards phase name
+        iterator = iter(iterable)
+        while True:
+            self.enter(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.exit()
+            yield item
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def finish(self):
+        self.wall_seconds = time.perf_counter() - self._started
+
+    def summary(self, top=3):
+        # One line for the operator report
+        if self.wall_seconds is None:
+            self.finish()
+        counts = ", ".join(f"{n} {name}" for name, n in self.counts.items() if name != "bytes")
+        slowest = sorted(self.phases.items(), key=lambda item: item[1], reverse=True)[:top]
+        phases = ", ".join(f"{name} {seconds:.3f}s" for name, seconds in slowest)
+        size = self.counts.get("bytes")
+        size = f", {size / 1024:.1f} KiB" if size is not None else ""
+        return f"SMP export: {counts}{size} in {self.wall_seconds:.3f}s ({phases})"
+
+    def to_dict(self):
+        if self.wall_seconds is None:
+            self.finish()
+        return {"wall_seconds": self.wall_seconds, "phases": self.phases, "counts": self.counts}
+
+    def write_json(self, filepath):
+        with open(filepath, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+class _Phase():
+    __slots__ = ("stats", "name")
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.stats.enter(self.name)
+        return self.stats
+
+    def __exit__(self, *exc):
+        self.stats.exit()
+        return False
+
+
+def _mib(size):
+    return f"{size / (1024 * 1024):.1f} MiB"
+
+def record_sizes(scene_data):
+    # Approximate bytes held by the records of every class and the lists they're in, objects shared
+    # between records are counted once
+    seen = set()
+    def size(obj):
+        if id(obj) in seen:
+            return 0
+        seen.add(id(obj))
+        total = sys.getsizeof(obj)
+        if isinstance(obj, (list, tuple)):
+            total += sum(size(item) for item in obj)
+        elif hasattr(obj, "__slots__"):
+            total += sum(size(getattr(obj, slot)) for slot in obj.__slots__)
+        return total
+
+    sizes = {"SMPStaticBones": size(scene_data.statics)}
+    for records in (scene_data.kinematics, scene_data.constraints, scene_data.collision_meshes):
+        if records:
+            name = type(records[0]).__name__
+            sizes[name] = sizes.get(name, 0) + size(records)
+    return sizes
+
+
+class SMPMemoryStats(SMPExportStats):
+    """SMPExportStats that also traces memory. For every phase it keeps the peak allocated on top of what
+       was allocated when the phase started (nested phases included) and what it left allocated.
+       budget is in bytes, exceeding it makes budget_warning return a message"""
+
+    def __init__(self, budget=None):
+        super().__init__()
+        self.budget = budget
+        # phase name -> bytes
+        self.peaks = {}
+        self.retained = {}
+        # record class name -> bytes, see measure_records
+        self.records = {}
+        self.peak = 0
+        # Garbage left from before the export would otherwise be freed in whichever phase the collector runs
+        gc.collect()
+        self._started_tracing = not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+        self._baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        # [memory when the phase started, peak above it so far], parallel to _stack
+        self._memory_stack = []
+
+    def _fold_peak(self):
+        # Fold the peak since the last reset into the overall peak and the peaks of the running phases
+        current, peak = tracemalloc.get_traced_memory()
+        self.peak = max(self.peak, peak - self._baseline)
+        for entry in self._memory_stack:
+            entry[1] = max(entry[1], peak - entry[0])
+        return current
+
+    def enter(self, name):
+        current = self._fold_peak()
+        super().enter(name)
+        self._memory_stack.append([current, 0])
+        tracemalloc.reset_peak()
+
+    def exit(self):
+        name = self._stack[-1][0]
+        current = self._fold_peak()
+        super().exit()
+        start, peak = self._memory_stack.pop()
+        self.peaks[name] = max(self.peaks.get(name, 0), peak)
+        self.retained[name] = self.retained.get(name, 0) + current - start
+
+    def measure_records(self, scene_data):
+        self.records = record_sizes(scene_data)
+
+    def finish(self):
+        super().finish()
+        if tracemalloc.is_tracing():
+            self._fold_peak()
+            if self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+
+    def budget_warning(self, top=3):
+        # None, or which phases and records took the most if the peak went over the budget
+        if self.budget is None or self.peak <= self.budget:
+            return None
+        phases = sorted(self.peaks.items(), key=lambda item: item[1], reverse=True)[:top]
+        records = sorted(self.records.items(), key=lambda item: item[1], reverse=True)[:top]
+        contributors = ", ".join(f"{name} {_mib(size)}" for name, size in phases + records)
+        return f"SMP export peaked at {_mib(self.peak)}, over the budget of {_mib(self.budget)}: {contributors}"
+
+    def summary(self, top=3):
+        return f"{super().summary(top)}, peak {_mib(self.peak)}"
+
+    def to_dict(self):
+        result = super().to_dict()
+        result["memory"] = {"peak": self.peak, "budget": self.budget, "phase_peaks": self.peaks,
+                            "phase_retained": self.retained, "records": self.records}
+        return result
@@ -16,100 +16,593 @@
 # ##### END GPL LICENSE BLOCK #####
 # Copyright © 2023, OpheliaComplex.
 
-import bpy
-from SMPRigidBodies.SMP_Core_Classes import SMPCollisionShape, SMPKinematicBone, SMPStaticBones, SMPGenericConstraint
+import hashlib
+import os
+import re
+import shutil
+import threading
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import nullcontext
+from SMPRigidBodies.SMP_Core_Classes import SMPCollisionShape, SMPKinematicBone, SMPStaticBones, \
+    SMPGenericConstraint, SMPSceneData, SMPError, strip_rbb_suffix, record_key
+from SMPRigidBodies.SMPMath import constraints_to_opengl
+from SMPRigidBodies.SMPDefaults import factor_defaults, template_name
+from SMPRigidBodies.SMPFormat import SMPFormat
+
+XML_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<system xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:noNamespaceSchemaLocation="description.xsd">\n\n"""
+XML_FOOTER = """\n\n</system>
+</xml>"""
+
+# Names of the named bone-default / generic-constraint-default templates
+BONE_TEMPLATE_PREFIX = "smp-bone"
+CONSTRAINT_TEMPLATE_PREFIX = "smp-constraint"
+
+# File name suffix of the shared collision mesh file of split exports
+SHAPES_FILE_SUFFIX = "collision_meshes"
+UNSAFE_FILENAME_CHARACTERS = re.compile(r"[^\w.-]+")
+
+# Fragments are small, let the file object batch them into large writes
+WRITE_BUFFER_SIZE = 1 << 16
+
+# Rigid body bones puts the objects of every armature into these children of its " [Container]" collection
+RBB_COLLECTION_KINDS = {
+    " [Passives]": "statics",
+    " [Actives]": "kinematics",
+    " [Joints]": "joints",
+}
+
+def collection_kind(name):
+    # "statics", "kinematics", "joints" or None, from the suffix of a rigid body bones collection name
+    return RBB_COLLECTION_KINDS.get(name[name.rfind(" ["):])
+
+def iter_collections(roots):
+    # Iterative depth first walk over trees of blender collections, parents before children.
+    # A collection linked into several parents is only visited once
+    seen = set()
+    stack = list(reversed(roots))
+    while stack:
+        collection = stack.pop()
+        pointer = collection.as_pointer()
+        if pointer in seen:
+            continue
+        seen.add(pointer)
+        yield collection
+        stack.extend(reversed(collection.children))
 
-def traverse_tree(t):
-    # Func to traverse trees of blender collections
-    yield t
-    for child in t.children:
-        yield from traverse_tree(child)
 
-def parse_scene(scene):
+class SMPSceneIndex():
+    """The objects of a scene sorted by what they are exported as. Every object is in here at most once,
+       even if it is linked into several collections"""
+    __slots__ = ("statics", "kinematics", "joints", "collision_meshes", "seen")
+
+    def __init__(self):
+        # (object, armature data name) for the rigid body bones objects
+        self.statics = []
+        self.kinematics = []
+        self.joints = []
+        self.collision_meshes = []
+        # as_pointer() of every object visited so far
+        self.seen = set()
+
+    def visit(self, obj):
+        # True the first time an object is visited
+        pointer = obj.as_pointer()
+        if pointer in self.seen:
+            return False
+        self.seen.add(pointer)
+        return True
+
+
+def index_scene(scene):
+    # Single pass over the scene, sorting every object into statics, kinematics, joints and collision meshes
+    index = SMPSceneIndex()
     # Collect hard coded top scene-level collection (the "Scene Collection")
     top_collection = scene.collection
+    rigid_body_bones = [c for c in top_collection.children if c.name == "RigidBodyBones"]
+    others = [c for c in top_collection.children if c.name != "RigidBodyBones"]
+
+    # Rigid body bones objects go first, so a [Passive] linked somewhere else is still a static bone and
+    # not also a collision mesh
+    for collection in rigid_body_bones:
+        for armature_collections in collection.children:
+            # Rigid body bones names the armature collection after its data property name, ie
+            # armature.data.name + " [Container]"
+            # This is different to the armature OBJECT name
+            arma_name = armature_collections.name.replace(" [Container]" ,"")
+            for armature_collection_child in armature_collections.children:
+                kind = collection_kind(armature_collection_child.name)
+                if kind is None:
+                    continue
+                for obj in armature_collection_child.objects:
+                    if not index.visit(obj):
+                        continue
+                    if kind == "statics":
+                        index.statics.append((obj, arma_name))
+                    elif kind == "kinematics":
+                        index.kinematics.append((obj, arma_name))
+                    elif obj.rigid_body_constraint is not None:
+                        index.joints.append((obj, arma_name))
+
+    # All other collections, then the objects directly in the top-level scene collection.
+    # Find rigid bodies that are not part of rigidbodybones collection
+    def other_objects():
+        for c in iter_collections(others):
+            yield from c.objects
+        yield from top_collection.objects
+
+    for obj in other_objects():
+        if obj.rigid_body is None or not index.visit(obj):
+            continue
+        if obj.rigid_body.type == "PASSIVE":
+            # Collision meshes with a proxy in the scene are exported as the proxy, see SMPProxy.py
+            proxy = obj.smp_collision_proxy
+            if proxy is not None and scene.objects.get(proxy.name) == proxy:
+                continue
+            index.collision_meshes.append(obj)
+        else:
+            # Warn the user that it found a rigid body that could be intended to be a collision mesh
+            # But is defined as 'ACTIVE' and thus will be ignored
+            print(f"WARNING: Found a passive rigid body {obj.name}, set to 'ACTIVE' to export as a "
+                  f"collision mesh.")
+    return index
+
+def index_armature_bones(armature):
+    # name -> bone and name -> rigid_body_bones_extra_props for one armature, built once per armature container
+    # instead of looking up every bone by name through RNA
+    bones = {bone.name: bone for bone in armature.bones}
+    extra_props = {name: bone.rigid_body_bones_extra_props for name, bone in bones.items()}
+    return bones, extra_props
+
+def _phase(stats, name):
+    # stats.phase(name) of an SMPStats.SMPExportStats, or nothing
+    return stats.phase(name) if stats is not None else nullcontext()
+
+def _timed(stats, name, iterable):
+    return stats.timed_iter(name, iterable) if stats is not None else iterable
+
+def resolve_tag_presets(scene):
+    # Tag preset name -> its tags, read once per export and shared by every shape using the preset
+    return {preset.name: [item.name for item in preset.tags] for preset in scene.smp_tag_presets}
+
+def parse_scene(scene, cache=None, stats=None):
+    # Capture everything the exporter needs from the scene into plain SMP records, this is the only place
+    # generate_xml reads blender data.
+    # With an SMPCache.SMPFragmentCache, records of objects that didn't change since the last export are reused
+    with _phase(stats, "traversal"):
+        index = index_scene(scene)
+    with _phase(stats, "capture"):
+        return capture_index(index, cache, resolve_tag_presets(scene))
+
+def capture_index(index, cache=None, presets=None):
+    # presets: see resolve_tag_presets
+    # bpy is imported here so the rest of this module runs without blender
+    import bpy
+
+    if cache is not None:
+        cache.begin_capture()
 
     statics = SMPStaticBones()
+    for obj, arma_name in index.statics:
+        statics.push(obj.name)
+
     kinematics = []
+    # Bones that have an [Active] object but could not be found in their armature, reported all at once
+    missing_bones = []
+    extra_props_indices = {}
+    kinematic_armatures = []
+    for obj, arma_name in index.kinematics:
+        if cache is not None:
+            record = cache.cached_record(obj, arma_name)
+            if record is not None:
+                kinematics.append(record)
+                kinematic_armatures.append(arma_name)
+                continue
+        extra_props_index = extra_props_indices.get(arma_name)
+        if extra_props_index is None:
+            armature = bpy.data.armatures.get(arma_name)
+            extra_props_index = index_armature_bones(armature)[1] if armature is not None else {}
+            extra_props_indices[arma_name] = extra_props_index
+        bone_name = strip_rbb_suffix(obj.name)
+        bone_data = extra_props_index.get(bone_name)
+        if bone_data is None:
+            missing_bones.append(f"{arma_name}: {bone_name}")
+            continue
+        record = SMPKinematicBone.from_object(obj, bone_data)
+        if cache is not None:
+            cache.store_record(obj, record)
+        kinematics.append(record)
+        kinematic_armatures.append(arma_name)
+
+    if missing_bones:
+        raise SMPError(f"Could not find the armature bones of {len(missing_bones)} active rigid bodies: "
+                       + ", ".join(missing_bones))
+
     hkx_constraints_list = []
+    for obj, arma_name in index.joints:
+        record = cache.cached_constraint(obj) if cache is not None else None
+        if record is None:
+            record = SMPGenericConstraint.from_constraint(obj.rigid_body_constraint)
+            if cache is not None:
+                cache.store_record(obj, record)
+        hkx_constraints_list.append(record)
+
+    presets = presets or {}
+    missing_presets = [f"{obj.name}: {name}" for obj in index.collision_meshes
+                       for name in (obj.smp_no_collide_preset, obj.smp_collide_preset) if name and name not in presets]
+    if missing_presets:
+        raise SMPError(f"{len(missing_presets)} collision meshes use tag presets that don't exist: "
+                       + ", ".join(missing_presets))
+    # Editing a preset doesn't touch the objects using it, the cache can't tell them apart
+    presets_changed = cache is not None and cache.presets_changed(presets)
+
     collision_meshes = []
+    for obj in index.collision_meshes:
+        record = None
+        if cache is not None and not (presets_changed and (obj.smp_no_collide_preset or obj.smp_collide_preset)):
+            record = cache.cached_record(obj)
+        if record is None:
+            record = SMPCollisionShape.from_object(obj, presets)
+            if cache is not None:
+                cache.store_record(obj, record)
+        collision_meshes.append(record)
+
+    if cache is not None:
+        cache.end_capture()
+    armatures = {
+        "statics": [arma_name for obj, arma_name in index.statics],
+        "kinematics": kinematic_armatures,
+        "constraints": [arma_name for obj, arma_name in index.joints],
+    }
+    return SMPSceneData(statics, kinematics, hkx_constraints_list, collision_meshes, armatures)
+
+
+def _bone_templates(kinematics, share_defaults, xml_format, stats=None):
+    # (templates, [(bone, template index)]), the index is None for bones written in full
+    templates, assignment = [], []
+    if share_defaults:
+        with _phase(stats, "defaults"):
+            templates, assignment = factor_defaults([xml_format.bone_fields(bone) for bone in kinematics])
+    if not templates:
+        assignment = [None] * len(kinematics)
+    return templates, list(zip(kinematics, assignment))
+
+def _generate_kinematics(templates, bones, xml_format):
+    for kinematic_bone, index in bones:
+        if index is None:
+            yield xml_format.bone(kinematic_bone)
+        else:
+            yield xml_format.bone(kinematic_bone, templates[index], template_name(BONE_TEMPLATE_PREFIX, index))
+
+def _generate_collision_meshes(collision_meshes, xml_format):
+    for collision_mesh in collision_meshes:
+        yield xml_format.shape(collision_mesh)
 
-    for collection in top_collection.children:
-        # Find the RigidBodyBones collection
-        if collection.name == "RigidBodyBones":
-            for armature_collections in collection.children:
-                # Rigid body bones names the armature collection after its data property name, ie
-                # armature.data.name + " [Container]"
-                # This is different to the armature OBJECT name
-                arma_name = armature_collections.name.replace(" [Container]" ,"")
-                for armature_collection_child in armature_collections.children:
-                    if " [Passives]" in armature_collection_child.name:
-                        for obj in armature_collection_child.objects:
-                            bone_name = obj.name.replace(" [Passive]" ,"")
-                            statics.push(obj)
-
-                    if " [Actives]" in armature_collection_child.name:
-                        for obj in armature_collection_child.objects:
-                            bone_name = obj.name.replace(" [Active]" ,"")
-                            kinematics.append(SMPKinematicBone(obj, arma_name))
-
-                    if " [Joints]" in armature_collection_child.name:
-                        for obj in armature_collection_child.objects:
-                            if obj.rigid_body_constraint is not None:
-                                constr = obj.rigid_body_constraint
-
-                                hkx_constr = SMPGenericConstraint(constr)
-                                hkx_constraints_list.append(hkx_constr)
+def _constraint_templates(constraints, share_defaults, xml_format, stats=None):
+    # (templates, [(constraint, converted vectors, template index)]), the index is None for constraints
+    # written in full. Templates compare the written values, so everything is converted up front
+    with _phase(stats, "constraint conversion"):
+        converted = constraints_to_opengl(constraints).tolist()
+    templates, assignment = [], []
+    if share_defaults:
+        with _phase(stats, "defaults"):
+            templates, assignment = factor_defaults([xml_format.constraint_fields(constraint, vectors)
+                                                     for constraint, vectors in zip(constraints, converted)])
+    if not templates:
+        assignment = [None] * len(constraints)
+    return templates, list(zip(constraints, converted, assignment))
 
+def _generate_templated_constraints(templates, constraints, xml_format):
+    for hkx_constraint, hkx_converted, index in constraints:
+        if index is None:
+            yield xml_format.constraint(hkx_constraint, hkx_converted)
         else:
-            # All other collections
-            # Find rigid bodies that are not part of rigidbodybones collection but is in some other high level collection
-
-            # Traverse these and find all objs
-            for c in traverse_tree(collection):
-                for obj in c.objects:
-                    if obj.rigid_body is not None:
-                        if obj.rigid_body.type == "PASSIVE":
-                            collision_meshes.append(SMPCollisionShape(obj))
-                        else:
-                            # Warn the user that it found a rigid body that could be intended to be a collision mesh
-                            # But is defined as 'ACTIVE' and thus will be ignored
-                            print(f"WARNING: Found a passive rigid body {obj.name}, set to 'ACTIVE' to export as a "
-                                  f"collision mesh.")
-
-    for obj in top_collection.objects:
-        # All objects in the top-level scene collection
-        if obj.rigid_body is not None:
-            if obj.rigid_body.type == "PASSIVE":
-                collision_meshes.append(SMPCollisionShape(obj))
+            yield xml_format.constraint(hkx_constraint, hkx_converted, templates[index],
+                                        template_name(CONSTRAINT_TEMPLATE_PREFIX, index))
+
+def _fragment_keys(items, templates, xml_format):
+    # Items are (record, ..., template index), their fragments also depend on the template and the format
+    return [(record_key(item[0]), item[-1], None if item[-1] is None else templates[item[-1]], xml_format.key)
+            for item in items]
+
+def iter_xml(scene, cache=None, stats=None, share_defaults=False, xml_format=None):
+    # Yields the xml a fragment at a time (roughly one per element), so it can be streamed to a file
+    # without ever holding the whole document.
+    # Accepts either a blender scene or already captured SMPSceneData, e.g. from SMPSnapshot.load_snapshot.
+    # With an SMPCache.SMPFragmentCache only elements whose records changed since the last export are generated.
+    # With an SMPStats.SMPExportStats the time spent on every element type is recorded.
+    # With share_defaults settings shared by many elements are written once as defaults, see SMPDefaults.
+    # xml_format is an SMPFormat.SMPFormat, e.g. SMPCompactFormat, the indented layout by default
+    if isinstance(scene, SMPSceneData):
+        scene_data = scene
+    else:
+        scene_data = parse_scene(scene, cache, stats)
+    if xml_format is None:
+        xml_format = SMPFormat()
+
+    if stats is not None:
+        stats.count("bones", len(scene_data.statics.bone_list) + len(scene_data.kinematics))
+        stats.count("constraints", len(scene_data.constraints))
+        stats.count("shapes", len(scene_data.collision_meshes))
+
+    bone_templates, bones = _bone_templates(scene_data.kinematics, share_defaults, xml_format, stats)
+    constraint_templates, constraints = _constraint_templates(scene_data.constraints, share_defaults, xml_format,
+                                                              stats)
+
+    def generate_kinematics(bones):
+        return _generate_kinematics(bone_templates, bones, xml_format)
+
+    def generate_collision_meshes(collision_meshes):
+        return _generate_collision_meshes(collision_meshes, xml_format)
+
+    def generate_constraints(constraints):
+        return _generate_templated_constraints(constraint_templates, constraints, xml_format)
+
+    # Add header, statics, kinematics, collision meshes, constraints, footer.
+    # The named bone templates go after the statics, those use the unnamed bone-default
+    yield XML_HEADER
+    yield from _timed(stats, "serialize statics", xml_format.statics(scene_data.statics))
+    for index, template in enumerate(bone_templates):
+        yield xml_format.bone_default(template, template_name(BONE_TEMPLATE_PREFIX, index))
+    if cache is None:
+        yield from _timed(stats, "serialize bones", generate_kinematics(bones))
+        yield from _timed(stats, "serialize shapes", generate_collision_meshes(scene_data.collision_meshes))
+    else:
+        cache.begin_fragments()
+        yield from _timed(stats, "serialize bones",
+                          cache.iter_fragments(bones, generate_kinematics,
+                                               _fragment_keys(bones, bone_templates, xml_format)))
+        shape_keys = [(record_key(shape), xml_format.key) for shape in scene_data.collision_meshes]
+        yield from _timed(stats, "serialize shapes",
+                          cache.iter_fragments(scene_data.collision_meshes, generate_collision_meshes, shape_keys))
+    for index, template in enumerate(constraint_templates):
+        yield xml_format.constraint_default(template, template_name(CONSTRAINT_TEMPLATE_PREFIX, index))
+    if cache is None:
+        yield from _timed(stats, "serialize constraints", generate_constraints(constraints))
+    else:
+        yield from _timed(stats, "serialize constraints",
+                          cache.iter_fragments(constraints, generate_constraints,
+                                               _fragment_keys(constraints, constraint_templates, xml_format)))
+        cache.end_fragments()
+        if stats is not None:
+            stats.count("cached", cache.hits)
+    yield XML_FOOTER
+
+
+# Path -> ((st_mtime_ns, st_size), digest) of files written or read by write_fragments
+_digests = {}
+
+def file_digest(filepath):
+    # sha256 of the text of a file, as write_fragments computes it, None if it can't be read.
+    # Remembered by modification time and size, so files written by the last export aren't read again
+    try:
+        st = os.stat(filepath)
+    except OSError:
+        return None
+    stamp = (st.st_mtime_ns, st.st_size)
+    known = _digests.get(filepath)
+    if known is not None and known[0] == stamp:
+        return known[1]
+    digest = hashlib.sha256()
+    try:
+        # Same encoding and newlines as writing
+        with open(filepath, "r", buffering=WRITE_BUFFER_SIZE) as f:
+            for chunk in iter(lambda: f.read(WRITE_BUFFER_SIZE), ""):
+                digest.update(chunk.encode("utf-8"))
+    except (OSError, UnicodeError):
+        return None
+    digest = digest.digest()
+    _digests[filepath] = (stamp, digest)
+    return digest
+
+def write_fragments(filepath, fragments, stats=None, cancel=None):
+    # Write fragments into a temporary file next to filepath that is then renamed over it, so filepath is
+    # always either the old or the complete new file. If the content is what filepath already holds the
+    # temporary file is dropped and filepath is left untouched, mtime included.
+    # cancel is a threading.Event checked between fragments.
+    # Returns (characters written, whether filepath changed), or None when cancelled
+    directory, name = os.path.split(os.path.abspath(filepath))
+    temp_path = os.path.join(directory, f".{name}.{uuid.uuid4().hex[:8]}.tmp")
+    digest = hashlib.sha256()
+    written = 0
+    try:
+        with open(temp_path, "x", buffering=WRITE_BUFFER_SIZE) as f:
+            for fragment in fragments:
+                if cancel is not None and cancel.is_set():
+                    break
+                with _phase(stats, "write"):
+                    written += f.write(fragment)
+                    digest.update(fragment.encode("utf-8"))
+            with _phase(stats, "write"):
+                f.flush()
+                os.fsync(f.fileno())
+        if cancel is not None and cancel.is_set():
+            os.remove(temp_path)
+            return None
+
+        digest = digest.digest()
+        if digest == file_digest(filepath):
+            os.remove(temp_path)
+            return written, False
+        if os.path.exists(filepath):
+            shutil.copymode(filepath, temp_path)
+        os.replace(temp_path, filepath)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    st = os.stat(filepath)
+    _digests[filepath] = ((st.st_mtime_ns, st.st_size), digest)
+    return written, True
+
+def write_xml(filepath, scene, cache=None, stats=None, share_defaults=False, xml_format=None, cancel=None):
+    # Stream the xml into filepath (see write_fragments), returns the number of characters of the xml,
+    # None if cancel was set
+    return _write_counted(filepath, iter_xml(scene, cache, stats, share_defaults, xml_format), stats, cancel)
+
+def _write_counted(filepath, fragments, stats, cancel=None):
+    result = write_fragments(filepath, fragments, stats, cancel)
+    if result is None:
+        return None
+    written, changed = result
+    if stats is not None:
+        stats.count("bytes", os.path.getsize(filepath))
+        if not changed:
+            stats.count("unchanged")
+    return written
+
+
+def generate_xml(scene, cache=None, stats=None, share_defaults=False, xml_format=None):
+    return "".join(iter_xml(scene, cache, stats, share_defaults, xml_format))
+
+
+def split_by_armature(scene_data, shared_shapes=True):
+    # [(name, SMPSceneData)], one per armature with its static bones, kinematic bones and constraints, in
+    # the order they were captured. The collision meshes go into every armature's data, or with
+    # shared_shapes into one more entry of their own, with all static bones for the shapes to be skinned to
+    armatures = scene_data.armatures
+    if not armatures:
+        raise SMPError("The scene data doesn't say which armature the bones belong to, it can't be split")
+
+    split = {}
+    def armature_data(arma_name):
+        data = split.get(arma_name)
+        if data is None:
+            data = split[arma_name] = SMPSceneData(collision_meshes=() if shared_shapes else
+                                                   scene_data.collision_meshes)
+        return data
+
+    for bone_name, arma_name in zip(scene_data.statics.bone_list, armatures["statics"]):
+        armature_data(arma_name).statics.bone_list.append(bone_name)
+    for bone, arma_name in zip(scene_data.kinematics, armatures["kinematics"]):
+        armature_data(arma_name).kinematics.append(bone)
+    for constraint, arma_name in zip(scene_data.constraints, armatures["constraints"]):
+        armature_data(arma_name).constraints.append(constraint)
+
+    # SMP can't load a file without static bones
+    no_statics = [arma_name for arma_name, data in split.items() if not data.statics.bone_list]
+    if no_statics:
+        raise SMPError(f"Armatures without static bones can't be exported to a file of their own: "
+                       f"{', '.join(no_statics)}")
+    split = list(split.items())
+    if shared_shapes and scene_data.collision_meshes:
+        split.append((SHAPES_FILE_SUFFIX, SMPSceneData(scene_data.statics, (), (), scene_data.collision_meshes)))
+    return split
+
+def split_filepath(filepath, name):
+    # outfit.xml (or outfit) -> outfit_<name>.xml, with anything that doesn't belong in a file name replaced
+    return f"{os.path.splitext(filepath)[0]}_{UNSAFE_FILENAME_CHARACTERS.sub('_', name)}.xml"
+
+def write_split_xml(filepath, scene_data, share_defaults=False, xml_format=None, shared_shapes=True,
+                    workers=None, processes=False, cancel=None, progress=None):
+    # One xml per armature next to filepath (see split_by_armature and split_filepath), serialized in a pool
+    # of workers threads, or processes with processes. Returns [(path, characters written)].
+    # cancel is a threading.Event checked before and between files, and by the files being written with
+    # threads. Returns None if it was set, the files written until then stay. progress is called with
+    # (files written, number of files) after every file
+    split = split_by_armature(scene_data, shared_shapes)
+    jobs = [(split_filepath(filepath, name), data) for name, data in split]
+    labels = [f"armature {name}" for name, _ in split]
+    if shared_shapes and scene_data.collision_meshes:
+        labels[-1] = "the shared collision meshes"
+    by_path = {}
+    for (path, _), label in zip(jobs, labels):
+        # Windows file names ignore case
+        by_path.setdefault(path.casefold(), []).append(label)
+    clashes = [" and ".join(same_path) for same_path in by_path.values() if len(same_path) > 1]
+    if clashes:
+        raise SMPError(f"These would be written to the same file, rename them: {', '.join(clashes)}")
+    if cancel is not None and cancel.is_set():
+        return None
+    pool = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    # An Event can't be sent to another process, those files are only cancelled before they start
+    file_cancel = None if processes else cancel
+    with pool(max_workers=workers) as executor:
+        futures = [executor.submit(write_xml, path, data, None, None, share_defaults, xml_format, file_cancel)
+                   for path, data in jobs]
+        written = []
+        for (path, data), future in zip(jobs, futures):
+            characters = None if cancel is not None and cancel.is_set() else future.result()
+            if characters is None:
+                for pending in futures:
+                    pending.cancel()
+                return None
+            written.append((path, characters))
+            if progress is not None:
+                progress(len(written), len(jobs))
+        return written
+
+
+class SMPWriteJob():
+    """Writes captured scene data on a background thread, so blender stays responsive (see the exporter's
+       background mode). Progress and the result are read from the main thread while it runs"""
+
+    def __init__(self, filepath, scene_data, cache=None, stats=None, share_defaults=False, xml_format=None,
+                 split=False, shared_shapes=True):
+        self.filepath = filepath
+        self.scene_data = scene_data
+        self.cache = cache
+        self.stats = stats
+        self.share_defaults = share_defaults
+        self.xml_format = xml_format
+        self.split = split
+        self.shared_shapes = shared_shapes
+        # Roughly one fragment per element, defaults and headers make it a bit more
+        self.total = (len(scene_data.statics.bone_list) + len(scene_data.kinematics) +
+                      len(scene_data.collision_meshes) + len(scene_data.constraints) + 2)
+        self.done = 0
+        self.error = None
+        # [(path, characters written)], stays None if the export failed or was cancelled
+        self.written = None
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="SMP export", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def progress(self):
+        return min(self.done / self.total, 1.0)
+
+    def _run(self):
+        try:
+            if self.split:
+                with _phase(self.stats, "write split"):
+                    self.written = write_split_xml(self.filepath, self.scene_data, self.share_defaults,
+                                                   self.xml_format, self.shared_shapes, cancel=self._cancel,
+                                                   progress=self._files_written)
             else:
-                # Warn the user that it found a rigid body that could be intended to be a collision mesh
-                # But is defined as 'ACTIVE' and thus will be ignored
-                print(f"WARNING: Found a passive rigid body {obj.name}, set to 'ACTIVE' to export as a "
-                      f"collision mesh.")
-    return statics, kinematics, hkx_constraints_list, collision_meshes
+                self._write()
+        except SMPError as e:
+            self.error = e.message
+        except OSError as e:
+            self.error = f"Could not write {self.filepath}: {e}"
+        except Exception as e:
+            # Last resort, anything else would leave error unset and the export would look successful
+            print(traceback.format_exc())
+            self.error = f"SMP export failed: {type(e).__name__}: {e}"
 
+    def _write(self):
+        fragments = iter_xml(self.scene_data, self.cache, self.stats, self.share_defaults, self.xml_format)
+        written = _write_counted(self.filepath, self._count(fragments), self.stats, self._cancel)
+        if written is not None:
+            self.written = [(self.filepath, written)]
 
-def generate_xml(scene):
+    def _files_written(self, files_done, files):
+        self.done = self.total * files_done / files
 
-    statics, kinematics, hkx_constraints, collision_meshes = parse_scene(scene)
-    header = """<?xml version="1.0" encoding="UTF-8"?>
-<system xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:noNamespaceSchemaLocation="description.xsd">\n\n"""
-    footer = """\n\n</system>
-</xml>"""
-    # Add header, statics, kinematics, collision meshes, constraints, footer
-    full_xml_string = header
-    full_xml_string += statics.generate_string()
-    if kinematics:
-        for kinematic_bone in kinematics:
-            full_xml_string += kinematic_bone.generate_string()
-    if collision_meshes:
-        for collision_mesh in collision_meshes:
-            full_xml_string += collision_mesh.generate_string()
-    if hkx_constraints:
-        for hkx_constraint in hkx_constraints:
-            full_xml_string += hkx_constraint.generate_string()
-
-    full_xml_string += footer
-
-    return full_xml_string
\ No newline at end of file
+    def _count(self, fragments):
+        for fragment in fragments:
+            yield fragment
+            self.done += 1
@@ -16,8 +16,8 @@
 # ##### END GPL LICENSE BLOCK #####
 # Copyright © 2023, OpheliaComplex.
 
-import bpy
-from mathutils import Vector
+# Nothing in here touches bpy. The from_* classmethods read Blender objects by attribute only, so the
+# records can be captured inside Blender and serialized anywhere, see SMPSnapshot.py
 from SMPRigidBodies.SMPMath import rotate_vector_blender_to_opengl
 
 # Custom SMP error
@@ -25,54 +25,109 @@ class SMPError(Exception):
     def __init__(self, message):
         self.message = message
 
+# Rigid body bones names its objects after the bone they belong to plus one of these suffixes
+RBB_SUFFIXES = frozenset((" [Passive]", " [Active]", " [Blank]"))
+
+def strip_rbb_suffix(name):
+    suffix_start = name.rfind(" [")
+    if suffix_start != -1 and name[suffix_start:] in RBB_SUFFIXES:
+        return name[:suffix_start]
+    return name
+
+def record_key(record):
+    # Everything generate_string reads from a record, hashable
+    values = []
+    for slot in record.__slots__:
+        value = getattr(record, slot)
+        if isinstance(value, list):
+            value = tuple(value)
+        values.append(value)
+    return type(record).__name__, tuple(values)
+
+def _preset_tags(presets, preset_name, own_tags):
+    tags = presets.get(preset_name) if preset_name else None
+    if tags is None:
+        return own_tags
+    if not own_tags:
+        return list(tags)
+    return list(dict.fromkeys(tags + own_tags))
+
+def object_weight_thresholds(obj):
+    # (bone, weight) of every vertex group of obj, from the shape's weight threshold unless the bone has its
+    # own. SMP has no threshold for the whole shape, it is written out for every bone
+    own = {item.name: item.threshold for item in obj.smp_bone_weight_thresholds}
+    bones = [group.name for group in obj.vertex_groups] if obj.smp_weight_threshold > 0.0 else []
+    bones.extend(bone for bone in own if bone not in bones)
+    thresholds = [(bone, own.get(bone, obj.smp_weight_threshold)) for bone in bones]
+    return [(bone, weight) for bone, weight in thresholds if weight > 0.0]
+
 class SMPCollisionShape():
-    collision_mesh_type = "vertex"
-    collision_mesh_privacy = "private"
-    no_collide_with_tags = []
-    collide_with_tags = []
-    name = "UNNAMED"
-    tag = "collision_mesh"
-    margin = 0.1
-    penetration = 0.1
-
-    #TODO: add weight-threshold ?
-
-    def __init__(self, obj):
-        rb_obj = obj.rigid_body
-        self.name = obj.name
-        self.margin = rb_obj.collision_margin
+    __slots__ = ("name", "tag", "collision_mesh_type", "collision_mesh_privacy", "margin", "penetration",
+                 "no_collide_with_tags", "collide_with_tags", "weight_thresholds")
+
+    def __init__(self, name="UNNAMED", tag="collision_mesh", collision_mesh_type="vertex",
+                 collision_mesh_privacy="private", margin=0.1, penetration=0.1,
+                 no_collide_with_tags=(), collide_with_tags=(), weight_thresholds=()):
+        self.name = name
+        self.tag = tag
+        self.collision_mesh_type = collision_mesh_type
+        self.collision_mesh_privacy = collision_mesh_privacy
+        self.margin = margin
+        self.penetration = penetration
+        self.no_collide_with_tags = list(no_collide_with_tags)
+        self.collide_with_tags = list(collide_with_tags)
+        # (bone, weight) pairs, SMP leaves out the vertices of a per-vertex shape that no bone weights above
+        # that bone's threshold
+        self.weight_thresholds = [(bone, float(weight)) for bone, weight in weight_thresholds]
+
+    @classmethod
+    def from_object(cls, obj, presets=None):
+        # presets: tag preset name -> tags, see SMPUtils.resolve_tag_presets. The tag lists of an object
+        # using a preset are the preset's tags followed by its own
+        shape = cls(name=obj.name, margin=obj.rigid_body.collision_margin)
 
         if obj.no_collide_with_tags:
-            self.no_collide_with_tags = [x.name for x in obj.no_collide_with_tags]
+            shape.no_collide_with_tags = [x.name for x in obj.no_collide_with_tags]
         if obj.collide_with_tags:
-            self.collide_with_tags = [x.name for x in obj.collide_with_tags]
+            shape.collide_with_tags = [x.name for x in obj.collide_with_tags]
+        if presets:
+            shape.no_collide_with_tags = _preset_tags(presets, obj.smp_no_collide_preset, shape.no_collide_with_tags)
+            shape.collide_with_tags = _preset_tags(presets, obj.smp_collide_preset, shape.collide_with_tags)
         if obj.smp_col_type:
-            self.collision_mesh_type = obj.smp_col_type
+            shape.collision_mesh_type = obj.smp_col_type
         if obj.smp_col_privacy:
-            self.collision_mesh_privacy = obj.smp_col_privacy
+            shape.collision_mesh_privacy = obj.smp_col_privacy
         if obj.smp_tag:
-            self.tag = obj.smp_tag
+            shape.tag = obj.smp_tag
+        shape.weight_thresholds = object_weight_thresholds(obj)
+        return shape
 
-    def generate_string(self):
-        output_string = f"""    <per-{self.collision_mesh_type}-shape name="{self.name}">
+    def vertex_weight_thresholds(self):
+        # The weight thresholds written to the xml, SMP only reads them for per-vertex shapes
+        return self.weight_thresholds if self.collision_mesh_type == "vertex" else ()
+
+    def iter_strings(self):
+        yield f"""    <per-{self.collision_mesh_type}-shape name="{self.name}">
         <margin>{self.margin}</margin>
         <shared>{self.collision_mesh_privacy}</shared>
         <penetration>{self.penetration}</penetration>
         <tag>{self.tag}</tag>\n"""
-        if self.no_collide_with_tags:
-            for no_collide_tag in self.no_collide_with_tags:
-                output_string += f"""        <no-collide-with-tag>{no_collide_tag}</no-collide-with-tag>\n"""
-        if self.collide_with_tags:
-            for collide_tag in self.collide_with_tags:
-                output_string += f"""        <can-collide-with-tag>{collide_tag}</can-collide-with-tag>\n"""
-        output_string += f"""    </per-{self.collision_mesh_type}-shape>\n\n"""
+        for bone, weight in self.vertex_weight_thresholds():
+            yield f"""        <weight-threshold bone="{bone}">{weight}</weight-threshold>\n"""
+        for no_collide_tag in self.no_collide_with_tags:
+            yield f"""        <no-collide-with-tag>{no_collide_tag}</no-collide-with-tag>\n"""
+        for collide_tag in self.collide_with_tags:
+            yield f"""        <can-collide-with-tag>{collide_tag}</can-collide-with-tag>\n"""
+        yield f"""    </per-{self.collision_mesh_type}-shape>\n\n"""
 
-        return output_string
+    def generate_string(self):
+        return "".join(self.iter_strings())
 
 
 class SMPStaticBones():
     """This a container for multiple static bones, very primitive.
        It's just a 'header' and a list of bones"""
+    __slots__ = ("bone_list",)
 
     header = """    <bone-default>
         <mass>0</mass>
@@ -89,75 +144,114 @@ class SMPStaticBones():
         <gravity-factor>0.000</gravity-factor>
     </bone-default>\n\n"""
 
-    bone_list = []
-
-    def __init__(self):
+    def __init__(self, bone_list=()):
         # When initialized the bone_list should be empty
-        self.bone_list = []
+        self.bone_list = list(bone_list)
 
-    def push(self, bone):
+    def push(self, bone_name):
         # Should probably raise on encountering '[Active]'
-        self.bone_list.append(bone.name.replace(" [Passive]", "").replace(" [Active]", ""))
+        self.bone_list.append(strip_rbb_suffix(bone_name))
 
-    def generate_string(self):
+    def iter_strings(self):
         if not self.bone_list:
             raise SMPError("No static bones")
-        output_string = self.header
+        yield self.header
         for bone in self.bone_list:
-            output_string += f"""    <bone name="{bone}"/>\n"""
-        output_string += "\n"
-        return output_string
+            yield f"""    <bone name="{bone}"/>\n"""
+        yield "\n"
+
+    def generate_string(self):
+        return "".join(self.iter_strings())
 
 
 class SMPKinematicBone():
     """
     Class for holding a kinematic bones and it's SMP definitions
     """
+    __slots__ = ("bone_name", "mass", "inertia_x", "inertia_y", "inertia_z", "linearDamping", "angularDamping",
+                 "friction", "rollingFriction", "restitution", "margin_multiplier", "gravityFactor")
 
     # Inertia should always be 1.0 for kinematic bones and can't be changed in blender.
     # However, many users change it on the SMP xml side
-    inertia_x = inertia_y = inertia_z = 1.0
-
-    # SMP properties with corresponding blender properties
-    bone_name = "Unset bone"
-    mass = 1.0
-    linearDamping = 0.2
-    angularDamping = 0.1
-    friction = 0.0
-    restitution = 0.0
-
-    # These do not have a proper corresponding blender property
-    rollingFriction = 0.0
-    gravityFactor = 1.0
-    margin_multiplier = 1.0
-
-    def __init__(self, obj, armature_name):
+    # rollingFriction, gravityFactor and margin_multiplier do not have a proper corresponding blender property
+    def __init__(self, bone_name="Unset bone", mass=1.0, inertia_x=1.0, inertia_y=1.0, inertia_z=1.0,
+                 linearDamping=0.2, angularDamping=0.1, friction=0.0, rollingFriction=0.0, restitution=0.0,
+                 margin_multiplier=1.0, gravityFactor=1.0):
+        self.bone_name = bone_name
+        self.mass = mass
+        self.inertia_x = inertia_x
+        self.inertia_y = inertia_y
+        self.inertia_z = inertia_z
+        self.linearDamping = linearDamping
+        self.angularDamping = angularDamping
+        self.friction = friction
+        self.rollingFriction = rollingFriction
+        self.restitution = restitution
+        self.margin_multiplier = margin_multiplier
+        self.gravityFactor = gravityFactor
+
+    @classmethod
+    def from_object(cls, obj, bone_data):
+        # obj is the rigid body bones [Active] object, bone_data the rigid_body_bones_extra_props
+        # (extra properties in the rigid body bones panel) of the armature bone it simulates
         rb_obj = obj.rigid_body
         assert rb_obj.type == "ACTIVE"
-        self.bone_name = obj.name.replace(" [Active]", "")
-        self.mass = rb_obj.mass
-
-        self.linearDamping = rb_obj.linear_damping
-        self.angularDamping = rb_obj.angular_damping
-
-        self.friction = rb_obj.friction
-        self.restitution = rb_obj.restitution
-
-        # Extra properties in the rigid body bones panel extra props
-        # First get the bone based on the bone_name and the armature
-        #************
-        # Rigid body bones names the armature collection after its data property name, ie
-        # armature.data.name + " [Container]"
-        # This is different to the armature OBJECT name
-        #************
-        bone = bpy.data.armatures[armature_name].bones.get(self.bone_name)
-        bone_data = bone.rigid_body_bones_extra_props
-        self.gravityFactor = bone_data.gravity_factor
-        self.margin_multiplier = bone_data.margin_multiplier
-        self.rollingFriction = bone_data.rolling_friction
-        self.inertia_x = self.inertia_y = self.inertia_z = bone_data.inertia
 
-    def generate_string(self):
+        return cls(bone_name=strip_rbb_suffix(obj.name),
+                   mass=rb_obj.mass,
+                   inertia_x=bone_data.inertia,
+                   inertia_y=bone_data.inertia,
+                   inertia_z=bone_data.inertia,
+                   linearDamping=rb_obj.linear_damping,
+                   angularDamping=rb_obj.angular_damping,
+                   friction=rb_obj.friction,
+                   rollingFriction=bone_data.rolling_friction,
+                   restitution=rb_obj.restitution,
+                   margin_multiplier=bone_data.margin_multiplier,
+                   gravityFactor=bone_data.gravity_factor)
+
+    def fields(self):
+        # (element, value) of everything a bone-default can hold, see SMPDefaults
+        return (("mass", self.mass),
+                ("inertia", (self.inertia_x, self.inertia_y, self.inertia_z)),
+                ("linearDamping", self.linearDamping),
+                ("angularDamping", self.angularDamping),
+                ("friction", self.friction),
+                ("rollingFriction", self.rollingFriction),
+                ("restitution", self.restitution),
+                ("margin-multiplier", self.margin_multiplier),
+                ("gravity-factor", self.gravityFactor))
+
+    @staticmethod
+    def _field_lines(fields):
+        for element, value in fields:
+            if element == "inertia":
+                yield f"""        <inertia x="{value[0]}" y="{value[1]}" z="{value[2]}"/>\n"""
+            else:
+                yield f"""        <{element}>{value}</{element}>\n"""
+
+    @classmethod
+    def default_string(cls, fields, name=""):
+        # A complete bone-default with the settings of fields
+        name_attr = f' name="{name}"' if name else ""
+        lines = list(cls._field_lines(fields))
+        # The center of mass goes after the inertia, like in the bones
+        lines.insert(2, """        <centerOfMassTransform>
+            <basis x="0" y="0" z="0" w="1"/>
+            <origin x="0" y="0" z="0"/>
+        </centerOfMassTransform>\n""")
+        return f"""    <bone-default{name_attr}>\n{"".join(lines)}    </bone-default>\n\n"""
+
+    def generate_string(self, template=None, template_name=""):
+        # template: the fields() of the bone-default this bone uses, only what differs from it is written
+        if template is not None:
+            template_attr = f' template="{template_name}"' if template_name else ""
+            lines = "".join(self._field_lines(field for field, default in zip(self.fields(), template)
+                                              if field != default))
+            if not lines:
+                return f"""    <bone name="{self.bone_name}"{template_attr}/>\n"""
+            return f"""    <bone name="{self.bone_name}"{template_attr}>\n{lines}    </bone>\n\n"""
+
         output_string = f"""    <bone name="{self.bone_name}">
         <mass>{self.mass}</mass>
         <inertia x="{self.inertia_x}" y="{self.inertia_y}" z="{self.inertia_z}"/>
@@ -176,226 +270,137 @@ class SMPKinematicBone():
         return output_string
 
 
-class SMPGenericConstraint():
-    bodyA = "UNSET_bodyA"
-    bodyB = "UNSET_bodyB"
-    useLinearReferenceFrameA = False
-    limit_lin_x_lower = 0.0
-    limit_lin_x_upper = 0.0
-    limit_lin_y_lower = 0.0
-    limit_lin_y_upper = 0.0
-    limit_lin_z_lower = 0.0
-    limit_lin_z_upper = 0.0
-    limit_ang_x_lower = 0.0
-    limit_ang_x_upper = 0.0
-    limit_ang_y_lower = 0.0
-    limit_ang_y_upper = 0.0
-    limit_ang_z_lower = 0.0
-    limit_ang_z_upper = 0.0
-    spring_stiffness_x = 0.0
-    spring_damping_x = 0.0
-    spring_stiffness_y = 0.0
-    spring_stiffness_z = 0.0
-    spring_damping_y = 0.0
-    spring_damping_z = 0.0
-    spring_stiffness_ang_x = 0.0
-    spring_stiffness_ang_y = 0.0
-    spring_stiffness_ang_z = 0.0
-    spring_damping_ang_x = 0.0
-    spring_damping_ang_y = 0.0
-    spring_damping_ang_z = 0.0
-
-    # This class takes a rigid body constraint and sets all variables, with defaults settings for disabled translation/rotation limits
-
-    def __init__(self, b_rb_constraint):
-        self.bodyA = b_rb_constraint.object1.name.replace(" [Passive]", "").replace(" [Active]", "").replace(" [Blank]", "")
-        self.bodyB = b_rb_constraint.object2.name.replace(" [Passive]", "").replace(" [Active]", "").replace(" [Blank]", "")
-        self.useLinearReferenceFrameA = False
+def _axis_values(b_rb_constraint, use_prop, value_prop):
+    # Read an (x, y, z) triple of a rigid body constraint property, 0.0 for every axis that is disabled
+    return tuple(getattr(b_rb_constraint, value_prop.format(axis)) if getattr(b_rb_constraint, use_prop.format(axis))
+                 else 0.0 for axis in "xyz")
 
-        self.set_lin_limits(b_rb_constraint)
-        self.set_ang_limits(b_rb_constraint)
-        self.set_spring_lin_limits(b_rb_constraint)
-        self.set_spring_ang_limits(b_rb_constraint)
+
+class SMPGenericConstraint():
+    # Limits, stiffness and damping are stored as (x, y, z) in blender coordinates and only transformed
+    # into SMP coordinates when generating the xml
+    __slots__ = ("bodyA", "bodyB", "useLinearReferenceFrameA", "lin_lower", "lin_upper", "ang_lower", "ang_upper",
+                 "lin_stiffness", "lin_damping", "ang_stiffness", "ang_damping")
+
+    def __init__(self, bodyA="UNSET_bodyA", bodyB="UNSET_bodyB", useLinearReferenceFrameA=False,
+                 lin_lower=(0.0, 0.0, 0.0), lin_upper=(0.0, 0.0, 0.0), ang_lower=(0.0, 0.0, 0.0),
+                 ang_upper=(0.0, 0.0, 0.0), lin_stiffness=(0.0, 0.0, 0.0), lin_damping=(0.0, 0.0, 0.0),
+                 ang_stiffness=(0.0, 0.0, 0.0), ang_damping=(0.0, 0.0, 0.0)):
+        self.bodyA = bodyA
+        self.bodyB = bodyB
+        self.useLinearReferenceFrameA = useLinearReferenceFrameA
+        self.lin_lower = tuple(lin_lower)
+        self.lin_upper = tuple(lin_upper)
+        self.ang_lower = tuple(ang_lower)
+        self.ang_upper = tuple(ang_upper)
+        self.lin_stiffness = tuple(lin_stiffness)
+        self.lin_damping = tuple(lin_damping)
+        self.ang_stiffness = tuple(ang_stiffness)
+        self.ang_damping = tuple(ang_damping)
+
+    # This takes a rigid body constraint and sets all variables, with defaults settings for disabled
+    # translation/rotation limits
+    @classmethod
+    def from_constraint(cls, b_rb_constraint):
+        constraint = cls(bodyA=strip_rbb_suffix(b_rb_constraint.object1.name),
+                         bodyB=strip_rbb_suffix(b_rb_constraint.object2.name))
+        constraint.update(b_rb_constraint)
+        return constraint
 
     def set_lin_limits(self, b_rb_constraint):
         # Parse the linear limits into two vectors, for the lower and upper limits
-        # If the limit is disabled, set it to 0.0
-        vec_LO = Vector((0.0, 0.0, 0.0))
-        vec_HI = Vector((0.0, 0.0, 0.0))
-        if b_rb_constraint.use_limit_lin_x:
-            vec_LO.x = b_rb_constraint.limit_lin_x_lower
-            vec_HI.x = b_rb_constraint.limit_lin_x_upper
-        else:
-            vec_LO.x = 0.0
-            vec_HI.x = 0.0
-
-        if b_rb_constraint.use_limit_lin_y:
-            vec_LO.y = b_rb_constraint.limit_lin_y_lower
-            vec_HI.y = b_rb_constraint.limit_lin_y_upper
-        else:
-            vec_LO.y = 0.0
-            vec_HI.y = 0.0
-
-        if b_rb_constraint.use_limit_lin_z:
-            vec_LO.z = b_rb_constraint.limit_lin_z_lower
-            vec_HI.z = b_rb_constraint.limit_lin_z_upper
-        else:
-            vec_LO.z = 0.0
-            vec_HI.z = 0.0
-
-        # Transform the vectors into correct coordinates
-        vec_LO = rotate_vector_blender_to_opengl(vec_LO)
-        vec_HI = rotate_vector_blender_to_opengl(vec_HI)
-
-        # Set the limits
-        self.limit_lin_x_lower = str(vec_LO.x)
-        self.limit_lin_x_upper = str(vec_HI.x)
-        self.limit_lin_y_lower = str(vec_LO.y)
-        self.limit_lin_y_upper = str(vec_HI.y)
-        self.limit_lin_z_lower = str(vec_LO.z)
-        self.limit_lin_z_upper = str(vec_HI.z)
-
+        self.lin_lower = _axis_values(b_rb_constraint, "use_limit_lin_{}", "limit_lin_{}_lower")
+        self.lin_upper = _axis_values(b_rb_constraint, "use_limit_lin_{}", "limit_lin_{}_upper")
 
     def set_ang_limits(self, b_rb_constraint):
         # Parse the angular limits into two vectors, for the lower and upper limits
-        # If the limit is disabled, set it to 0.0
-        vec_LO = Vector((0.0, 0.0, 0.0))
-        vec_HI = Vector((0.0, 0.0, 0.0))
-        if b_rb_constraint.use_limit_ang_x:
-            vec_LO.x = b_rb_constraint.limit_ang_x_lower
-            vec_HI.x = b_rb_constraint.limit_ang_x_upper
-        else:
-            vec_LO.x = 0.0
-            vec_HI.x = 0.0
-        if b_rb_constraint.use_limit_ang_y:
-            vec_LO.y = b_rb_constraint.limit_ang_y_lower
-            vec_HI.y = b_rb_constraint.limit_ang_y_upper
-        else:
-            vec_LO.y = 0.0
-            vec_HI.y = 0.0
-        if b_rb_constraint.use_limit_ang_z:
-            vec_LO.z = b_rb_constraint.limit_ang_z_lower
-            vec_HI.z = b_rb_constraint.limit_ang_z_upper
-        else:
-            vec_LO.z = 0.0
-            vec_HI.z = 0.0
-
-        # Transform the vectors into correct coordinates
-        vec_LO = rotate_vector_blender_to_opengl(vec_LO)
-        vec_HI = rotate_vector_blender_to_opengl(vec_HI)
-
-        # Set the limits
-        self.limit_ang_x_lower = str(vec_LO.x)
-        self.limit_ang_x_upper = str(vec_HI.x)
-        self.limit_ang_y_lower = str(vec_LO.y)
-        self.limit_ang_y_upper = str(vec_HI.y)
-        self.limit_ang_z_lower = str(vec_LO.z)
-        self.limit_ang_z_upper = str(vec_HI.z)
-
-
+        self.ang_lower = _axis_values(b_rb_constraint, "use_limit_ang_{}", "limit_ang_{}_lower")
+        self.ang_upper = _axis_values(b_rb_constraint, "use_limit_ang_{}", "limit_ang_{}_upper")
 
     def set_spring_ang_limits(self, b_rb_constraint):
-
         # Parse the spring angular limits into two vectors, for the stiffness and damping
-        # If the limit is disabled, set it to 0.0
-        vec_stiffness = Vector((0.0, 0.0, 0.0))
-        vec_damping = Vector((0.0, 0.0, 0.0))
-        if b_rb_constraint.use_spring_ang_x:
-            vec_stiffness.x = b_rb_constraint.spring_stiffness_ang_x
-            vec_damping.x = b_rb_constraint.spring_damping_ang_x
-        else:
-            vec_stiffness.x = 0.0
-            vec_damping.x = 0.0
-        if b_rb_constraint.use_spring_ang_y:
-            vec_stiffness.y = b_rb_constraint.spring_stiffness_ang_y
-            vec_damping.y = b_rb_constraint.spring_damping_ang_y
-        else:
-            vec_stiffness.y = 0.0
-            vec_damping.y = 0.0
-        if b_rb_constraint.use_spring_ang_z:
-            vec_stiffness.z = b_rb_constraint.spring_stiffness_ang_z
-            vec_damping.z = b_rb_constraint.spring_damping_ang_z
-        else:
-            vec_stiffness.z = 0.0
-            vec_damping.z = 0.0
-
-        # Transform the vectors into correct coordinates
-        vec_stiffness = rotate_vector_blender_to_opengl(vec_stiffness)
-        vec_damping = rotate_vector_blender_to_opengl(vec_damping)
-
-        # Make the values positive (absolute)
-        vec_stiffness.x = abs(vec_stiffness.x)
-        vec_stiffness.y = abs(vec_stiffness.y)
-        vec_stiffness.z = abs(vec_stiffness.z)
-        vec_damping.x = abs(vec_damping.x)
-        vec_damping.y = abs(vec_damping.y)
-        vec_damping.z = abs(vec_damping.z)
-
-        # Set the limits
-        self.spring_stiffness_ang_x = str(vec_stiffness.x)
-        self.spring_stiffness_ang_y = str(vec_stiffness.y)
-        self.spring_stiffness_ang_z = str(vec_stiffness.z)
-        self.spring_damping_ang_x = str(vec_damping.x)
-        self.spring_damping_ang_y = str(vec_damping.y)
-        self.spring_damping_ang_z = str(vec_damping.z)
-
-
+        self.ang_stiffness = _axis_values(b_rb_constraint, "use_spring_ang_{}", "spring_stiffness_ang_{}")
+        self.ang_damping = _axis_values(b_rb_constraint, "use_spring_ang_{}", "spring_damping_ang_{}")
 
     def set_spring_lin_limits(self, b_rb_constraint):
         # Parse the spring linear limits into two vectors, for the stiffness and damping
-        # If the limit is disabled, set it to 0.0
-        # The stiffness and damping values should always be positive
-
-        vec_stiffness = Vector((0.0, 0.0, 0.0))
-        vec_damping = Vector((0.0, 0.0, 0.0))
-        if b_rb_constraint.use_spring_x:
-            vec_stiffness.x = b_rb_constraint.spring_stiffness_x
-            vec_damping.x = b_rb_constraint.spring_damping_x
-        else:
-            vec_stiffness.x = 0.0
-            vec_damping.x = 0.0
-        if b_rb_constraint.use_spring_y:
-            vec_stiffness.y = b_rb_constraint.spring_stiffness_y
-            vec_damping.y = b_rb_constraint.spring_damping_y
-        else:
-            vec_stiffness.y = 0.0
-            vec_damping.y = 0.0
-        if b_rb_constraint.use_spring_z:
-            vec_stiffness.z = b_rb_constraint.spring_stiffness_z
-            vec_damping.z = b_rb_constraint.spring_damping_z
-        else:
-            vec_stiffness.z = 0.0
-            vec_damping.z = 0.0
-
-        # Transform the vectors into correct coordinates
-        vec_stiffness = rotate_vector_blender_to_opengl(vec_stiffness)
-        vec_damping = rotate_vector_blender_to_opengl(vec_damping)
-
-        # Make the values positive (absolute)
-        vec_stiffness.x = abs(vec_stiffness.x)
-        vec_stiffness.y = abs(vec_stiffness.y)
-        vec_stiffness.z = abs(vec_stiffness.z)
-        vec_damping.x = abs(vec_damping.x)
-        vec_damping.y = abs(vec_damping.y)
-        vec_damping.z = abs(vec_damping.z)
-
-        # Set the limits
-        self.spring_stiffness_x = str(vec_stiffness.x)
-        self.spring_stiffness_y = str(vec_stiffness.y)
-        self.spring_stiffness_z = str(vec_stiffness.z)
-        self.spring_damping_x = str(vec_damping.x)
-        self.spring_damping_y = str(vec_damping.y)
-        self.spring_damping_z = str(vec_damping.z)
-
+        self.lin_stiffness = _axis_values(b_rb_constraint, "use_spring_{}", "spring_stiffness_{}")
+        self.lin_damping = _axis_values(b_rb_constraint, "use_spring_{}", "spring_damping_{}")
 
     def update(self, b_rb_constraint):
-        # Might be needed at some point I dunno
         self.set_lin_limits(b_rb_constraint)
         self.set_ang_limits(b_rb_constraint)
         self.set_spring_lin_limits(b_rb_constraint)
         self.set_spring_ang_limits(b_rb_constraint)
 
-    def generate_string(self):
+    def vectors(self):
+        return (self.lin_lower, self.lin_upper, self.ang_lower, self.ang_upper,
+                self.lin_stiffness, self.lin_damping, self.ang_stiffness, self.ang_damping)
+
+    def to_opengl(self):
+        # Transform the vectors into correct coordinates
+        # The stiffness and damping values should always be positive
+        return (rotate_vector_blender_to_opengl(self.lin_lower),
+                rotate_vector_blender_to_opengl(self.lin_upper),
+                rotate_vector_blender_to_opengl(self.ang_lower),
+                rotate_vector_blender_to_opengl(self.ang_upper),
+                tuple(abs(v) for v in rotate_vector_blender_to_opengl(self.lin_stiffness)),
+                tuple(abs(v) for v in rotate_vector_blender_to_opengl(self.lin_damping)),
+                tuple(abs(v) for v in rotate_vector_blender_to_opengl(self.ang_stiffness)),
+                tuple(abs(v) for v in rotate_vector_blender_to_opengl(self.ang_damping)))
+
+    def fields(self, converted=None):
+        # (element, value) of everything a generic-constraint-default can hold, see SMPDefaults.
+        # converted as in generate_string, the linearLowerLimit is the upper limit like there
+        if converted is None:
+            converted = self.to_opengl()
+        lin_lower, lin_upper, ang_lower, ang_upper, lin_stiffness, lin_damping, ang_stiffness, ang_damping = converted
+        return (("useLinearReferenceFrameA", str(self.useLinearReferenceFrameA).lower()),
+                ("linearLowerLimit", tuple(lin_upper)),
+                ("linearUpperLimit", tuple(lin_upper)),
+                ("angularLowerLimit", tuple(ang_lower)),
+                ("angularUpperLimit", tuple(ang_upper)),
+                ("linearStiffness", tuple(lin_stiffness)),
+                ("angularStiffness", tuple(ang_stiffness)),
+                ("linearDamping", tuple(lin_damping)),
+                ("angularDamping", tuple(ang_damping)),
+                ("linearEquilibrium", (0, 0, 0)),
+                ("angularEquilibrium", (0, 0, 0)),
+                ("linearBounce", (0, 0, 0)),
+                ("angularBounce", (0, 0, 0)))
+
+    @staticmethod
+    def _field_lines(fields):
+        for element, value in fields:
+            if isinstance(value, tuple):
+                yield f"""        <{element} x="{value[0]}" y="{value[1]}" z="{value[2]}" />\n"""
+            else:
+                yield f"""        <{element}>{value}</{element}>\n"""
+
+    @classmethod
+    def default_string(cls, fields, name=""):
+        # A complete generic-constraint-default with the settings of fields
+        name_attr = f' name="{name}"' if name else ""
+        return (f"    <generic-constraint-default{name_attr}>\n{''.join(cls._field_lines(fields))}"
+                f"    </generic-constraint-default>\n\n")
+
+    def generate_string(self, converted=None, template=None, template_name=""):
+        # converted are the already transformed vectors, see SMPMath.constraints_to_opengl.
+        # template: the fields() of the generic-constraint-default this constraint uses, only what differs
+        # from it is written
+        if converted is None:
+            converted = self.to_opengl()
+        if template is not None:
+            attrs = f'bodyA="{self.bodyA}" bodyB="{self.bodyB}"'
+            if template_name:
+                attrs += f' template="{template_name}"'
+            lines = "".join(self._field_lines(field for field, default in zip(self.fields(converted), template)
+                                              if field != default))
+            if not lines:
+                return f"""    <generic-constraint {attrs}/>\n"""
+            return f"""    <generic-constraint {attrs}>\n{lines}    </generic-constraint>\n\n"""
+
+        lin_lower, lin_upper, ang_lower, ang_upper, lin_stiffness, lin_damping, ang_stiffness, ang_damping = converted
         constraintStr = """    <generic-constraint bodyA="{bodyA}" bodyB="{bodyB}">
         <useLinearReferenceFrameA>{useLinearReferenceFrameA}</useLinearReferenceFrameA>
         <linearLowerLimit x="{limit_lin_x_lower}" y="{limit_lin_y_lower}" z="{limit_lin_z_lower}" />
@@ -413,28 +418,43 @@ class SMPGenericConstraint():
     </generic-constraint>\n\n""".format(bodyA=self.bodyA,
                                         bodyB=self.bodyB,
                                         useLinearReferenceFrameA=str(self.useLinearReferenceFrameA).lower(),
-                                        limit_lin_x_lower=str(self.limit_lin_x_upper),
-                                        limit_lin_y_lower=str(self.limit_lin_y_upper),
-                                        limit_lin_z_lower=str(self.limit_lin_z_upper),
-                                        limit_lin_x_upper=str(self.limit_lin_x_upper),
-                                        limit_lin_y_upper=str(self.limit_lin_y_upper),
-                                        limit_lin_z_upper=str(self.limit_lin_z_upper),
-                                        limit_ang_x_lower=str(self.limit_ang_x_lower),
-                                        limit_ang_y_lower=str(self.limit_ang_y_lower),
-                                        limit_ang_z_lower=str(self.limit_ang_z_lower),
-                                        limit_ang_x_upper=str(self.limit_ang_x_upper),
-                                        limit_ang_y_upper=str(self.limit_ang_y_upper),
-                                        limit_ang_z_upper=str(self.limit_ang_z_upper),
-                                        spring_stiffness_x=str(self.spring_stiffness_x),
-                                        spring_stiffness_y=str(self.spring_stiffness_y),
-                                        spring_stiffness_z=str(self.spring_stiffness_z),
-                                        spring_damping_x=str(self.spring_damping_x),
-                                        spring_damping_y=str(self.spring_damping_y),
-                                        spring_damping_z=str(self.spring_damping_z),
-                                        spring_stiffness_ang_x=str(self.spring_stiffness_ang_x),
-                                        spring_stiffness_ang_y=str(self.spring_stiffness_ang_y),
-                                        spring_stiffness_ang_z=str(self.spring_stiffness_ang_z),
-                                        spring_damping_ang_x=str(self.spring_damping_ang_x),
-                                        spring_damping_ang_y=str(self.spring_damping_ang_y),
-                                        spring_damping_ang_z=str(self.spring_damping_ang_z))
+                                        limit_lin_x_lower=str(lin_upper[0]),
+                                        limit_lin_y_lower=str(lin_upper[1]),
+                                        limit_lin_z_lower=str(lin_upper[2]),
+                                        limit_lin_x_upper=str(lin_upper[0]),
+                                        limit_lin_y_upper=str(lin_upper[1]),
+                                        limit_lin_z_upper=str(lin_upper[2]),
+                                        limit_ang_x_lower=str(ang_lower[0]),
+                                        limit_ang_y_lower=str(ang_lower[1]),
+                                        limit_ang_z_lower=str(ang_lower[2]),
+                                        limit_ang_x_upper=str(ang_upper[0]),
+                                        limit_ang_y_upper=str(ang_upper[1]),
+                                        limit_ang_z_upper=str(ang_upper[2]),
+                                        spring_stiffness_x=str(lin_stiffness[0]),
+                                        spring_stiffness_y=str(lin_stiffness[1]),
+                                        spring_stiffness_z=str(lin_stiffness[2]),
+                                        spring_damping_x=str(lin_damping[0]),
+                                        spring_damping_y=str(lin_damping[1]),
+                                        spring_damping_z=str(lin_damping[2]),
+                                        spring_stiffness_ang_x=str(ang_stiffness[0]),
+                                        spring_stiffness_ang_y=str(ang_stiffness[1]),
+                                        spring_stiffness_ang_z=str(ang_stiffness[2]),
+                                        spring_damping_ang_x=str(ang_damping[0]),
+                                        spring_damping_ang_y=str(ang_damping[1]),
+                                        spring_damping_ang_z=str(ang_damping[2]))
         return constraintStr
+
+
+class SMPSceneData():
+    """Everything captured from a scene that is needed to write an SMP xml.
+       Filled once by SMPUtils.parse_scene, or loaded from a snapshot"""
+    __slots__ = ("statics", "kinematics", "constraints", "collision_meshes", "armatures")
+
+    def __init__(self, statics=None, kinematics=(), constraints=(), collision_meshes=(), armatures=None):
+        self.statics = statics if statics is not None else SMPStaticBones()
+        self.kinematics = list(kinematics)
+        self.constraints = list(constraints)
+        self.collision_meshes = list(collision_meshes)
+        # Armature data name of every static bone, kinematic bone and constraint, lists in the same order as
+        # the records under "statics", "kinematics" and "constraints". Empty if not known, e.g. read from an xml
+        self.armatures = armatures if armatures is not None else {}
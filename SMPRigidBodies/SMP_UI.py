@@ -26,7 +26,13 @@ from bpy.types import (Operator,
                        Panel,
                        PropertyGroup,
                        UIList)
+from SMPRigidBodies.SMP_Core_Classes import SMPCollisionShape
+from SMPRigidBodies.SMPCollision import analyze_collision_cost, preview_weight_thresholds
+from SMPRigidBodies.SMPUtils import index_scene, resolve_tag_presets
+from SMPRigidBodies.SMPProxy import make_collision_proxy
 
+# Tags of the 'Fill default tags' buttons
+DEFAULT_TAGS = ("body", "hair", "hands", "head")
 
 class SMP_OT_actions_ncwt(Operator):
     """Move items up and down, add and remove"""
@@ -88,7 +94,7 @@ class SMP_OT_defaultTags_ncwt(Operator):
     bl_options = {'INTERNAL'}
 
     def invoke(self, context, event):
-        for tag in ["body", "hair", "hands", "head"]:
+        for tag in DEFAULT_TAGS:
             item = context.active_object.no_collide_with_tags.add()
             item.name = tag
             item.obj_id = len(context.active_object.no_collide_with_tags)
@@ -155,13 +161,298 @@ class SMP_OT_defaultTags_cwt(Operator):
     bl_options = {'INTERNAL'}
 
     def invoke(self, context, event):
-        for tag in ["body", "hair", "hands", "head"]:
+        for tag in DEFAULT_TAGS:
             item = context.active_object.collide_with_tags.add()
             item.name = tag
             item.obj_id = len(context.active_object.collide_with_tags)
             context.active_object.collide_with_tags_index = len(context.active_object.collide_with_tags) - 1
         return {'FINISHED'}
 
+def set_tags(collection, tags):
+    # Replace the items of a tag CollectionProperty
+    collection.clear()
+    for i, tag in enumerate(tags):
+        item = collection.add()
+        item.name = tag
+        item.obj_id = i + 1
+
+def split_tags(text):
+    # "body, hair hands" -> ["body", "hair", "hands"]
+    return [tag for tag in text.replace(",", " ").split() if tag]
+
+def edit_tags(tags, mode, edited, replacement=""):
+    # The tag list tags after applying mode with the tags in edited, duplicates are dropped
+    if mode == 'APPLY':
+        result = list(edited)
+    elif mode == 'MERGE':
+        result = list(tags) + list(edited)
+    elif mode == 'REMOVE':
+        result = [tag for tag in tags if tag not in edited]
+    else:
+        result = [replacement if tag in edited else tag for tag in tags]
+    return list(dict.fromkeys(tag for tag in result if tag))
+
+def copy_tag_presets(presets, target):
+    # Copy the tag preset CollectionProperty presets into target, replacing the presets of the same name
+    for preset in presets:
+        copy = target.get(preset.name)
+        if copy is None:
+            copy = target.add()
+            copy.name = preset.name
+        set_tags(copy.tags, [item.name for item in preset.tags])
+
+class SMP_OT_batchTags(Operator):
+    """Edit the SMP collision settings and tag lists of all selected objects at once"""
+    bl_idname = "smp.batch_edit_tags"
+    bl_label = "Edit tags of selected"
+    bl_description = "Set, merge, replace or remove the SMP collision settings and tags of all selected objects " \
+                     "in one undo step"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    mode: EnumProperty(
+        name="Mode",
+        items=(
+            ('APPLY', "Apply", "Set the settings and replace the tag lists with the tags below"),
+            ('MERGE', "Merge", "Set the settings and add the tags below to the tag lists"),
+            ('REPLACE', "Replace", "Replace the tag and the tags below with the replacement"),
+            ('REMOVE', "Remove", "Reset the tag if it is the one below and remove the tags below from the "
+                                 "tag lists")))
+
+    only_rigid_bodies: BoolProperty(name="Only rigid bodies", default=True,
+                                    description="Skip selected objects without a rigid body")
+
+    use_tag: BoolProperty(name="Tag", default=False)
+    tag: StringProperty(name="Tag", default="collision_mesh")
+    use_col_type: BoolProperty(name="Collision type", default=False)
+    col_type: EnumProperty(name="Collision type", items=(
+        ('vertex', "per-vertex-shape", ""),
+        ('triangle', "per-triangle-shape", "")))
+    use_col_privacy: BoolProperty(name="Shared", default=False)
+    col_privacy: EnumProperty(name="Shared", items=(
+        ('public', "public", ""),
+        ('private', "private", ""),
+        ('internal', "internal", ""),
+        ('external', "external", "")))
+    use_no_collide: BoolProperty(name="No collide with tags", default=False)
+    no_collide_tags: StringProperty(name="No collide with tags", description="Comma or space separated tags")
+    use_collide: BoolProperty(name="Collide with tags", default=False)
+    collide_tags: StringProperty(name="Collide with tags", description="Comma or space separated tags")
+    replacement: StringProperty(name="Replace with", description="Tag to replace the tags above with")
+    use_no_collide_preset: BoolProperty(name="No collide with preset", default=False)
+    no_collide_preset: StringProperty(name="No collide with preset", description="Tag preset to use, applied and "
+                                      "merged, cleared by remove if the objects use it")
+    use_collide_preset: BoolProperty(name="Collide with preset", default=False)
+    collide_preset: StringProperty(name="Collide with preset", description="Tag preset to use, applied and "
+                                   "merged, cleared by remove if the objects use it")
+
+    @classmethod
+    def poll(cls, context):
+        return bool(context.selected_objects)
+
+    def invoke(self, context, event):
+        return context.window_manager.invoke_props_dialog(self, width=400)
+
+    def draw(self, context):
+        layout = self.layout
+        layout.prop(self, "mode", expand=True)
+        layout.prop(self, "only_rigid_bodies")
+        for use, value in (("use_tag", "tag"), ("use_col_type", "col_type"), ("use_col_privacy", "col_privacy"),
+                           ("use_no_collide", "no_collide_tags"), ("use_collide", "collide_tags")):
+            row = layout.row()
+            row.prop(self, use, text="")
+            sub = row.row()
+            sub.active = getattr(self, use)
+            sub.prop(self, value)
+        if self.mode == 'REPLACE':
+            layout.prop(self, "replacement")
+        else:
+            for use, value in (("use_no_collide_preset", "no_collide_preset"),
+                               ("use_collide_preset", "collide_preset")):
+                row = layout.row()
+                row.prop(self, use, text="")
+                sub = row.row()
+                sub.active = getattr(self, use)
+                sub.prop_search(self, value, context.scene, "smp_tag_presets")
+
+    def execute(self, context):
+        objects = [obj for obj in context.selected_objects
+                   if obj.rigid_body is not None or not self.only_rigid_bodies]
+        no_collide = split_tags(self.no_collide_tags)
+        collide = split_tags(self.collide_tags)
+        changed = 0
+        for obj in objects:
+            # Only write what actually changes, every RNA write is a depsgraph update
+            before = changed
+            if self.use_tag:
+                tag = obj.smp_tag
+                if self.mode in ('APPLY', 'MERGE'):
+                    tag = self.tag
+                elif tag == self.tag:
+                    tag = self.replacement if self.mode == 'REPLACE' else "collision_mesh"
+                if tag and tag != obj.smp_tag:
+                    obj.smp_tag = tag
+                    changed += 1
+            if self.mode in ('APPLY', 'MERGE'):
+                if self.use_col_type and obj.smp_col_type != self.col_type:
+                    obj.smp_col_type = self.col_type
+                    changed += 1
+                if self.use_col_privacy and obj.smp_col_privacy != self.col_privacy:
+                    obj.smp_col_privacy = self.col_privacy
+                    changed += 1
+            for use, prop, preset in ((self.use_no_collide_preset, "smp_no_collide_preset", self.no_collide_preset),
+                                      (self.use_collide_preset, "smp_collide_preset", self.collide_preset)):
+                if not use or self.mode == 'REPLACE':
+                    continue
+                if self.mode == 'REMOVE':
+                    preset = "" if getattr(obj, prop) == preset else getattr(obj, prop)
+                if getattr(obj, prop) != preset:
+                    setattr(obj, prop, preset)
+                    changed += 1
+            for use, tags, collection in ((self.use_no_collide, no_collide, obj.no_collide_with_tags),
+                                          (self.use_collide, collide, obj.collide_with_tags)):
+                if not use:
+                    continue
+                current = [item.name for item in collection]
+                new = edit_tags(current, self.mode, tags, self.replacement)
+                if new != current:
+                    set_tags(collection, new)
+                    changed += 1
+            if changed != before:
+                obj.no_collide_with_tags_index = min(obj.no_collide_with_tags_index,
+                                                     len(obj.no_collide_with_tags) - 1)
+                obj.collide_with_tags_index = min(obj.collide_with_tags_index, len(obj.collide_with_tags) - 1)
+
+        self.report({'INFO'}, f"Edited {changed} settings on {len(objects)} objects")
+        return {'FINISHED'}
+
+def scene_collision_report(context):
+    # SMPCollisionReport of the collision meshes the scene exports
+    index = index_scene(context.scene)
+    presets = resolve_tag_presets(context.scene)
+    shapes = [SMPCollisionShape.from_object(obj, presets) for obj in index.collision_meshes]
+    return analyze_collision_cost(shapes, {obj.name: obj for obj in index.collision_meshes},
+                                  context.evaluated_depsgraph_get())
+
+class SMP_OT_analyzeCollisions(Operator):
+    """Estimate the in-game collision work of all SMP collision shapes in the scene"""
+    bl_idname = "smp.analyze_collision_cost"
+    bl_label = "Analyze collision cost"
+    bl_description = "Estimate the in-game collision work of all collision shapes, full report in the system console"
+    bl_options = {'REGISTER'}
+
+    def execute(self, context):
+        report = scene_collision_report(context)
+        print(report.format())
+        self.report({'INFO'}, report.summary())
+        return {'FINISHED'}
+
+class SMP_OT_boneWeightThresholdActions(Operator):
+    """Add and remove the weight thresholds of single bones"""
+    bl_idname = "smp.bone_weight_threshold_action"
+    bl_label = "Bone weight threshold actions"
+    bl_description = "Add a weight threshold for the active vertex group's bone, or remove the selected one"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    action: bpy.props.EnumProperty(
+        items=(
+            ('ADD', "Add", ""),
+            ('REMOVE', "Remove", "")))
+
+    def execute(self, context):
+        obj = context.active_object
+        thresholds = obj.smp_bone_weight_thresholds
+        if self.action == 'ADD':
+            item = thresholds.add()
+            group = obj.vertex_groups.active
+            item.name = group.name if group is not None else "bone"
+            item.threshold = obj.smp_weight_threshold
+            obj.smp_bone_weight_thresholds_index = len(thresholds) - 1
+        elif 0 <= obj.smp_bone_weight_thresholds_index < len(thresholds):
+            thresholds.remove(obj.smp_bone_weight_thresholds_index)
+            obj.smp_bone_weight_thresholds_index = min(obj.smp_bone_weight_thresholds_index, len(thresholds) - 1)
+        return {'FINISHED'}
+
+class SMP_OT_previewWeightThresholds(Operator):
+    """Count the collision vertices the weight thresholds leave"""
+    bl_idname = "smp.preview_weight_thresholds"
+    bl_label = "Preview weight thresholds"
+    bl_description = "Count the collision vertices SMP keeps with these weight thresholds and the bones left " \
+                     "without any, per bone counts in the system console"
+    bl_options = {'REGISTER'}
+
+    @classmethod
+    def poll(cls, context):
+        obj = context.active_object
+        return obj is not None and obj.type == "MESH" and obj.rigid_body is not None
+
+    def execute(self, context):
+        obj = context.active_object
+        shape = SMPCollisionShape.from_object(obj, resolve_tag_presets(context.scene))
+        preview = preview_weight_thresholds(shape, obj, context.evaluated_depsgraph_get())
+        for bone, (before, after) in preview.bone_vertices.items():
+            print(f"    {bone:<40} {before:>8} -> {after:>8}")
+        self.report({'WARNING'} if preview.emptied_bones else {'INFO'}, preview.summary())
+        return {'FINISHED'}
+
+class SMP_OT_collisionProxy(Operator):
+    """Export decimated copies of the selected collision meshes in their place"""
+    bl_idname = "smp.make_collision_proxy"
+    bl_label = "Make collision proxies"
+    bl_description = "Decimate a copy of every selected collision mesh down to a budget and export the copy " \
+                     "instead, with the same vertex groups and SMP settings. The proxies have to be in the .nif too"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    budget: IntProperty(name="Budget", description="Most elements a proxy may have", default=500, min=4)
+    budget_kind: EnumProperty(
+        name="Budget of",
+        items=(
+            ('SHAPE', "Collision elements", "Triangles of per-triangle shapes, vertices of per-vertex shapes"),
+            ('TRIANGLES', "Triangles", ""),
+            ('VERTICES', "Vertices", "")))
+
+    @staticmethod
+    def is_collision_mesh(obj):
+        return obj.type == "MESH" and obj.rigid_body is not None and obj.rigid_body.type == "PASSIVE"
+
+    @classmethod
+    def targets(cls, context):
+        # Selected collision meshes, not counting proxies
+        proxies = {obj.smp_collision_proxy.as_pointer() for obj in context.scene.objects
+                   if obj.smp_collision_proxy is not None}
+        return [obj for obj in context.selected_objects
+                if cls.is_collision_mesh(obj) and obj.as_pointer() not in proxies]
+
+    @classmethod
+    def poll(cls, context):
+        # Runs on every redraw, only looks at the selection. Proxies are left out when it runs
+        return any(cls.is_collision_mesh(obj) for obj in context.selected_objects)
+
+    def invoke(self, context, event):
+        return context.window_manager.invoke_props_dialog(self)
+
+    def execute(self, context):
+        targets = self.targets(context)
+        if not targets:
+            self.report({'WARNING'}, "Only proxies are selected")
+            return {'CANCELLED'}
+        before = scene_collision_report(context)
+        over = []
+        depsgraph = context.view_layer.depsgraph
+        for obj in targets:
+            proxy, count = make_collision_proxy(depsgraph, obj, self.budget, self.budget_kind)
+            if count > self.budget:
+                over.append(f"{proxy.name} ({count})")
+        context.view_layer.update()
+        after = scene_collision_report(context)
+
+        saved = 1.0 - after.total / before.total if before.total else 0.0
+        self.report({'INFO'}, f"Made {len(targets)} collision proxies, estimated collision cost "
+                              f"{before.total:,.0f} -> {after.total:,.0f} element tests per frame ({saved:.0%} saved)")
+        if over:
+            self.report({'WARNING'}, f"{len(over)} proxies couldn't be decimated down to {self.budget}: "
+                                     + ", ".join(over[:5]))
+        return {'FINISHED'}
+
 class SMP_UL_items(UIList):
     def draw_item(self, context, layout, data, item, icon, active_data, active_propname, index):
         row = layout.row()
@@ -171,6 +462,13 @@ class SMP_UL_items(UIList):
         pass
 
 
+class SMP_UL_weightThresholds(UIList):
+    def draw_item(self, context, layout, data, item, icon, active_data, active_propname, index):
+        row = layout.row()
+        row.prop(item, "name", text="", emboss=False)
+        row.prop(item, "threshold", text="")
+
+
 class SMP_PT_CollisionPropertiesPanel(Panel):
     """Custom panel in the rigid body physics properties area
     Containing a list of tags to not collide with"""
@@ -198,10 +496,23 @@ class SMP_PT_CollisionPropertiesPanel(Panel):
         tag_row = layout.row()
         tag_row.prop(obj, "smp_tag", text="tag")
 
+        # ************* WEIGHT THRESHOLDS *************
+
+        if obj.smp_col_type == "vertex":
+            layout.prop(obj, "smp_weight_threshold", text="weight threshold")
+            row = layout.row()
+            row.template_list("SMP_UL_weightThresholds", "", obj, "smp_bone_weight_thresholds", obj,
+                              "smp_bone_weight_thresholds_index", rows=2)
+            col = row.column(align=True)
+            col.operator("smp.bone_weight_threshold_action", icon='ADD', text="").action = 'ADD'
+            col.operator("smp.bone_weight_threshold_action", icon='REMOVE', text="").action = 'REMOVE'
+            layout.operator("smp.preview_weight_thresholds", icon="GROUP_VERTEX")
+
         # ************* NO COLLIDE WITH TAGS *************
 
         desc_row = layout.row()
         desc_row.label(text="no-collide-with-tags")
+        layout.prop_search(obj, "smp_no_collide_preset", context.scene, "smp_tag_presets", text="preset")
 
         rows = 2
         row = layout.row()
@@ -224,6 +535,8 @@ class SMP_PT_CollisionPropertiesPanel(Panel):
         desc_row = layout.row()
         desc_row.label(text="no-collide-with-tags")
 
+        layout.prop_search(obj, "smp_collide_preset", context.scene, "smp_tag_presets", text="preset")
+
         rows = 2
         row = layout.row()
         row.template_list("SMP_UL_items", "", obj, "collide_with_tags", obj, "collide_with_tags_index", rows=rows)
@@ -239,6 +552,105 @@ class SMP_PT_CollisionPropertiesPanel(Panel):
         col = row.column(align=True)
         row = col.row(align=True)
         row.operator("collide_with_tags.default_tags", icon="ADD")
+
+        row = layout.row()
+        row.operator("smp.batch_edit_tags", icon="PRESET")
+        row = layout.row()
+        row.operator("smp.analyze_collision_cost", icon="PHYSICS")
+        row = layout.row()
+        row.operator("smp.make_collision_proxy", icon="MOD_DECIM")
+        if obj.smp_collision_proxy is not None:
+            layout.label(text=f"Exported as {obj.smp_collision_proxy.name}", icon="INFO")
+
+
+class SMP_OT_tagPresetActions(Operator):
+    """Add and remove tag presets and their tags"""
+    bl_idname = "smp.tag_preset_action"
+    bl_label = "Tag preset actions"
+    bl_description = "Add and remove tag presets and the tags of the active preset"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    action: bpy.props.EnumProperty(
+        items=(
+            ('ADD_PRESET', "Add preset", ""),
+            ('REMOVE_PRESET', "Remove preset", ""),
+            ('ADD_TAG', "Add tag", ""),
+            ('REMOVE_TAG', "Remove tag", ""),
+            ('DEFAULT_TAGS', "Fill default tags", ""),
+            ('COPY_TO_SCENES', "Copy to other scenes", "")))
+
+    def execute(self, context):
+        scene = context.scene
+        presets = scene.smp_tag_presets
+        if self.action == 'ADD_PRESET':
+            preset = presets.add()
+            preset.name = "preset"
+            scene.smp_tag_presets_index = len(presets) - 1
+            return {'FINISHED'}
+        if self.action == 'COPY_TO_SCENES':
+            # Presets with the same name in the other scenes are replaced
+            for other in bpy.data.scenes:
+                if other != scene:
+                    copy_tag_presets(presets, other.smp_tag_presets)
+            return {'FINISHED'}
+
+        try:
+            preset = presets[scene.smp_tag_presets_index]
+        except IndexError:
+            return {'CANCELLED'}
+        if self.action == 'REMOVE_PRESET':
+            presets.remove(scene.smp_tag_presets_index)
+            scene.smp_tag_presets_index = min(scene.smp_tag_presets_index, len(presets) - 1)
+        elif self.action == 'ADD_TAG':
+            item = preset.tags.add()
+            item.name = "tag"
+            item.obj_id = len(preset.tags)
+            preset.tags_index = len(preset.tags) - 1
+        elif self.action == 'REMOVE_TAG':
+            if 0 <= preset.tags_index < len(preset.tags):
+                preset.tags.remove(preset.tags_index)
+                preset.tags_index = min(preset.tags_index, len(preset.tags) - 1)
+        else:
+            set_tags(preset.tags, list(dict.fromkeys([item.name for item in preset.tags] + list(DEFAULT_TAGS))))
+        return {'FINISHED'}
+
+
+class SMP_PT_TagPresetsPanel(Panel):
+    """Tag presets of the scene, collision meshes can use one for each of their tag lists. Every scene has
+       its own presets, they can be copied to the other scenes of the .blend"""
+
+    bl_idname = "SMPRIGIDBODIES_PT_TagPresetsPanel"
+    bl_label = "SMP tag presets"
+    bl_space_type = 'PROPERTIES'
+    bl_region_type = 'WINDOW'
+    bl_context = "physics"
+    bl_parent_id = "SMPRIGIDBODIES_PT_CollisionPropertiesPanel"
+    bl_options = {'DEFAULT_CLOSED'}
+
+    def draw(self, context):
+        layout = self.layout
+        scene = context.scene
+
+        row = layout.row()
+        row.template_list("SMP_UL_items", "presets", scene, "smp_tag_presets", scene, "smp_tag_presets_index", rows=2)
+        col = row.column(align=True)
+        col.operator("smp.tag_preset_action", icon='ADD', text="").action = 'ADD_PRESET'
+        col.operator("smp.tag_preset_action", icon='REMOVE', text="").action = 'REMOVE_PRESET'
+        if len(bpy.data.scenes) > 1:
+            layout.operator("smp.tag_preset_action", icon="DUPLICATE",
+                            text="Copy to other scenes").action = 'COPY_TO_SCENES'
+
+        if not 0 <= scene.smp_tag_presets_index < len(scene.smp_tag_presets):
+            return
+        preset = scene.smp_tag_presets[scene.smp_tag_presets_index]
+        layout.label(text=f"tags of {preset.name}")
+        row = layout.row()
+        row.template_list("SMP_UL_items", "preset_tags", preset, "tags", preset, "tags_index", rows=2)
+        col = row.column(align=True)
+        col.operator("smp.tag_preset_action", icon='ADD', text="").action = 'ADD_TAG'
+        col.operator("smp.tag_preset_action", icon='REMOVE', text="").action = 'REMOVE_TAG'
+        layout.operator("smp.tag_preset_action", icon="ADD", text="Fill default tags").action = 'DEFAULT_TAGS'
+
 # -------------------------------------------------------------------
 #   Injection in Rigid Body Bones panel
 # -------------------------------------------------------------------
@@ -335,5 +747,23 @@ class SMP_objectCollection(PropertyGroup):
     obj_id: IntProperty()
 
 
+class SMP_boneWeightThreshold(PropertyGroup):
+    # name: StringProperty() -> Instantiated by default, the bone
+    threshold: bpy.props.FloatProperty(
+        name="threshold",
+        description="Vertices this bone weights at most this much are no collision vertices for it",
+        default=0.0,
+        min=0.0,
+        max=1.0,
+        precision=3,
+    )
+
+
+class SMP_tagPreset(PropertyGroup):
+    # name: StringProperty() -> Instantiated by default
+    tags: CollectionProperty(type=SMP_objectCollection)
+    tags_index: IntProperty()
+
+
 class SMP_OT_tagCollection(PropertyGroup):
     tag: bpy.props.StringProperty(default="collision_mesh", name="tag")
\ No newline at end of file
@@ -16,13 +16,26 @@
 # ##### END GPL LICENSE BLOCK #####
 # Copyright © 2023, OpheliaComplex.
 
-import bpy
-from bpy.props import (StringProperty, CollectionProperty, IntProperty, EnumProperty)
+try:
+    import bpy
+except ImportError:
+    # Imported outside of blender, e.g. to regenerate xmls from snapshots (SMPSnapshot.py).
+    # Only the bpy-free modules are usable then, there is nothing to register
+    bpy = None
 
-from SMPRigidBodies.SMP_UI import SMP_OT_actions_ncwt, SMP_OT_actions_cwt, SMP_OT_defaultTags_ncwt, \
-    SMP_OT_defaultTags_cwt,SMP_OT_tagCollection, SMP_UL_items, SMP_PT_CollisionPropertiesPanel,  SMP_objectCollection,\
-    SMP_Props_that_dont_exist_in_blender, RBBExtraProps
-from SMPRigidBodies.SMPExport import SMPExport
+if bpy is not None:
+    from bpy.props import (StringProperty, CollectionProperty, IntProperty, EnumProperty, FloatProperty,
+                           PointerProperty)
+
+    from SMPRigidBodies.SMP_UI import SMP_OT_actions_ncwt, SMP_OT_actions_cwt, SMP_OT_defaultTags_ncwt, \
+        SMP_OT_defaultTags_cwt,SMP_OT_tagCollection, SMP_UL_items, SMP_PT_CollisionPropertiesPanel,  SMP_objectCollection,\
+        SMP_Props_that_dont_exist_in_blender, RBBExtraProps, SMP_OT_analyzeCollisions, SMP_OT_batchTags, \
+        SMP_tagPreset, SMP_OT_tagPresetActions, SMP_PT_TagPresetsPanel, SMP_boneWeightThreshold, \
+        SMP_OT_boneWeightThresholdActions, SMP_OT_previewWeightThresholds, SMP_UL_weightThresholds, \
+        SMP_OT_collisionProxy
+    from SMPRigidBodies.SMPExport import SMPExport
+    from SMPRigidBodies.SMPImport import SMPImport
+    from SMPRigidBodies.SMPCache import register_handlers, unregister_handlers
 
 bl_info = {
     "name": "SMPRigidBodies",
@@ -36,24 +49,39 @@ bl_info = {
 #   Register & Unregister
 # -------------------------------------------------------------------
 
-classes = (
-    SMP_OT_actions_ncwt,
-    SMP_OT_defaultTags_ncwt,
-    SMP_OT_actions_cwt,
-    SMP_OT_defaultTags_cwt,
-    SMP_OT_tagCollection,
-    SMP_UL_items,
-    SMP_PT_CollisionPropertiesPanel,
-    SMP_objectCollection,
-    SMPExport,
-    SMP_Props_that_dont_exist_in_blender,
-    RBBExtraProps,
-)
+if bpy is not None:
+    classes = (
+        SMP_OT_actions_ncwt,
+        SMP_OT_defaultTags_ncwt,
+        SMP_OT_actions_cwt,
+        SMP_OT_defaultTags_cwt,
+        SMP_OT_tagCollection,
+        SMP_OT_analyzeCollisions,
+        SMP_OT_batchTags,
+        SMP_UL_items,
+        SMP_PT_CollisionPropertiesPanel,
+        SMP_objectCollection,
+        SMP_tagPreset,
+        SMP_OT_tagPresetActions,
+        SMP_PT_TagPresetsPanel,
+        SMP_boneWeightThreshold,
+        SMP_OT_boneWeightThresholdActions,
+        SMP_OT_previewWeightThresholds,
+        SMP_UL_weightThresholds,
+        SMP_OT_collisionProxy,
+        SMPExport,
+        SMPImport,
+        SMP_Props_that_dont_exist_in_blender,
+        RBBExtraProps,
+    )
 
 
 def SMP_menu_export(self, context):
     self.layout.operator(SMPExport.bl_idname, text="Skinned mesh physics (SMP) .xml")
 
+def SMP_menu_import(self, context):
+    self.layout.operator(SMPImport.bl_idname, text="Skinned mesh physics (SMP) .xml")
+
 def register():
 
     if not check_for_Rigid_Body_bones():
@@ -79,8 +107,25 @@ def register():
         ('private', "private", ""),
         ('internal', "internal", ""),
         ('external', "external", "")))
+    # Tag presets are stored once in the scene, objects refer to them by name. Blender can't store add-on
+    # properties for the whole .blend, every scene has its own presets and they can be copied to the others
+    bpy.types.Scene.smp_tag_presets = CollectionProperty(type=SMP_tagPreset)
+    bpy.types.Scene.smp_tag_presets_index = IntProperty()
+    bpy.types.Object.smp_no_collide_preset = StringProperty()
+    bpy.types.Object.smp_collide_preset = StringProperty()
+    bpy.types.Object.smp_weight_threshold = FloatProperty(
+        description="Per-vertex shapes only: vertices no bone weights above this are left out of the shape, "
+                    "0 keeps every weighted vertex",
+        default=0.0, min=0.0, max=1.0, precision=3)
+    bpy.types.Object.smp_bone_weight_thresholds = CollectionProperty(type=SMP_boneWeightThreshold)
+    bpy.types.Object.smp_bone_weight_thresholds_index = IntProperty()
+    # Set on collision meshes that are exported through a low poly proxy, see SMPProxy.py
+    bpy.types.Object.smp_collision_proxy = PointerProperty(type=bpy.types.Object)
     # Insert into export menu
     bpy.types.TOPBAR_MT_file_export.append(SMP_menu_export)
+    bpy.types.TOPBAR_MT_file_import.append(SMP_menu_import)
+    # Track changed objects for incremental exports
+    register_handlers()
 
 def unregister():
     from bpy.utils import unregister_class
@@ -94,8 +139,18 @@ def unregister():
     del bpy.types.Object.smp_tag
     del bpy.types.Object.smp_col_type
     del bpy.types.Object.smp_col_privacy
+    del bpy.types.Scene.smp_tag_presets
+    del bpy.types.Scene.smp_tag_presets_index
+    del bpy.types.Object.smp_no_collide_preset
+    del bpy.types.Object.smp_collide_preset
+    del bpy.types.Object.smp_weight_threshold
+    del bpy.types.Object.smp_bone_weight_thresholds
+    del bpy.types.Object.smp_bone_weight_thresholds_index
+    del bpy.types.Object.smp_collision_proxy
     # Remove from export menu
     bpy.types.TOPBAR_MT_file_export.remove(SMP_menu_export)
+    bpy.types.TOPBAR_MT_file_import.remove(SMP_menu_import)
+    unregister_handlers()
 
 def check_for_Rigid_Body_bones():
     # Check that Pauan's Rigid Body Bones addon is installed and enabled
@@ -0,0 +1,157 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENSE BLOCK #####
+# Copyright © 2023, OpheliaComplex.
+
+# Exporter benchmarks over synthetic scenes of growing size.
+#   python benchmarks/bench_export.py -o results.json                     (stand-ins, plain python)
+#   blender -b --python benchmarks/bench_export.py -- -o results.json     (real blender data)
+#   python benchmarks/bench_export.py --compare results.json              (fail on regressions)
+# Sizes are ARMATURESxBONESxCONSTRAINTSxMESHES, bones and constraints are per armature.
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import SMPRigidBodies
+from SMPRigidBodies.SMPUtils import parse_scene, generate_xml, write_xml, _constraint_templates, \
+    _generate_templated_constraints
+from SMPRigidBodies.SMPFormat import SMPFormat
+from benchmarks.synthetic_scene import make_spec, spec_counts, build_standin_scene, build_blender_scene
+
+try:
+    import bpy
+    IN_BLENDER = hasattr(bpy, "app")
+except ImportError:
+    IN_BLENDER = False
+
+DEFAULT_SIZES = ("1x10x10x5", "4x50x50x20", "16x100x120x80")
+
+def parse_size(size):
+    armatures, bones, constraints, meshes = (int(v) for v in size.split("x"))
+    return armatures, bones, constraints, meshes
+
+def measure(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {"min": min(times), "median": statistics.median(times), "max": max(times)}
+
+def constraints_batch(constraints):
+    # The constraint path of iter_xml: all constraints converted at once, then serialized
+    xml_format = SMPFormat()
+    templates, items = _constraint_templates(constraints, False, xml_format)
+    return list(_generate_templated_constraints(templates, items, xml_format))
+
+def bench_size(size, repeat, seed):
+    spec = make_spec(*parse_size(size), seed=seed)
+    scene = build_blender_scene(spec) if IN_BLENDER else build_standin_scene(spec)
+    scene_data = parse_scene(scene)
+
+    def each(records):
+        return lambda: [record.generate_string() for record in records]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        xml_path = os.path.join(tmp, "bench.xml")
+        timings = {
+            "parse_scene": measure(lambda: parse_scene(scene), repeat),
+            "generate_string.SMPStaticBones": measure(scene_data.statics.generate_string, repeat),
+            "generate_string.SMPKinematicBone": measure(each(scene_data.kinematics), repeat),
+            "generate_string.SMPCollisionShape": measure(each(scene_data.collision_meshes), repeat),
+            "generate_string.SMPGenericConstraint": measure(each(scene_data.constraints), repeat),
+            "constraints_batch": measure(lambda: constraints_batch(scene_data.constraints), repeat),
+            "generate_xml": measure(lambda: generate_xml(scene_data), repeat),
+            "write_xml": measure(lambda: write_xml(xml_path, scene_data), repeat),
+            "export": measure(lambda: generate_xml(scene), repeat),
+        }
+        xml_bytes = os.path.getsize(xml_path)
+
+    if IN_BLENDER:
+        bpy.data.scenes.remove(scene)
+    return {"size": size, "counts": spec_counts(spec), "xml_bytes": xml_bytes, "timings": timings}
+
+def compare(results, baseline, threshold):
+    # Median ratios against a previous run, returns the regressions
+    old = {r["size"]: r["timings"] for r in baseline["results"]}
+    regressions = []
+    for result in results["results"]:
+        if result["size"] not in old:
+            continue
+        for name, timing in result["timings"].items():
+            if name not in old[result["size"]]:
+                continue
+            ratio = timing["median"] / max(old[result["size"]][name]["median"], 1e-9)
+            flag = "REGRESSION" if ratio > threshold else ""
+            print(f"{result['size']:>18} {name:<40} {ratio:6.2f}x {flag}")
+            if flag:
+                regressions.append((result["size"], name, ratio))
+    return regressions
+
+def main(argv=None):
+    if argv is None:
+        # blender passes its own arguments, ours come after '--'
+        argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+    parser = argparse.ArgumentParser(description="Benchmark parse_scene and generate_xml on synthetic scenes")
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES,
+                        help="ARMATURESxBONESxCONSTRAINTSxMESHES, default: %(default)s")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="write the results as json")
+    parser.add_argument("--compare", help="json of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="median slowdown that counts as a regression, default: %(default)s")
+    args = parser.parse_args(argv)
+
+    results = {
+        "meta": {
+            "backend": "blender" if IN_BLENDER else "standins",
+            "blender": bpy.app.version_string if IN_BLENDER else None,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "repeat": args.repeat,
+            "seed": args.seed,
+        },
+        "results": [],
+    }
+    for size in args.sizes:
+        result = bench_size(size, args.repeat, args.seed)
+        results["results"].append(result)
+        print(f"{size}: {result['counts']}, {result['xml_bytes']} bytes")
+        for name, timing in result["timings"].items():
+            print(f"    {name:<40} {timing['median'] * 1000:10.3f} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
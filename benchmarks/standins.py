@@ -0,0 +1,67 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENSE BLOCK #####
+# Copyright © 2023, OpheliaComplex.
+
+# Lightweight stand-ins for the blender data parse_scene reads, so the benchmarks also run in plain python.
+# Only attribute access is emulated, no RNA behaviour. mathutils isn't needed, the exporter doesn't use it.
+# Import SMPRigidBodies before install(), the add-on's __init__ must see that the real bpy is missing.
+
+import itertools
+import sys
+import types
+
+_pointers = itertools.count(1)
+
+class StandinCollectionProp(list):
+    """bpy_prop_collection: a list that can also be indexed by name"""
+
+    def get(self, key, default=None):
+        for item in self:
+            if item.name == key:
+                return item
+        return default
+
+    def keys(self):
+        return [item.name for item in self]
+
+
+class StandinID():
+    def __init__(self, name, **props):
+        self.name = name
+        self._pointer = next(_pointers)
+        self.__dict__.update(props)
+
+    def as_pointer(self):
+        return self._pointer
+
+
+class StandinObject(StandinID):
+    def __init__(self, name, rigid_body=None, rigid_body_constraint=None, **props):
+        super().__init__(name, rigid_body=rigid_body, rigid_body_constraint=rigid_body_constraint, **props)
+
+
+class StandinCollection(StandinID):
+    def __init__(self, name, objects=(), children=()):
+        super().__init__(name, objects=StandinCollectionProp(objects), children=StandinCollectionProp(children))
+
+
+def install(armatures):
+    # Put a minimal bpy module in place, bpy.data.armatures is the only thing parse_scene asks bpy for
+    bpy = types.ModuleType("bpy")
+    bpy.data = types.SimpleNamespace(armatures=StandinCollectionProp(armatures))
+    sys.modules["bpy"] = bpy
+    return bpy
@@ -0,0 +1,260 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END GPL LICENSE BLOCK #####
+# Copyright © 2023, OpheliaComplex.
+
+# Synthetic Rigid Body Bones style scenes for the benchmarks. A scene is first described as plain data by
+# make_spec, then built either from stand-ins (build_standin_scene) or as real blender data (build_blender_scene).
+#
+# Every armature gets a [Container] with a [Passives] root, a chain of [Active] bones and [Joints] joining the
+# chain, plus random extra joints if there are more constraints than bones. Collision meshes are spread over
+# nested collections, every tenth one is also linked into a second collection.
+
+import random
+
+TAGS = ("body", "hair", "hands", "head", "skirt", "cape")
+
+def _axis_props(rnd, use_prefix, value_names):
+    props = {}
+    for axis in "xyz":
+        props[use_prefix.format(axis)] = rnd.random() < 0.7
+        for name, low, high in value_names:
+            props[name.format(axis)] = rnd.uniform(low, high)
+    return props
+
+def make_spec(armatures, bones, constraints, meshes, seed=0):
+    rnd = random.Random(seed)
+    spec = {"armatures": [], "meshes": []}
+    for a in range(armatures):
+        arma_name = f"Armature{a}"
+        root = f"{arma_name}_root"
+        bone_specs = []
+        for b in range(bones):
+            bone_specs.append({
+                "name": f"{arma_name}_bone{b}",
+                "mass": rnd.choice((0.5, 1.0, 1.0, 2.0)),
+                "linear_damping": rnd.choice((0.2, 0.5)),
+                "angular_damping": rnd.choice((0.1, 0.5)),
+                "friction": 0.5,
+                "restitution": 0.0,
+                "inertia": 1.0,
+                "gravity_factor": rnd.choice((1.0, 1.0, 0.5)),
+                "rolling_friction": 0.0,
+                "margin_multiplier": 1.0,
+            })
+        names = [root] + [bone["name"] for bone in bone_specs]
+        constraint_specs = []
+        for c in range(constraints):
+            if c < bones:
+                body_a, body_b = names[c], names[c + 1]
+            else:
+                body_a, body_b = rnd.sample(names, 2)
+            props = {}
+            props.update(_axis_props(rnd, "use_limit_lin_{}", (("limit_lin_{}_lower", -0.2, 0.0),
+                                                               ("limit_lin_{}_upper", 0.0, 0.2))))
+            props.update(_axis_props(rnd, "use_limit_ang_{}", (("limit_ang_{}_lower", -1.0, 0.0),
+                                                               ("limit_ang_{}_upper", 0.0, 1.0))))
+            props.update(_axis_props(rnd, "use_spring_{}", (("spring_stiffness_{}", 0.0, 100.0),
+                                                            ("spring_damping_{}", 0.0, 1.0))))
+            props.update(_axis_props(rnd, "use_spring_ang_{}", (("spring_stiffness_ang_{}", 0.0, 100.0),
+                                                                ("spring_damping_ang_{}", 0.0, 1.0))))
+            constraint_specs.append({"name": f"{arma_name}_joint{c}", "bodyA": body_a, "bodyB": body_b,
+                                     "props": props})
+        spec["armatures"].append({"name": arma_name, "statics": [root], "bones": bone_specs,
+                                  "constraints": constraint_specs})
+    for m in range(meshes):
+        spec["meshes"].append({
+            "name": f"CollisionMesh{m}",
+            "collection": f"Collisions{m % 4}",
+            "also_in": f"Collisions{(m + 1) % 4}" if m % 10 == 0 else None,
+            "margin": 0.1,
+            "smp_tag": rnd.choice(TAGS),
+            "smp_col_type": rnd.choice(("vertex", "triangle")),
+            "smp_col_privacy": rnd.choice(("public", "private", "internal")),
+            "no_collide_with_tags": rnd.sample(TAGS, rnd.randint(0, 3)),
+            "collide_with_tags": [],
+        })
+    return spec
+
+def spec_counts(spec):
+    return {
+        "armatures": len(spec["armatures"]),
+        "bones": sum(len(a["bones"]) for a in spec["armatures"]),
+        "constraints": sum(len(a["constraints"]) for a in spec["armatures"]),
+        "meshes": len(spec["meshes"]),
+    }
+
+def _collision_collections(spec, make_collection):
+    # Two levels deep: "Collisions" > "CollisionsN"
+    names = sorted({m["collection"] for m in spec["meshes"]} |
+                   {m["also_in"] for m in spec["meshes"] if m["also_in"]})
+    return {name: make_collection(name) for name in names}
+
+# -------------------------------------------------------------------
+#   Stand-ins
+# -------------------------------------------------------------------
+
+def build_standin_scene(spec):
+    # Returns the scene, installs a stand-in bpy holding the armatures
+    from types import SimpleNamespace
+    from benchmarks.standins import StandinObject, StandinCollection, StandinCollectionProp, StandinID, install
+
+    containers = []
+    armatures = []
+    for arma in spec["armatures"]:
+        objects = {}
+        passives = []
+        for name in arma["statics"]:
+            objects[name] = StandinObject(name + " [Passive]", rigid_body=SimpleNamespace(type="PASSIVE"))
+            passives.append(objects[name])
+        actives = []
+        bones = []
+        for bone in arma["bones"]:
+            rigid_body = SimpleNamespace(type="ACTIVE", mass=bone["mass"], linear_damping=bone["linear_damping"],
+                                         angular_damping=bone["angular_damping"], friction=bone["friction"],
+                                         restitution=bone["restitution"])
+            objects[bone["name"]] = StandinObject(bone["name"] + " [Active]", rigid_body=rigid_body)
+            actives.append(objects[bone["name"]])
+            extra = SimpleNamespace(inertia=bone["inertia"], gravity_factor=bone["gravity_factor"],
+                                    rolling_friction=bone["rolling_friction"],
+                                    margin_multiplier=bone["margin_multiplier"])
+            bones.append(StandinID(bone["name"], rigid_body_bones_extra_props=extra))
+        joints = []
+        for constraint in arma["constraints"]:
+            rbc = SimpleNamespace(object1=objects[constraint["bodyA"]], object2=objects[constraint["bodyB"]],
+                                  **constraint["props"])
+            joints.append(StandinObject(constraint["name"] + " [Joint]", rigid_body_constraint=rbc))
+        containers.append(StandinCollection(arma["name"] + " [Container]", children=[
+            StandinCollection(arma["name"] + " [Passives]", passives),
+            StandinCollection(arma["name"] + " [Actives]", actives),
+            StandinCollection(arma["name"] + " [Joints]", joints),
+        ]))
+        armatures.append(StandinID(arma["name"], bones=StandinCollectionProp(bones)))
+
+    collections = _collision_collections(spec, StandinCollection)
+    for mesh in spec["meshes"]:
+        obj = StandinObject(mesh["name"],
+                            rigid_body=SimpleNamespace(type="PASSIVE", collision_margin=mesh["margin"]),
+                            smp_tag=mesh["smp_tag"], smp_col_type=mesh["smp_col_type"],
+                            smp_col_privacy=mesh["smp_col_privacy"], smp_no_collide_preset="", smp_collide_preset="",
+                            smp_weight_threshold=0.0, smp_bone_weight_thresholds=[], smp_collision_proxy=None,
+                            no_collide_with_tags=[SimpleNamespace(name=t) for t in mesh["no_collide_with_tags"]],
+                            collide_with_tags=[SimpleNamespace(name=t) for t in mesh["collide_with_tags"]])
+        collections[mesh["collection"]].objects.append(obj)
+        if mesh["also_in"]:
+            collections[mesh["also_in"]].objects.append(obj)
+
+    install(armatures)
+    top = StandinCollection("Scene Collection", children=[
+        StandinCollection("RigidBodyBones", children=containers),
+        StandinCollection("Collisions", children=list(collections.values())),
+    ])
+    return SimpleNamespace(name="Synthetic", collection=top, smp_tag_presets=[])
+
+# -------------------------------------------------------------------
+#   Blender
+# -------------------------------------------------------------------
+
+def _cube_mesh(bpy):
+    mesh = bpy.data.meshes.new("SMPBenchCube")
+    verts = [(x, y, z) for x in (-0.1, 0.1) for y in (-0.1, 0.1) for z in (-0.1, 0.1)]
+    faces = [(0, 1, 3, 2), (4, 6, 7, 5), (0, 4, 5, 1), (2, 3, 7, 6), (0, 2, 6, 4), (1, 5, 7, 3)]
+    mesh.from_pydata(verts, [], faces)
+    return mesh
+
+def _with_object(bpy, obj, operator, **kwargs):
+    with bpy.context.temp_override(object=obj, active_object=obj, selected_objects=[obj],
+                                   selected_editable_objects=[obj]):
+        operator(**kwargs)
+
+def build_blender_scene(spec):
+    # Needs blender 3.2+ (context.temp_override) with SMPRigidBodies enabled for the bone extra props.
+    # Builds into a new scene so the current one is left alone
+    import bpy
+
+    scene = bpy.data.scenes.new("SMPBenchmark")
+    cube = _cube_mesh(bpy)
+
+    def new_collection(name, parent):
+        collection = bpy.data.collections.new(name)
+        parent.children.link(collection)
+        return collection
+
+    def new_object(name, collection, data=None):
+        obj = bpy.data.objects.new(name, data)
+        collection.objects.link(obj)
+        return obj
+
+    with bpy.context.temp_override(scene=scene, view_layer=scene.view_layers[0]):
+        rigid_body_bones = new_collection("RigidBodyBones", scene.collection)
+        for arma in spec["armatures"]:
+            armature = bpy.data.armatures.new(arma["name"])
+            arma_obj = new_object(arma["name"], scene.collection, armature)
+            _with_object(bpy, arma_obj, bpy.ops.object.mode_set, mode="EDIT")
+            for i, bone in enumerate(arma["bones"]):
+                edit_bone = armature.edit_bones.new(bone["name"])
+                edit_bone.head = (0.0, 0.0, i * 0.1)
+                edit_bone.tail = (0.0, 0.0, (i + 1) * 0.1)
+            _with_object(bpy, arma_obj, bpy.ops.object.mode_set, mode="OBJECT")
+            for bone in arma["bones"]:
+                extra = armature.bones[bone["name"]].rigid_body_bones_extra_props
+                extra.inertia = bone["inertia"]
+                extra.gravity_factor = bone["gravity_factor"]
+                extra.rolling_friction = bone["rolling_friction"]
+                extra.margin_multiplier = bone["margin_multiplier"]
+
+            container = new_collection(arma["name"] + " [Container]", rigid_body_bones)
+            passives = new_collection(arma["name"] + " [Passives]", container)
+            actives = new_collection(arma["name"] + " [Actives]", container)
+            joints = new_collection(arma["name"] + " [Joints]", container)
+            objects = {}
+            for name in arma["statics"]:
+                objects[name] = new_object(name + " [Passive]", passives, cube)
+                _with_object(bpy, objects[name], bpy.ops.rigidbody.object_add, type="PASSIVE")
+            for bone in arma["bones"]:
+                obj = objects[bone["name"]] = new_object(bone["name"] + " [Active]", actives, cube)
+                _with_object(bpy, obj, bpy.ops.rigidbody.object_add, type="ACTIVE")
+                rigid_body = obj.rigid_body
+                rigid_body.mass = bone["mass"]
+                rigid_body.linear_damping = bone["linear_damping"]
+                rigid_body.angular_damping = bone["angular_damping"]
+                rigid_body.friction = bone["friction"]
+                rigid_body.restitution = bone["restitution"]
+            for constraint in arma["constraints"]:
+                obj = new_object(constraint["name"] + " [Joint]", joints)
+                _with_object(bpy, obj, bpy.ops.rigidbody.constraint_add, type="GENERIC_SPRING")
+                rbc = obj.rigid_body_constraint
+                rbc.object1 = objects[constraint["bodyA"]]
+                rbc.object2 = objects[constraint["bodyB"]]
+                for prop, value in constraint["props"].items():
+                    setattr(rbc, prop, value)
+
+        collisions = new_collection("Collisions", scene.collection)
+        collections = _collision_collections(spec, lambda name: new_collection(name, collisions))
+        for mesh in spec["meshes"]:
+            obj = new_object(mesh["name"], collections[mesh["collection"]], cube)
+            if mesh["also_in"]:
+                collections[mesh["also_in"]].objects.link(obj)
+            _with_object(bpy, obj, bpy.ops.rigidbody.object_add, type="PASSIVE")
+            obj.rigid_body.collision_margin = mesh["margin"]
+            obj.smp_tag = mesh["smp_tag"]
+            obj.smp_col_type = mesh["smp_col_type"]
+            obj.smp_col_privacy = mesh["smp_col_privacy"]
+            for tag in mesh["no_collide_with_tags"]:
+                obj.no_collide_with_tags.add().name = tag
+            for tag in mesh["collide_with_tags"]:
+                obj.collide_with_tags.add().name = tag
+    return scene